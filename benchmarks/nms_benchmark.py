@@ -0,0 +1,54 @@
+"""Micro-benchmark of the NumPy and TensorFlow NMS paths of the ObjectDetector
+
+Run from the repository root with: python -m benchmarks.nms_benchmark
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from rushb.vision.boxes import non_max_suppression
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+
+def random_detections(count: int, num_classes: int, seed: int = 0) -> tuple:
+    """Random normalized boxes, scores and class ids like the ones of an SSD model"""
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 1, size=(count, 2, 2)).astype(np.float32)
+    boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    scores = rng.uniform(0, 1, size=count).astype(np.float32)
+    class_ids = rng.integers(1, num_classes + 1, size=count).astype(np.int32)
+    return boxes, scores, class_ids
+
+
+def time_call(function, repeat: int) -> float:
+    """Best time of a call in microseconds"""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-repeat", metavar="--repeat", type=int, default=200, help="Timed calls per case")
+    parser.add_argument("-max_detections", metavar="--max_detections", type=int, default=50)
+    parser.add_argument("-iou_threshold", metavar="--iou_threshold", type=float, default=0.5)
+    parser.add_argument("-confidence_threshold", metavar="--confidence_threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"{'boxes':>6} {'numpy us':>10} {'numpy class aware us':>21} {'tf us':>10}")
+    for count in (100, 1000):
+        boxes, scores, class_ids = random_detections(count, num_classes=90)
+        nms_args = (boxes, scores, args.max_detections, args.iou_threshold, args.confidence_threshold)
+
+        numpy_time = time_call(lambda: non_max_suppression(*nms_args), args.repeat)
+        class_aware_time = time_call(lambda: non_max_suppression(*nms_args, class_ids), args.repeat)
+
+        # The TF path also pays for moving the arrays into tensors and the result back
+        tf_time = float("nan")
+        if tf is not None:
+            tf_time = time_call(lambda: tf.image.non_max_suppression(*nms_args).numpy(), args.repeat)
+
+        print(f"{count:>6} {numpy_time:>10.1f} {class_aware_time:>21.1f} {tf_time:>10.1f}")
@@ -0,0 +1,319 @@
+"""Offline benchmark of the module pipeline with synthetic stand-ins for the hardware.
+
+The active modules of the configuration file are run by a ModuleManger with
+every scheduler type, after replacing what needs hardware:
+- VideoCapture is a SyntheticVideoCapture of the same frame size
+- KeyboardControls and JoyStickControls are ScriptedControls
+- SerialWriter and SerialReader write to and read from a pty
+- VideoViewer is left out, it needs a display
+- The connection only publishes, to a subscriber on localhost
+
+For every scheduler the loop rate, the step rate and times of every module,
+the latencies, the bytes on the wire and the memory growth are reported and
+written to a JSON file. Pass an earlier result file as baseline to fail on
+regressions.
+
+Run from the repository root with: python -m benchmarks.pipeline_benchmark
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+# Serial modules write to a pty, which only exists on POSIX
+try:
+    import pty
+    import tty
+except ImportError:
+    pty = None
+
+from rushb.connection.connection import Connection
+from rushb.metrics import metrics
+from rushb.modulemanager.module_manager import ModuleManger
+
+# Modules replaced by a synthetic stand-in of the same rate
+STAND_INS = {
+    "VideoCapture": lambda module: {"module_name": "synthetic", "module_class": "SyntheticVideoCapture",
+                                    "width": module.get("width", 640), "height": module.get("height", 480)},
+    "KeyboardControls": lambda module: {"module_name": "synthetic", "module_class": "ScriptedControls"},
+    "JoyStickControls": lambda module: {"module_name": "synthetic", "module_class": "ScriptedControls"},
+}
+
+# Modules that cannot run without a display
+HEADLESS_SKIPPED = ("VideoViewer",)
+
+SCHEDULER_TYPES = ("SEQUENTIAL", "THREADED", "ASYNC")
+
+
+class PtyDrain(threading.Thread):
+    """PtyDrain opens a pty for a serial module and counts the bytes written to it"""
+
+    def __init__(self) -> None:
+        super().__init__(name="PtyDrain", daemon=True)
+        self.master, self.slave = pty.openpty()
+        # Raw mode, the line discipline would otherwise echo and translate the binary frames
+        tty.setraw(self.slave)
+        self.port: str = os.ttyname(self.slave)
+        self.bytes: int = 0
+        self.running: bool = True
+
+    def run(self) -> None:
+        while self.running:
+            try:
+                self.bytes += len(os.read(self.master, 4096))
+            except OSError:
+                return
+
+    def stop(self) -> None:
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class LoopbackSubscriber(threading.Thread):
+    """LoopbackSubscriber receives everything the pipeline publishes, which
+    records the received bytes and the transport latencies"""
+
+    def __init__(self, connection_config: dict) -> None:
+        super().__init__(name="LoopbackSubscriber", daemon=True)
+        self.connection: Connection = Connection(**{**connection_config, "connection_type": "SUB",
+                                                    "recv_timeout": 100})
+        self.connection.init()
+        self.running: bool = True
+
+    def run(self) -> None:
+        while self.running:
+            self.connection.recv()
+
+    def stop(self) -> None:
+        self.running = False
+        self.join()
+        self.connection.deinit()
+
+
+def bench_config(config: dict, scheduler_type: str, port: int, activate: list, drains: list, directory: str) -> dict:
+    """Copy of the configuration with the stand-ins, a loopback connection and the given scheduler"""
+    config = copy.deepcopy(config)
+    config["Connection"] = {**config.get("Connection", {}), "connection_type": "PUB", "pub_port": port,
+                            "sub_port": port, "sub_host": "localhost"}
+    config["Scheduler"] = {**config.get("Scheduler", {}), "scheduler_type": scheduler_type}
+
+    modules = []
+    for module in config["Modules"]:
+        module_class = module["module_class"]
+        if not (module["active"] or module_class in activate) or module_class in HEADLESS_SKIPPED:
+            continue
+        module = {**module, "active": True}
+        if module_class in STAND_INS:
+            module = {"active": True, "rate_hz": module.get("rate_hz"), **STAND_INS[module_class](module)}
+            if module["rate_hz"] is None:
+                del module["rate_hz"]
+        elif module_class in ("SerialWriter", "SerialReader"):
+            if pty is None:
+                logging.warning(f"Leaving out {module_class}, there are no ptys on this platform")
+                continue
+            drain = PtyDrain()
+            drains.append(drain)
+            module["port"] = drain.port
+        elif module_class == "Recorder":
+            module["path"] = os.path.join(directory, f"{scheduler_type}.rblog")
+            module["overwrite"] = True
+        modules.append(module)
+
+    config["Modules"] = modules
+    return config
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process, the peak where the current one is not available"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_pipeline(config: dict, duration: float, warmup: float, directory: str) -> dict:
+    """Run a configuration for the duration and summarize its metrics"""
+    cfg_path = os.path.join(directory, "modules.yml")
+    with open(cfg_path, "w") as cfg_file:
+        yaml.safe_dump(config, cfg_file)
+
+    with metrics.registry_lock:
+        metrics.histograms.clear()
+        metrics.counters.clear()
+
+    manager = ModuleManger(cfg_path)
+    if not manager.init():
+        raise RuntimeError("Failed to initialize the modules")
+    subscriber = LoopbackSubscriber(config["Connection"])
+    subscriber.start()
+
+    # Sample the memory once the pipeline warmed up, to leave out the allocations of the first steps
+    samples = {}
+    threading.Timer(warmup, lambda: samples.update(start=sample())).start()
+    threading.Timer(warmup + duration, manager.scheduler.stop_event.set).start()
+    succeeded = manager.run()
+    end = sample()
+    subscriber.stop()
+    manager.deinit()
+    manager.connection.deinit()
+    if not succeeded:
+        raise RuntimeError("The pipeline failed while running")
+
+    return summarize(samples["start"], end)
+
+
+def sample() -> tuple:
+    return time.perf_counter(), rss_bytes(), metrics.snapshot()
+
+
+def summarize(start: tuple, end: tuple) -> dict:
+    """Rates, times and bytes between the start and end snapshots of the metrics"""
+    (start_time, start_rss, start_metrics), (end_time, end_rss, end_metrics) = start, end
+    elapsed = end_time - start_time
+
+    def rate(name: str) -> float:
+        count = end_metrics["histograms"].get(name, {}).get("count", 0)
+        return (count - start_metrics["histograms"].get(name, {}).get("count", 0)) / elapsed
+
+    def percentiles(name: str) -> dict:
+        summary = end_metrics["histograms"][name]
+        return {key: summary[key] for key in ("mean", "p50", "p95", "p99", "max") if key in summary}
+
+    histograms = end_metrics["histograms"]
+    modules = {}
+    for name in histograms:
+        if name.startswith("module.") and name.endswith(".step"):
+            modules[name[len("module."):-len(".step")]] = {"hz": rate(name), "step_ms": percentiles(name)}
+
+    wire_bytes = {}
+    for name, entry in end_metrics["counters"].items():
+        if name.endswith("_bytes"):
+            wire_bytes[name] = (entry["value"] - start_metrics["counters"].get(name, {}).get("value", 0)) / elapsed
+
+    return {
+        "loop_hz": rate("loop.jitter"),
+        "loop_jitter_ms": percentiles("loop.jitter") if "loop.jitter" in histograms else {},
+        "loop_overruns": end_metrics["counters"].get("loop.overruns", {}).get("value", 0),
+        "modules": modules,
+        "latency_ms": {name: percentiles(name) for name in histograms if name.startswith("latency.")},
+        "bytes_per_s": wire_bytes,
+        "rss_start_bytes": start_rss,
+        "rss_growth_bytes": end_rss - start_rss,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of the loop and module rates and the module step times beyond the tolerance"""
+    regressions = []
+    for scheduler_type, result in results["results"].items():
+        base = baseline["results"].get(scheduler_type)
+        if base is None:
+            continue
+        if result["loop_hz"] < base["loop_hz"] * (1 - tolerance):
+            regressions.append(f"{scheduler_type} loop rate {result['loop_hz']:.1f} Hz, was {base['loop_hz']:.1f} Hz")
+        for name, module in result["modules"].items():
+            base_module = base["modules"].get(name)
+            if base_module is None:
+                continue
+            if module["hz"] < base_module["hz"] * (1 - tolerance):
+                regressions.append(f"{scheduler_type} {name} rate {module['hz']:.1f} Hz, "
+                                   f"was {base_module['hz']:.1f} Hz")
+            p95, base_p95 = module["step_ms"].get("p95"), base_module["step_ms"].get("p95")
+            if p95 is not None and base_p95 is not None and p95 > base_p95 * (1 + tolerance):
+                regressions.append(f"{scheduler_type} {name} step p95 {p95:.3f} ms, was {base_p95:.3f} ms")
+    return regressions
+
+
+def report(scheduler_type: str, result: dict) -> None:
+    print(f"{scheduler_type}: loop {result['loop_hz']:.1f} Hz, {result['loop_overruns']:.0f} overruns, "
+          f"memory {result['rss_growth_bytes'] / 1024:+.0f} KiB")
+    for name, module in sorted(result["modules"].items()):
+        step = module["step_ms"]
+        print(f"  {name:<24} {module['hz']:>8.1f} Hz  step p50 {step.get('p50', 0):.3f} ms "
+              f"p95 {step.get('p95', 0):.3f} ms")
+    for name, latency in sorted(result["latency_ms"].items()):
+        print(f"  {name:<40} p50 {latency.get('p50', 0):.3f} ms p95 {latency.get('p95', 0):.3f} ms")
+    for name, rate in sorted(result["bytes_per_s"].items()):
+        print(f"  {name:<40} {rate / 1024:>10.1f} KiB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-cfg", metavar="--cfg", type=str, default="modules.yml", help="Module configuration file")
+    parser.add_argument("-schedulers", metavar="--schedulers", nargs="+", default=list(SCHEDULER_TYPES),
+                        choices=SCHEDULER_TYPES)
+    parser.add_argument("-duration", metavar="--duration", type=float, default=5.0,
+                        help="Seconds measured per scheduler")
+    parser.add_argument("-warmup", metavar="--warmup", type=float, default=1.0,
+                        help="Seconds run before measuring")
+    parser.add_argument("-activate", metavar="--activate", nargs="*", default=["KeyboardControls", "SerialWriter"],
+                        help="Module classes to run even if they are not active in the configuration")
+    parser.add_argument("-port", metavar="--port", type=int, default=5850, help="Base port of the loopback")
+    parser.add_argument("-output", metavar="--output", type=str, default=None,
+                        help="File the results are written to as JSON, to compare against later runs")
+    parser.add_argument("-baseline", metavar="--baseline", type=str, default=None,
+                        help="Earlier result file to compare against")
+    parser.add_argument("-tolerance", metavar="--tolerance", type=float, default=0.2,
+                        help="Relative change counted as a regression")
+    parser.add_argument("-loglevel", metavar="--loglevel", type=int, default=3, help="Loglevel [0,5]")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.loglevel * 10, format="{asctime} {levelname:<8} {message}", style="{")
+    metrics.enable()
+
+    with open(args.cfg) as stream:
+        config = yaml.safe_load(stream)
+
+    results = {"revision": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+               "time": time.time(), "cfg": args.cfg, "duration": args.duration, "results": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for index, scheduler_type in enumerate(args.schedulers):
+            drains = []
+            # Every run binds new ports, the previous sockets may still be lingering
+            run_config = bench_config(config, scheduler_type, args.port + index * 10, args.activate, drains,
+                                      directory)
+            for drain in drains:
+                drain.start()
+            try:
+                result = run_pipeline(run_config, args.duration, args.warmup, directory)
+            finally:
+                for drain in drains:
+                    drain.stop()
+            # The pty is drained from the start, including the warmup
+            result["bytes_per_s"].update({f"serial.{i}.written_bytes": drain.bytes / (args.warmup + args.duration)
+                                          for i, drain in enumerate(drains)})
+            results["results"][scheduler_type] = result
+            report(scheduler_type, result)
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as stream:
+            regressions = compare(results, json.load(stream), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,125 @@
+"""Intra-host benchmark of handing video frames to another process through the
+ProcessSharedMem frame ring and through the Connection PUB/SUB sockets.
+
+A consumer process acknowledges every frame by publishing its index as a servo
+value, the producer times the round trip of frame and acknowledgement.
+
+Run from the repository root with: python -m benchmarks.shared_mem_benchmark
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from rushb.connection.connection import Connection
+from rushb.sharedmem.process_shared_mem import ProcessSharedMem
+from rushb.sharedmem.shared_mem import ServoVals, SharedMem
+
+# Both directions carry the video and servo topics, each side only sends what changed
+TOPICS = {"servo": None, "video": None}
+
+# The shared memory side polls for changes, sleeping yields the core to the other process in between
+POLL_PERIOD = 0
+
+
+def shared_mem_consumer(attach_args: dict) -> None:
+    """Acknowledge every new frame until the producer terminates the process"""
+    shared_mem = ProcessSharedMem(**attach_args)
+    seq = 0
+    while True:
+        frame, frame_seq, _ = shared_mem.read("video_frame")
+        if frame_seq != seq:
+            seq = frame_seq
+            shared_mem.servo_vals = ServoVals([int(frame[0, 0, 0]), 0, 0])
+        else:
+            time.sleep(POLL_PERIOD)
+
+
+def connection_consumer(port: int) -> None:
+    """Acknowledge every received frame until the producer terminates the process"""
+    connection = Connection(connection_type="PUBSUB", pub_port=port + 10, sub_port=port, sub_host="localhost",
+                            topics=TOPICS, recv_timeout=1000)
+    connection.init()
+    shared_mem = SharedMem()
+    while True:
+        frame = connection.recv().get("video_frame")
+        if frame is not None:
+            shared_mem.servo_vals = ServoVals([int(frame[0, 0, 0]), 0, 0])
+            connection.send(shared_mem)
+
+
+def time_shared_mem(frame: np.ndarray, frames: int) -> list:
+    shared_mem = ProcessSharedMem(name="rushb_benchmark", frame_shape=frame.shape)
+    consumer = multiprocessing.Process(target=shared_mem_consumer, args=(shared_mem.attach_args(),), daemon=True)
+    consumer.start()
+
+    round_trips = []
+    for index in range(frames):
+        frame[0, 0, 0] = index % 250
+        start = time.perf_counter()
+        shared_mem.video_frame = frame
+        while shared_mem.servo_vals.values[0] != index % 250:
+            time.sleep(POLL_PERIOD)
+        round_trips.append(time.perf_counter() - start)
+
+    consumer.terminate()
+    shared_mem.close()
+    return round_trips
+
+
+def time_connection(frame: np.ndarray, frames: int, port: int) -> list:
+    connection = Connection(connection_type="PUBSUB", pub_port=port, sub_port=port + 10, sub_host="localhost",
+                            topics=TOPICS, recv_timeout=1000)
+    connection.init()
+    consumer = multiprocessing.Process(target=connection_consumer, args=(port,), daemon=True)
+    consumer.start()
+    shared_mem = SharedMem()
+
+    # Resend a frame until the consumer acknowledges it, the subscriptions take a moment to connect
+    frame[0, 0, 0] = 255
+    shared_mem.video_frame = frame
+    while not acknowledged(connection, 255):
+        shared_mem.video_frame = frame
+        connection.send(shared_mem)
+
+    round_trips = []
+    for index in range(frames):
+        frame[0, 0, 0] = index % 250
+        start = time.perf_counter()
+        shared_mem.video_frame = frame
+        connection.send(shared_mem)
+        while not acknowledged(connection, index % 250):
+            pass
+        round_trips.append(time.perf_counter() - start)
+
+    consumer.terminate()
+    connection.deinit()
+    return round_trips
+
+
+def acknowledged(connection: Connection, marker: int) -> bool:
+    servo_vals = connection.recv().get("servo_vals")
+    return servo_vals is not None and servo_vals.values[0] == marker
+
+
+def report(name: str, round_trips: list) -> None:
+    round_trips = np.array(round_trips) * 1e6
+    print(f"{name:>12} {np.mean(round_trips):>10.1f} {np.percentile(round_trips, 50):>10.1f} "
+          f"{np.percentile(round_trips, 99):>10.1f} {1e6 / np.mean(round_trips):>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-frames", metavar="--frames", type=int, default=500, help="Frames sent per path")
+    parser.add_argument("-width", metavar="--width", type=int, default=640)
+    parser.add_argument("-height", metavar="--height", type=int, default=480)
+    parser.add_argument("-port", metavar="--port", type=int, default=5750, help="Base port of the PUB/SUB path")
+    args = parser.parse_args()
+
+    frame = np.random.default_rng(0).integers(0, 256, size=(args.height, args.width, 3), dtype=np.uint8)
+
+    print(f"{args.frames} frames of {args.width}x{args.height}x3")
+    print(f"{'path':>12} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'frames/s':>10}")
+    report("shared_mem", time_shared_mem(frame, args.frames))
+    report("pub/sub", time_connection(frame, args.frames, args.port))
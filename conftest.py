@@ -0,0 +1 @@
+# Makes the rushb package in this directory importable from the tests when running pytest
@@ -1,4 +1,10 @@
+import time
+
+# Taken before the imports, they are part of the startup time
+process_start = time.perf_counter()
+
 from rushb.modulemanager.module_manager import ModuleManger
+from rushb.metrics import metrics
 
 import argparse
 import os
@@ -22,6 +28,32 @@ if __name__ == "__main__":
         default=default_cfg_file,
         help="Module configuration file")
 
+    parser.add_argument(
+        "-metrics",
+        action="store_true",
+        help="Record module step times, loop rate and connection metrics")
+
+    parser.add_argument(
+        "-metrics_interval",
+        metavar="--metrics_interval",
+        type=float,
+        default=10.0,
+        help="Seconds between metric exports")
+
+    parser.add_argument(
+        "-metrics_file",
+        metavar="--metrics_file",
+        type=str,
+        default=None,
+        help="JSON file the metrics are written to on every export")
+
+    parser.add_argument(
+        "-metrics_port",
+        metavar="--metrics_port",
+        type=int,
+        default=None,
+        help="Local port the metrics are served on as JSON")
+
     args = parser.parse_args()
 
     filename = "%slog" % __file__[:-2]
@@ -36,7 +68,20 @@ if __name__ == "__main__":
         ]
     ),
 
+    # Without the flag the instrumentation is skipped entirely
+    metrics_exporter = None
+    if args.metrics:
+        metrics.enable()
+        metrics_exporter = metrics.MetricsExporter(args.metrics_interval, args.metrics_file, args.metrics_port)
+        metrics_exporter.start()
+
+    imports_time = time.perf_counter() - process_start
     module_manager = ModuleManger(args.cfg)
-    module_manager.init()
-    module_manager.run()
+    # The modules that did initialize are still deinitialized when others failed
+    if module_manager.init():
+        logging.info(f"Started in {time.perf_counter() - process_start:.3f} s, {imports_time:.3f} s of it importing")
+        module_manager.run()
     module_manager.deinit()
+
+    if metrics_exporter is not None:
+        metrics_exporter.stop()
@@ -0,0 +1,162 @@
+import struct
+
+import cv2
+import numpy as np
+import zmq
+
+from enum import IntEnum
+from rushb.sharedmem.shared_mem import *
+
+# Wire format version, bumped whenever a header layout changes
+WIRE_VERSION = 4
+
+
+class VideoCodec(IntEnum):
+    RAW = 0
+    JPEG = 1
+    WEBP = 2
+
+
+# Image extension and quality parameter passed to cv2.imencode
+CODEC_PARAMS = {
+    VideoCodec.JPEG: (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    VideoCodec.WEBP: (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+# Every header carries the wall clock time in ns the value was produced at,
+# receivers map it to their own monotonic clock
+
+# version, integer servo mask, servo values, wall clock time
+SERVO_FORMAT = struct.Struct("<BB3dQ")
+
+# version, wall clock time, codec, frame dtype, frame ndim, frame shape
+VIDEO_FORMAT = struct.Struct("<BQB4sB3I")
+
+# version, wall clock time, frame sequence number, detection count, followed by the boxes, class ids and scores
+DETECTIONS_FORMAT = struct.Struct("<BQQI")
+
+
+def _buffer(frame):
+    """Get the buffer of a received message frame"""
+    return frame.buffer if isinstance(frame, zmq.Frame) else frame
+
+
+def _check_version(version: int) -> None:
+    if version != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire version {version}, expected {WIRE_VERSION}")
+
+
+def encode_servo_vals(servo_vals: ServoVals) -> bytes:
+    """Encode the servo values into a fixed size message"""
+
+    # Servo values are sent as doubles, remember which ones were ints
+    values = servo_vals.values
+    int_mask = sum(1 << i for i, value in enumerate(values) if isinstance(value, (int, np.integer)))
+
+    return SERVO_FORMAT.pack(WIRE_VERSION, int_mask, *values, servo_vals.wall_ns)
+
+
+def decode_servo_vals(frames: list) -> ServoVals:
+    """Decode a servo values message"""
+
+    message = _buffer(frames[0])
+    if len(message) != SERVO_FORMAT.size:
+        raise ValueError(f"Invalid servo message size {len(message)}, expected {SERVO_FORMAT.size}")
+
+    version, int_mask, *values, wall_ns = SERVO_FORMAT.unpack(message)
+    _check_version(version)
+
+    servo_vals = ServoVals([int(value) if int_mask & (1 << i) else value for i, value in enumerate(values)])
+    servo_vals.wall_ns = wall_ns
+    servo_vals.stamp_ns = round(wall_ns_to_monotonic(wall_ns) * 1e9)
+    return servo_vals
+
+
+def encode_video_frame(frame: np.ndarray, single_part: bool = False,
+                       codec: VideoCodec = VideoCodec.RAW, quality: int = 90, wall_ns: int = 0) -> list:
+    """Encode a video frame into a header and the frame buffer.
+    Raw frames are sent without copying unless a single part message is
+    requested, which sockets with ZMQ_CONFLATE set need. Compressed
+    frames are encoded with OpenCV at the given quality"""
+
+    if frame.ndim > 3:
+        raise ValueError(f"Video frames with {frame.ndim} dimensions are not supported")
+
+    frame = np.ascontiguousarray(frame)
+    shape = tuple(frame.shape) + (0,) * (3 - frame.ndim)
+    header = VIDEO_FORMAT.pack(WIRE_VERSION, wall_ns, codec, frame.dtype.str.encode("ascii"), frame.ndim, *shape)
+
+    if codec == VideoCodec.RAW:
+        payload = frame
+    else:
+        extension, quality_param = CODEC_PARAMS[codec]
+        ret, payload = cv2.imencode(extension, frame, [quality_param, int(quality)])
+        if not ret:
+            raise RuntimeError(f"Failed to encode video frame with {codec.name}")
+
+    if single_part:
+        return [header + payload.tobytes()]
+    return [header, payload]
+
+
+def decode_video_frame(frames: list) -> tuple:
+    """Decode a video frame message into the frame and its wall clock time in ns.
+    Raw frames are a view on the received buffer, no data is copied"""
+
+    header = memoryview(_buffer(frames[0]))
+    if len(header) < VIDEO_FORMAT.size:
+        raise ValueError(f"Invalid video header size {len(header)}, expected {VIDEO_FORMAT.size}")
+
+    version, wall_ns, codec, dtype, ndim, *shape = VIDEO_FORMAT.unpack(header[:VIDEO_FORMAT.size])
+    _check_version(version)
+
+    # Single part messages carry the frame right after the header
+    if len(frames) == 1:
+        buffer = header[VIDEO_FORMAT.size:]
+    elif len(frames) == 2:
+        buffer = _buffer(frames[1])
+    else:
+        raise ValueError(f"Invalid video message with {len(frames)} parts")
+
+    if codec != VideoCodec.RAW:
+        frame = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if frame is None:
+            raise ValueError(f"Failed to decode video frame with {VideoCodec(codec).name}")
+        return frame, wall_ns
+
+    frame = np.frombuffer(buffer, dtype=np.dtype(dtype.rstrip(b"\0").decode("ascii")))
+    return frame.reshape(shape[:ndim]), wall_ns
+
+
+def encode_detections(detections: Detections, wall_ns: int = 0) -> bytes:
+    """Encode the detections into a header followed by the packed arrays"""
+
+    header = DETECTIONS_FORMAT.pack(WIRE_VERSION, wall_ns, detections.frame_seq, len(detections))
+    return b"".join([
+        header,
+        np.ascontiguousarray(detections.boxes, dtype="<f4").tobytes(),
+        np.ascontiguousarray(detections.class_ids, dtype="<i4").tobytes(),
+        np.ascontiguousarray(detections.scores, dtype="<f4").tobytes()])
+
+
+def decode_detections(frames: list) -> tuple:
+    """Decode a detections message into the detections and their wall clock
+    time in ns, the arrays are views on the received buffer"""
+
+    message = memoryview(_buffer(frames[0]))
+    if len(message) < DETECTIONS_FORMAT.size:
+        raise ValueError(f"Invalid detections header size {len(message)}, expected {DETECTIONS_FORMAT.size}")
+
+    version, wall_ns, frame_seq, count = DETECTIONS_FORMAT.unpack(message[:DETECTIONS_FORMAT.size])
+    _check_version(version)
+
+    # Each detection is 4 box coordinates, a class id and a score, all 4 bytes wide
+    expected_size = DETECTIONS_FORMAT.size + count * 6 * 4
+    if len(message) != expected_size:
+        raise ValueError(f"Invalid detections message size {len(message)}, expected {expected_size}")
+
+    offset = DETECTIONS_FORMAT.size
+    boxes = np.frombuffer(message, dtype="<f4", count=count * 4, offset=offset).reshape(count, 4)
+    class_ids = np.frombuffer(message, dtype="<i4", count=count, offset=offset + count * 16)
+    scores = np.frombuffer(message, dtype="<f4", count=count, offset=offset + count * 20)
+    return Detections(boxes, class_ids, scores, frame_seq), wall_ns
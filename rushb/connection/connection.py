@@ -1,8 +1,13 @@
 import zmq
+import zmq.asyncio
 import logging
+import time
 
 from enum import Enum
 from rushb.sharedmem.shared_mem import *
+from rushb.connection.codec import *
+from rushb.connection.video_encoder import *
+from rushb.metrics import metrics
 
 
 class ConnectionType(Enum):
@@ -11,6 +16,28 @@ class ConnectionType(Enum):
     SUB = "SUB"
 
 
+class Topic(Enum):
+    SERVO = "servo"
+    VIDEO = "video"
+    DETECTIONS = "detections"
+
+
+# Every topic is carried by its own socket on the base port plus the
+# port offset, so a slow video stream never holds back the servo values
+DEFAULT_TOPICS = {
+    "servo": {"port_offset": 0, "hwm": 100, "conflate": False},
+    "video": {"port_offset": 1, "hwm": 2, "conflate": True},
+    "detections": {"port_offset": 2, "hwm": 10, "conflate": False},
+}
+
+# Shared memory field carried by every topic
+TOPIC_FIELDS = {
+    Topic.SERVO: "servo_vals",
+    Topic.VIDEO: "video_frame",
+    Topic.DETECTIONS: "detections",
+}
+
+
 class Connection:
     def __init__(self, **kwargs):
         self.connection_type: ConnectionType = ConnectionType[kwargs.get("connection_type")]
@@ -18,21 +45,50 @@ class Connection:
         self.sub_port: str = kwargs.get("sub_port")
         self.sub_host: str = kwargs.get("sub_host")
 
+        # Topics to publish and subscribe to with their socket options
+        topics = kwargs.get("topics") or DEFAULT_TOPICS
+        self.topics: dict[Topic, dict] = {
+            Topic(name): {**DEFAULT_TOPICS[name], **(options or {})} for name, options in topics.items()
+        }
+
+        # Poll timeout of recv in ms, recv blocks until a message arrives when not set
+        self.recv_timeout: int = kwargs.get("recv_timeout")
+        # Drain the subscriber sockets on recv and keep only the newest message per topic
+        self.recv_latest: bool = kwargs.get("recv_latest", False)
+
+        # Compression of the published video frames, raw frames are sent when not set
+        self.video_codec: dict = kwargs.get("video_codec") or {"codec": "RAW"}
+
+        # Fields are only sent when they changed, unchanged fields are sent again
+        # after the resend interval in seconds so late subscribers catch up
+        self.resend_interval: float = kwargs.get("resend_interval", 1.0)
+        # Sequence number and time of the last sent value per topic
+        self.sent: dict[Topic, tuple] = {}
+
         # Connection objects are not initialized until
         # the init_connection method is called
+        self.asynchronous: bool = False
         self.context: zmq.Context = None
-        self.publisher: zmq.Socket = None
-        self.subscriber: zmq.Socket = None
+        self.publishers: dict[Topic, zmq.Socket] = {}
+        self.subscribers: dict[Topic, zmq.Socket] = {}
+        self.poller: zmq.Poller = zmq.Poller()
+        self.video_encoder: VideoEncoder = None
 
-    def init(self):
-        """Initialize the connection"""
+    def init(self, asynchronous: bool = False):
+        """Initialize the connection, with asynchronous the sockets are
+        zmq.asyncio sockets that are used with asend and arecv"""
         # Check if the connection type is not None
         if self.connection_type is None:
             raise ValueError("The connection_type cannot be None")
 
         # Init the context
         try:
-            self.context = zmq.Context()
+            self.asynchronous = asynchronous
+            if asynchronous:
+                self.context = zmq.asyncio.Context()
+                self.poller = zmq.asyncio.Poller()
+            else:
+                self.context = zmq.Context()
         except zmq.error.ZMQError as e:
             logging.error(f"Could not init context: {e}")
             raise e
@@ -51,31 +107,178 @@ class Connection:
             raise ValueError(f"Unknown connection type: {self.connection_type}")
 
     def send(self, shared_mem: SharedMem):
-        """Send the shared memory to the remote subscriber"""
+        """Send the changed shared memory fields to the remote subscriber, one message per topic"""
+        start = time.perf_counter() if metrics.enabled else None
         try:
-            self.publisher.send_pyobj(shared_mem)
+            for topic, message in self.encode_changed(shared_mem):
+                self.publishers[topic].send_multipart(message, copy=False)
         except zmq.error.ZMQError as e:
             logging.error(f"Could not send shared memory: {e}")
             raise e
 
-    def recv(self) -> SharedMem:
-        """Receive the shared memory from the remote publisher"""
+        if start is not None:
+            metrics.histogram("connection.send", "ms").observe((time.perf_counter() - start) * 1e3)
+
+    async def asend(self, shared_mem: SharedMem):
+        """Send like send on the asyncio sockets"""
+        start = time.perf_counter() if metrics.enabled else None
         try:
-            shared_mem = self.subscriber.recv_pyobj()
-            return shared_mem
+            for topic, message in self.encode_changed(shared_mem):
+                await self.publishers[topic].send_multipart(message, copy=False)
+        except zmq.error.ZMQError as e:
+            logging.error(f"Could not send shared memory: {e}")
+            raise e
+
+        if start is not None:
+            metrics.histogram("connection.send", "ms").observe((time.perf_counter() - start) * 1e3)
+
+    def encode_changed(self, shared_mem: SharedMem):
+        """Yield the topic and encoded message of every field that changed or is due
+        to be sent again. Video frames of the encoder thread are handed to it instead"""
+        now = time.monotonic()
+        for topic in self.publishers:
+            value, seq, timestamp = shared_mem.read(TOPIC_FIELDS[topic])
+            if value is None:
+                continue
+            last_seq, last_time = self.sent.get(topic, (None, None))
+            if seq == last_seq and now - last_time < self.resend_interval:
+                continue
+            self.sent[topic] = (seq, now)
+
+            # The servo values carry their own stamps, the other fields are stamped with their publish time
+            wall_ns = monotonic_to_wall_ns(timestamp) if timestamp is not None else 0
+            if topic == Topic.VIDEO and self.video_encoder is not None:
+                # The encoder thread sends the frame and counts its bytes
+                self.video_encoder.submit(value, wall_ns)
+                continue
+            elif topic == Topic.SERVO:
+                message = [encode_servo_vals(value)]
+            elif topic == Topic.DETECTIONS:
+                message = [encode_detections(value, wall_ns)]
+            else:
+                single_part = self.topics[topic]["conflate"]
+                message = encode_video_frame(value, single_part, wall_ns=wall_ns)
+
+            if metrics.enabled:
+                metrics.counter(f"connection.{topic.value}.sent_bytes", "B").inc(
+                    sum(memoryview(part).nbytes for part in message))
+            yield topic, message
+
+    def recv(self, timestamps: dict = None) -> dict:
+        """Receive the shared memory fields from the remote publisher.
+        Waits up to the recv timeout for at least one topic to have a
+        message and returns the received fields by name, topics without
+        a message are left out. Returns an empty dict on timeout.
+        The local monotonic time every received field was produced at
+        is written to the given timestamps dict"""
+        try:
+            ready = dict(self.poller.poll(self.recv_timeout))
+            # Only the receiving and decoding is timed, not the wait for a message
+            start = time.perf_counter() if metrics.enabled and ready else None
+            messages = {topic: self.recv_frames(subscriber)
+                        for topic, subscriber in self.subscribers.items() if subscriber in ready}
         except zmq.error.ZMQError as e:
             logging.error(f"Could not receive shared memory: {e}")
             raise e
 
+        return self.decode_messages(messages, start, timestamps)
+
+    async def arecv(self, timestamps: dict = None) -> dict:
+        """Receive like recv on the asyncio sockets, the other tasks run while it waits"""
+        try:
+            ready = dict(await self.poller.poll(self.recv_timeout))
+            start = time.perf_counter() if metrics.enabled and ready else None
+            messages = {topic: await self.arecv_frames(subscriber)
+                        for topic, subscriber in self.subscribers.items() if subscriber in ready}
+        except zmq.error.ZMQError as e:
+            logging.error(f"Could not receive shared memory: {e}")
+            raise e
+
+        return self.decode_messages(messages, start, timestamps)
+
+    def decode_messages(self, messages: dict, start: float, timestamps: dict) -> dict:
+        """Decode the received message of every topic into its field"""
+        fields = {}
+        wall_times = {}
+        for topic, frames in messages.items():
+            if metrics.enabled:
+                metrics.counter(f"connection.{topic.value}.recv_bytes", "B").inc(
+                    sum(len(frame) for frame in frames))
+            if topic == Topic.SERVO:
+                fields["servo_vals"] = decode_servo_vals(frames)
+                wall_times["servo_vals"] = fields["servo_vals"].wall_ns
+            elif topic == Topic.VIDEO:
+                fields["video_frame"], wall_times["video_frame"] = decode_video_frame(frames)
+            elif topic == Topic.DETECTIONS:
+                fields["detections"], wall_times["detections"] = decode_detections(frames)
+
+        if start is not None:
+            metrics.histogram("connection.recv", "ms").observe((time.perf_counter() - start) * 1e3)
+
+        # Time from producing a field on the remote host to receiving it here, needs synchronized clocks
+        now_ns = time.time_ns()
+        for name, wall_ns in wall_times.items():
+            if not wall_ns:
+                continue
+            if metrics.enabled:
+                metrics.histogram(f"latency.{name}.transport", "ms").observe((now_ns - wall_ns) / 1e6)
+            if timestamps is not None:
+                timestamps[name] = wall_ns_to_monotonic(wall_ns)
+
+        return fields
+
+    def recv_frames(self, subscriber: zmq.Socket) -> list:
+        """Receive the next message of a ready subscriber, or
+        the newest one and drop the queued ones in latest mode"""
+        frames = subscriber.recv_multipart(copy=False)
+        if not self.recv_latest:
+            return frames
+
+        dropped = 0
+        while True:
+            try:
+                frames = subscriber.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                dropped += 1
+            except zmq.Again:
+                break
+
+        if dropped:
+            logging.debug(f"Dropped {dropped} stale messages")
+        return frames
+
+    async def arecv_frames(self, subscriber: zmq.asyncio.Socket) -> list:
+        """Receive like recv_frames on an asyncio subscriber"""
+        frames = await subscriber.recv_multipart(copy=False)
+        if not self.recv_latest:
+            return frames
+
+        dropped = 0
+        while True:
+            try:
+                frames = await subscriber.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                dropped += 1
+            except zmq.Again:
+                break
+
+        if dropped:
+            logging.debug(f"Dropped {dropped} stale messages")
+        return frames
+
     def deinit(self):
         try:
-            # Check if the publisher socket is initialized and close it
-            if self.publisher is not None:
-                self.publisher.close()
+            # Stop the video encoder before closing the socket it publishes on
+            if self.video_encoder is not None:
+                self.video_encoder.stop()
+                self.video_encoder = None
+
+            # Close the publisher and subscriber sockets
+            for socket in [*self.publishers.values(), *self.subscribers.values()]:
+                socket.close()
 
-            # Check if the subscriber socket is initialized and close it
-            if self.subscriber is not None:
-                self.subscriber.close()
+            self.publishers = {}
+            self.subscribers = {}
+            self.poller = zmq.asyncio.Poller() if self.asynchronous else zmq.Poller()
+            self.sent = {}
 
             # Check if the context is initialized and destroy it
             if self.context is not None:
@@ -89,15 +292,31 @@ class Connection:
         if self.pub_port is None:
             raise ValueError("The pub_port cannot be None")
 
-        # Init the publisher socket
-        end_point = f"tcp://*:{self.pub_port}"
-        try:
-            self.publisher = self.context.socket(zmq.PUB)
-            self.publisher.bind(end_point)
-            logging.info(f"Publisher bound to {end_point}")
-        except zmq.error.ZMQError as e:
-            logging.error(f"Could not bind the publisher to {end_point}: {e}")
-            raise e
+        # Init one publisher socket per topic
+        for topic, options in self.topics.items():
+            end_point = f"tcp://*:{int(self.pub_port) + options['port_offset']}"
+            try:
+                publisher = self.context.socket(zmq.PUB)
+                publisher.setsockopt(zmq.SNDHWM, options["hwm"])
+                # Conflate has to be set before binding
+                if options["conflate"]:
+                    publisher.setsockopt(zmq.CONFLATE, 1)
+                publisher.bind(end_point)
+                self.publishers[topic] = publisher
+                logging.info(f"Publisher for topic {topic.value} bound to {end_point}")
+            except zmq.error.ZMQError as e:
+                logging.error(f"Could not bind the publisher to {end_point}: {e}")
+                raise e
+
+        # Compress the video frames on a background thread
+        if Topic.VIDEO in self.publishers and self.video_codec.get("codec", "RAW") != "RAW":
+            single_part = self.topics[Topic.VIDEO]["conflate"]
+            publisher = self.publishers[Topic.VIDEO]
+            # The encoder thread blocks on its sends, give it a synchronous shadow of an asyncio socket
+            if self.asynchronous:
+                publisher = zmq.Socket.shadow(publisher.underlying)
+            self.video_encoder = VideoEncoder(publisher, single_part, **self.video_codec)
+            self.video_encoder.start()
 
     def init_sub(self):
         # Check if the port and host are not None
@@ -106,15 +325,21 @@ class Connection:
         if self.sub_host is None:
             raise ValueError("The sub_host cannot be None")
 
-        # Init the subscriber socket
-        end_point = f"tcp://{self.sub_host}:{self.sub_port}"
-
-        try:
-            self.subscriber = self.context.socket(zmq.SUB)
-            self.subscriber.connect(end_point)
-            # Subscribe to all messages
-            self.subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
-            logging.info(f"Subscriber connected to {end_point}")
-        except zmq.error.ZMQError as e:
-            logging.error(f"Could not connect to {end_point}: {e}")
-            raise e
+        # Init one subscriber socket per topic
+        for topic, options in self.topics.items():
+            end_point = f"tcp://{self.sub_host}:{int(self.sub_port) + options['port_offset']}"
+            try:
+                subscriber = self.context.socket(zmq.SUB)
+                subscriber.setsockopt(zmq.RCVHWM, options["hwm"])
+                # Conflate has to be set before connecting
+                if options["conflate"]:
+                    subscriber.setsockopt(zmq.CONFLATE, 1)
+                subscriber.connect(end_point)
+                # Subscribe to all messages of the topic
+                subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+                self.subscribers[topic] = subscriber
+                self.poller.register(subscriber, zmq.POLLIN)
+                logging.info(f"Subscriber for topic {topic.value} connected to {end_point}")
+            except zmq.error.ZMQError as e:
+                logging.error(f"Could not connect to {end_point}: {e}")
+                raise e
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from rushb.connection.codec import *
+from rushb.metrics import metrics
+
+
+class VideoEncoder(threading.Thread):
+    """VideoEncoder compresses the newest submitted video frame on a
+    background thread and publishes it, so the encoding never blocks
+    the loop. Frames submitted while an encode is running replace each
+    other, only the newest one is encoded next"""
+
+    def __init__(self, publisher: zmq.Socket, single_part: bool, **kwargs) -> None:
+        super().__init__(name="VideoEncoder", daemon=True)
+        self.publisher: zmq.Socket = publisher
+        self.single_part: bool = single_part
+
+        self.codec: VideoCodec = VideoCodec[kwargs.get("codec", "JPEG")]
+        self.max_quality: int = kwargs.get("quality", 80)
+        self.min_quality: int = kwargs.get("min_quality", 20)
+        # Optional target bitrate in kbit/s, the quality is adapted to meet it
+        self.target_bitrate: float = kwargs.get("target_bitrate")
+        self.quality: int = self.max_quality
+
+        self.condition: threading.Condition = threading.Condition()
+        self.pending_frame: np.ndarray = None
+        self.pending_wall_ns: int = 0
+        self.running: bool = False
+        self.error: Exception = None
+
+        # Exponential moving average of the sent bitrate in kbit/s
+        self.bitrate: float = None
+        self.last_send: float = None
+
+    def start(self) -> None:
+        logging.info(f"Starting video encoder with codec {self.codec.name} at quality {self.quality}")
+        self.running = True
+        super().start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the encoder thread and wait for it to finish"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def submit(self, frame: np.ndarray, wall_ns: int = 0) -> None:
+        """Hand the newest frame and its capture time to the encoder thread without blocking"""
+        if self.error is not None:
+            raise RuntimeError("Video encoder failed") from self.error
+
+        with self.condition:
+            self.pending_frame, self.pending_wall_ns = frame, wall_ns
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and self.pending_frame is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame, wall_ns, self.pending_frame = self.pending_frame, self.pending_wall_ns, None
+
+            try:
+                message = encode_video_frame(frame, self.single_part, self.codec, self.quality, wall_ns)
+                self.publisher.send_multipart(message, copy=False)
+            except Exception as e:
+                logging.error(f"Could not encode and send video frame: {e}", exc_info=True)
+                self.error = e
+                return
+
+            size = sum(len(part) for part in message)
+            if metrics.enabled:
+                metrics.counter("connection.video.sent_bytes", "B").inc(size)
+            self.adapt_quality(size)
+
+    def adapt_quality(self, size: int) -> None:
+        """Step the quality up or down to meet the target bitrate"""
+        now = time.monotonic()
+        last_send, self.last_send = self.last_send, now
+        if self.target_bitrate is None or last_send is None or now <= last_send:
+            return
+
+        bitrate = size * 8 / 1000 / (now - last_send)
+        self.bitrate = bitrate if self.bitrate is None else 0.9 * self.bitrate + 0.1 * bitrate
+
+        if self.bitrate > 1.1 * self.target_bitrate and self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - 5)
+            logging.debug(f"Video bitrate {self.bitrate:.0f} kbit/s, lowering quality to {self.quality}")
+        elif self.bitrate < 0.9 * self.target_bitrate and self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 5)
+            logging.debug(f"Video bitrate {self.bitrate:.0f} kbit/s, raising quality to {self.quality}")
@@ -0,0 +1,193 @@
+import http.server
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Samples a histogram keeps, percentiles are computed over the most recent ones
+WINDOW_SIZE = 1024
+
+# Instrumentation is skipped when metrics are disabled, call sites check this flag before measuring
+enabled: bool = False
+
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+
+class Histogram:
+    """Histogram keeps a window of the most recent samples of a
+    value and reports its percentiles. Safe to observe from any thread"""
+
+    def __init__(self, name: str, unit: str = "") -> None:
+        self.name: str = name
+        self.unit: str = unit
+        self.samples: np.ndarray = np.zeros(WINDOW_SIZE, dtype=np.float64)
+        # Samples observed in total, the window holds the last WINDOW_SIZE of them
+        self.count: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self.lock:
+            self.samples[self.count % WINDOW_SIZE] = value
+            self.count += 1
+
+    def window(self) -> np.ndarray:
+        """Copy of the samples in the window"""
+        with self.lock:
+            return self.samples[:min(self.count, WINDOW_SIZE)].copy()
+
+    def summary(self) -> dict:
+        """Count, mean, p50, p95, p99 and max of the samples in the window"""
+        samples = self.window()
+        if len(samples) == 0:
+            return {"count": self.count}
+
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {"count": self.count, "mean": float(samples.mean()), "p50": float(p50), "p95": float(p95),
+                "p99": float(p99), "max": float(samples.max())}
+
+
+class Counter:
+    """Counter is a monotonically increasing total, like sent bytes or overruns"""
+
+    def __init__(self, name: str, unit: str = "") -> None:
+        self.name: str = name
+        self.unit: str = unit
+        self.value: float = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+
+# Histograms and counters of the process by name
+histograms: dict[str, Histogram] = {}
+counters: dict[str, Counter] = {}
+registry_lock = threading.Lock()
+
+
+def histogram(name: str, unit: str = "") -> Histogram:
+    """Get the histogram with the given name, creating it on first use"""
+    with registry_lock:
+        if name not in histograms:
+            histograms[name] = Histogram(name, unit)
+        return histograms[name]
+
+
+def counter(name: str, unit: str = "") -> Counter:
+    """Get the counter with the given name, creating it on first use"""
+    with registry_lock:
+        if name not in counters:
+            counters[name] = Counter(name, unit)
+        return counters[name]
+
+
+def snapshot() -> dict:
+    """Summaries of all histograms and the values of all counters"""
+    with registry_lock:
+        hists, counts = list(histograms.values()), list(counters.values())
+    return {
+        "time": time.time(),
+        "histograms": {hist.name: {**hist.summary(), "unit": hist.unit} for hist in hists},
+        "counters": {count.name: {"value": count.value, "unit": count.unit} for count in counts},
+    }
+
+
+def add_rates(current: dict, previous: dict) -> None:
+    """Add the rate per second of every histogram count and counter value since the previous snapshot"""
+    if not previous or current["time"] <= previous["time"]:
+        return
+
+    elapsed = current["time"] - previous["time"]
+    for kind, key in (("histograms", "count"), ("counters", "value")):
+        for name, entry in current[kind].items():
+            entry["rate"] = (entry[key] - previous[kind].get(name, {}).get(key, 0)) / elapsed
+
+
+def log_summaries(current: dict = None) -> None:
+    """Log the summary of every histogram that has samples and every counter"""
+    current = current or snapshot()
+    for name, summary in sorted(current["histograms"].items()):
+        if summary["count"] == 0:
+            continue
+        unit = summary["unit"]
+        values = " ".join(f"{key}={summary[key]:.3f}{unit}" for key in ("mean", "p50", "p95", "p99", "max"))
+        rate = f" rate={summary['rate']:.1f}/s" if "rate" in summary else ""
+        logging.info(f"{name}: count={summary['count']}{rate} {values}")
+    for name, entry in sorted(current["counters"].items()):
+        rate = f" rate={entry['rate']:.1f}{entry['unit']}/s" if "rate" in entry else ""
+        logging.info(f"{name}: {entry['value']:.0f}{entry['unit']}{rate}")
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the latest metrics snapshot of the exporter as JSON"""
+
+    def do_GET(self) -> None:
+        body = json.dumps(self.server.exporter.latest).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+
+class MetricsExporter(threading.Thread):
+    """MetricsExporter takes a snapshot of the metrics every interval, logs it,
+    writes it as JSON to a file and serves it on a local HTTP endpoint"""
+
+    def __init__(self, interval: float = 10.0, file_path: str = None, port: int = None) -> None:
+        super().__init__(name="MetricsExporter", daemon=True)
+        self.interval: float = interval
+        self.file_path: str = file_path
+        self.port: int = port
+        self.stop_event: threading.Event = threading.Event()
+        self.latest: dict = {}
+        self.server: http.server.ThreadingHTTPServer = None
+
+    def start(self) -> None:
+        if self.port is not None:
+            # Only reachable from this host
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", self.port), MetricsHandler)
+            self.server.exporter = self
+            threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+            logging.info(f"Serving metrics on http://127.0.0.1:{self.port}/")
+        super().start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Export a last snapshot and stop"""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.export()
+        self.export()
+
+    def export(self) -> None:
+        current = snapshot()
+        add_rates(current, self.latest)
+        self.latest = current
+        log_summaries(current)
+
+        if self.file_path is not None:
+            # Replace the file atomically so readers never see a partial snapshot
+            directory = os.path.dirname(os.path.abspath(self.file_path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(current, f, indent=2)
+            os.replace(tmp_path, self.file_path)
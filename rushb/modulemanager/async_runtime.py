@@ -0,0 +1,93 @@
+from rushb.modules.rb_module import *
+from rushb.metrics import metrics
+from rushb.modulemanager.loop_timer import *
+
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncRuntime:
+    """AsyncRuntime steps every module as its own task on an asyncio event
+    loop. Modules with an astep are awaited on the loop, so their I/O waits
+    overlap with the other modules. Synchronous modules are stepped on a
+    thread pool through the default astep, or on the loop itself with
+    executor: false for modules that have to stay on one thread"""
+
+    def __init__(self, stop_event, rate_hz: float, max_workers: int = None) -> None:
+        # Shared with the scheduler, any task that fails sets it
+        self.stop_event = stop_event
+        # Default rate for modules without a rate_hz
+        self.rate_hz: float = rate_hz
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers, thread_name_prefix="ModuleStep")
+        self.tasks: list[asyncio.Task] = []
+        self.errors: list[Exception] = []
+        # Parameters to configure every module with before its next step, only used on the event loop
+        self.pending_changes: dict[RBModule, dict] = {}
+
+    def start(self, modules: list[RBModule], module_configs: list[dict], shared_mem: SharedMem) -> None:
+        """Start one task per module on the running event loop"""
+        asyncio.get_running_loop().set_default_executor(self.executor)
+        self.stop_event.clear()
+        self.tasks = []
+        for module, module_config in zip(modules, module_configs):
+            rate_hz = module_config.get("rate_hz", self.rate_hz)
+            executor = module_config.get("executor", True)
+            task = asyncio.create_task(self.run_module(module, shared_mem, rate_hz, executor),
+                                       name=f"{type(module).__name__}Task")
+            self.tasks.append(task)
+
+    async def run_module(self, module: RBModule, shared_mem: SharedMem, rate_hz: float, executor: bool) -> None:
+        module_name = type(module).__name__
+        asynchronous = has_astep(module)
+        logging.info(f"Starting {module_name}Task at {rate_hz or 'max'} Hz, "
+                     f"{'async' if asynchronous else 'on the executor' if executor else 'on the event loop'}")
+        step_histogram = metrics.histogram(f"module.{module_name}.step", "ms") if metrics.enabled else None
+        timer = LoopTimer(rate_hz, f"module.{module_name}") if rate_hz else None
+        while not self.stop_event.is_set():
+            try:
+                changes = self.pending_changes.pop(module, None)
+                if changes:
+                    module.configure(**changes)
+                start = time.perf_counter()
+                if asynchronous or executor:
+                    await module.astep(shared_mem)
+                else:
+                    module.step(shared_mem)
+                if step_histogram is not None:
+                    step_histogram.observe((time.perf_counter() - start) * 1e3)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.critical(f"{module_name}Task failed to step the module", exc_info=True)
+                self.errors.append(e)
+                self.stop_event.set()
+                return
+
+            if timer is not None:
+                await timer.wait_async()
+            else:
+                # Modules at the maximum rate still let the other tasks run
+                await asyncio.sleep(0)
+
+    def configure(self, module: RBModule, changes: dict) -> None:
+        """Configure the module between two steps, a step may be running on the executor"""
+        self.pending_changes.setdefault(module, {}).update(changes)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Signal the tasks to stop, wait for them to finish and shut the executor down"""
+        self.stop_event.set()
+        if self.tasks:
+            done, pending = await asyncio.wait(self.tasks, timeout=timeout)
+            for task in pending:
+                logging.warning(f"{task.get_name()} did not stop within {timeout} seconds")
+                task.cancel()
+        self.tasks = []
+        # Wait for steps still running on the executor, they cannot be cancelled
+        await asyncio.get_running_loop().shutdown_default_executor()
+
+    def failed(self) -> bool:
+        """Check if any of the tasks stopped because of an error"""
+        return bool(self.errors)
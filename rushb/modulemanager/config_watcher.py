@@ -0,0 +1,137 @@
+from rushb.modules.rb_module import *
+
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+# Module config keys used by the manager and the scheduler, they are never passed to the configure of a module
+MANAGER_KEYS = ("module_name", "module_class", "active", "rate_hz", "process", "executor", "main_thread", "after",
+                "optional")
+
+
+class ConfigWatcher:
+    """ConfigWatcher polls the modification time and size of the
+    configuration file and loads it again when either changed"""
+
+    def __init__(self, cfg_path: str, interval: float) -> None:
+        self.cfg_path: str = cfg_path
+        self.interval: float = interval
+        self.next_check: float = time.monotonic() + interval
+        self.stamp: tuple = self.file_stamp()
+
+    def file_stamp(self) -> tuple:
+        try:
+            stat = os.stat(self.cfg_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def poll(self) -> dict:
+        """The new configuration if the file changed since the last poll, checked at most every
+        interval. A file that cannot be parsed is skipped until it changes again"""
+        now = time.monotonic()
+        if now < self.next_check:
+            return None
+        self.next_check = now + self.interval
+
+        stamp = self.file_stamp()
+        if stamp is None or stamp == self.stamp:
+            return None
+        self.stamp = stamp
+
+        try:
+            with open(self.cfg_path, "r") as stream:
+                config = yaml.safe_load(stream)
+        except (OSError, yaml.YAMLError) as e:
+            logging.warning(f"Could not reload the configuration file: {e}")
+            return None
+        if not isinstance(config, dict) or not isinstance(config.get("Modules"), list):
+            logging.warning("Could not reload the configuration file, it has no Modules")
+            return None
+
+        logging.info("Configuration file changed")
+        return config
+
+
+def module_keys(module_configs: list[dict]) -> list[tuple]:
+    """Identify every module by its class and how many modules of the class come before it"""
+    counts = {}
+    keys = []
+    for module_config in module_configs:
+        module_class = module_config["module_class"]
+        keys.append((module_class, counts.get(module_class, 0)))
+        counts[module_class] = keys[-1][1] + 1
+    return keys
+
+
+def diff_modules(old_configs: list[dict], new_configs: list[dict]) -> tuple:
+    """Match the modules of two configurations. Returns the new config of every old module that is
+    still configured by position, the configs of the added modules and the positions of the removed ones"""
+    new_by_key = dict(zip(module_keys(new_configs), new_configs))
+    old_keys = module_keys(old_configs)
+
+    matched = {position: new_by_key[key] for position, key in enumerate(old_keys) if key in new_by_key}
+    added = [new_by_key[key] for key in new_by_key if key not in old_keys]
+    removed = [position for position in range(len(old_configs)) if position not in matched]
+    return matched, added, removed
+
+
+def changed_keys(old_config: dict, new_config: dict) -> set[str]:
+    """Keys whose value differs between two configs of a module, including added and removed keys"""
+    return {key for key in old_config.keys() | new_config.keys() if old_config.get(key) != new_config.get(key)}
+
+
+class ModuleReload(threading.Thread):
+    """ModuleReload swaps a module on a background thread, so the other modules
+    keep running meanwhile. It stops the worker of the old module, deinitializes
+    it and creates and initializes the module of the new config, or of the old
+    config again if that fails. Without an old module the module is added,
+    without a new config the old module is only removed"""
+
+    def __init__(self, position: int, module: RBModule = None, worker: threading.Thread = None,
+                 old_config: dict = None, module_config: dict = None, timeout: float = 5.0) -> None:
+        super().__init__(name=f"{(module_config or old_config)['module_class']}Reload", daemon=True)
+        # Position in the module list the new module is inserted at
+        self.position: int = position
+        self.module: RBModule = module
+        self.worker: threading.Thread = worker
+        self.old_config: dict = old_config
+        self.module_config: dict = module_config
+        self.timeout: float = timeout
+        self.error: Exception = None
+
+    def run(self) -> None:
+        name = (self.module_config or self.old_config)["module_class"]
+        if self.worker is not None:
+            # The worker finishes its current step first
+            self.worker.running = False
+            self.worker.join(self.timeout)
+            if self.worker.is_alive():
+                self.error = RuntimeError(f"{self.worker.name} did not stop within {self.timeout} seconds")
+                return
+
+        if self.module is not None:
+            try:
+                self.module.deinit()
+            except Exception:
+                logging.error(f"{name} failed to deinitialize", exc_info=True)
+            self.module = None
+
+        if self.module_config is None:
+            return
+        configs = [self.module_config] if self.old_config is None else [self.module_config, self.old_config]
+        for config in configs:
+            try:
+                module = create_module(**config)
+                module.init()
+                self.module, self.module_config = module, config
+                return
+            except Exception:
+                logging.error(f"{name} failed to initialize with the "
+                              f"{'changed' if config is self.module_config else 'previous'} config", exc_info=True)
+        # An added module that fails is left out, a module that ran before has to keep running
+        if self.old_config is not None:
+            self.error = RuntimeError(f"{name} failed to initialize again")
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+from enum import Enum
+
+from rushb.metrics import metrics
+
+
+class OverrunPolicy(Enum):
+    # Drop the missed iterations and keep the phase of the schedule
+    SKIP = "SKIP"
+    # Run the missed iterations back to back, up to max_catch_up of them
+    CATCH_UP = "CATCH_UP"
+    # Like SKIP, and leave out the optional modules until the loop keeps its deadlines again
+    DEGRADE = "DEGRADE"
+
+
+class LoopTimer:
+    """LoopTimer paces a loop to a fixed rate with absolute deadlines, so
+    the time the loop body takes never adds up to drift. It sleeps until
+    shortly before the deadline and spins for the rest to wake up on time,
+    the spin time trades CPU for jitter and can be turned off with 0"""
+
+    def __init__(self, rate_hz: float, name: str = "loop", spin_time: float = 0.0,
+                 overrun_policy: OverrunPolicy = OverrunPolicy.SKIP, max_catch_up: int = 5,
+                 recover_iterations: int = 10) -> None:
+        self.period: float = 1.0 / rate_hz
+        self.name: str = name
+        self.spin_time: float = spin_time
+        self.overrun_policy: OverrunPolicy = overrun_policy
+        self.max_catch_up: int = max_catch_up
+        self.recover_iterations: int = recover_iterations
+
+        self.deadline: float = time.perf_counter() + self.period
+        # Missed deadlines in total, and the on time iterations since the last one
+        self.overruns: int = 0
+        self.on_time: int = 0
+        # Set by the DEGRADE policy while the loop misses its deadlines
+        self.degraded: bool = False
+
+    def wait(self, stop_event=None) -> bool:
+        """Wait for the next deadline and return True if the stop event was set meanwhile"""
+        now = time.perf_counter()
+        if now > self.deadline:
+            self.overrun(now)
+            return stop_event is not None and stop_event.is_set()
+
+        # Sleep through most of the wait, spin the rest
+        sleep_time = self.deadline - now - self.spin_time
+        if sleep_time > 0:
+            if stop_event is not None:
+                if stop_event.wait(sleep_time):
+                    return True
+            else:
+                time.sleep(sleep_time)
+        while time.perf_counter() < self.deadline:
+            pass
+
+        self.advance()
+        return stop_event is not None and stop_event.is_set()
+
+    async def wait_async(self) -> None:
+        """Wait for the next deadline on an asyncio event loop. Never spins,
+        that would hold up the other tasks, so the jitter is that of the loop"""
+        now = time.perf_counter()
+        if now > self.deadline:
+            self.overrun(now)
+            # Still yield so a slow task does not starve the others
+            await asyncio.sleep(0)
+            return
+
+        await asyncio.sleep(self.deadline - now)
+        self.advance()
+
+    def advance(self) -> None:
+        """Move the deadline after the loop woke up for it"""
+        if metrics.enabled:
+            metrics.histogram(f"{self.name}.jitter", "ms").observe((time.perf_counter() - self.deadline) * 1e3)
+
+        self.deadline += self.period
+        self.on_time += 1
+        if self.degraded and self.on_time >= self.recover_iterations:
+            logging.info(f"{self.name} keeps its deadlines again, stepping all modules")
+            self.degraded = False
+
+    def overrun(self, now: float) -> None:
+        """Move the deadline after the loop body took longer than its period"""
+        late = now - self.deadline
+        missed = int(late // self.period) + 1
+        self.overruns += 1
+        self.on_time = 0
+        if metrics.enabled:
+            metrics.counter(f"{self.name}.overruns").inc()
+            metrics.histogram(f"{self.name}.jitter", "ms").observe(late * 1e3)
+
+        if self.overrun_policy == OverrunPolicy.CATCH_UP and missed <= self.max_catch_up:
+            # Run the next iteration right away, the following ones stay on the original schedule
+            self.deadline += self.period
+            return
+
+        # Skip to the next deadline in phase with the original schedule
+        self.deadline += missed * self.period
+        if self.overrun_policy == OverrunPolicy.DEGRADE and not self.degraded:
+            logging.warning(f"{self.name} missed its deadline by {late * 1e3:.1f} ms, skipping the optional modules")
+            self.degraded = True
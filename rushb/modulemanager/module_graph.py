@@ -0,0 +1,100 @@
+from rushb.modules.rb_module import *
+
+import logging
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class ModuleGraph:
+    """ModuleGraph calls the init or deinit of every module on a thread pool,
+    so slow inits like loading a model or opening a camera overlap. A module
+    configured with after: [ModuleClass, ...] is initialized after and
+    deinitialized before the modules of those classes, modules configured
+    with main_thread: true are called on the calling thread"""
+
+    def __init__(self, modules: list[RBModule], module_configs: list[dict]) -> None:
+        self.modules: list[RBModule] = modules
+        self.names: list[str] = [type(module).__name__ for module in modules]
+        self.main_thread: list[bool] = [config.get("main_thread", False) for config in module_configs]
+
+        # Positions of the modules every module is ordered after
+        self.dependencies: list[set[int]] = []
+        for position, config in enumerate(module_configs):
+            after = set(config.get("after", []))
+            missing = after - set(self.names)
+            if missing:
+                logging.warning(f"{self.names[position]} is ordered after {sorted(missing)}, which are not assigned")
+            self.dependencies.append({other for other, name in enumerate(self.names)
+                                      if name in after and other != position})
+        self.check_cycles()
+
+    def check_cycles(self) -> None:
+        """Raise if modules are ordered after each other, they could never start"""
+        remaining = set(range(len(self.modules)))
+        while remaining:
+            ready = {position for position in remaining if not self.dependencies[position] & remaining}
+            if not ready:
+                raise ValueError(f"Modules {sorted(self.names[position] for position in remaining)} "
+                                 f"are ordered after each other")
+            remaining -= ready
+
+    def run(self, action: str, max_workers: int = None, reverse: bool = False) -> dict[int, tuple]:
+        """Call the action, init or deinit, of every module once the modules it waits for are done.
+        Reversed, every module waits for the modules ordered after it instead. Modules waiting for
+        a module that failed to init are skipped, deinit always runs. Returns the seconds every
+        call took and the exception it raised or None by module position"""
+        waits_for = self.dependencies
+        if reverse:
+            waits_for = [{other for other, dependencies in enumerate(self.dependencies) if position in dependencies}
+                         for position in range(len(self.modules))]
+
+        results: dict[int, tuple] = {}
+        failed: set[int] = set()
+        pending = set(range(len(self.modules)))
+        running = {}
+        with ThreadPoolExecutor(max_workers, thread_name_prefix=f"Module{action.capitalize()}") as executor:
+            while pending or running:
+                ready = sorted(position for position in pending if waits_for[position] <= results.keys())
+                inline = None
+                for position in ready:
+                    pending.remove(position)
+                    skipped_for = waits_for[position] & failed
+                    if skipped_for and not reverse:
+                        names = ", ".join(sorted(self.names[other] for other in skipped_for))
+                        results[position] = (0.0, RuntimeError(f"Skipped because {names} failed"))
+                        failed.add(position)
+                    elif self.main_thread[position] and inline is None:
+                        inline = position
+                    elif self.main_thread[position]:
+                        # Only one call runs on the calling thread at a time, the others wait for the next round
+                        pending.add(position)
+                    else:
+                        future = executor.submit(self.call, position, action)
+                        running[future] = position
+
+                if inline is not None:
+                    results[inline] = self.call(inline, action)
+                    if results[inline][1] is not None:
+                        failed.add(inline)
+                    continue
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position = running.pop(future)
+                    results[position] = future.result()
+                    if results[position][1] is not None:
+                        failed.add(position)
+
+        return results
+
+    def call(self, position: int, action: str) -> tuple:
+        """Seconds the action of a module took and the exception it raised or None"""
+        start = time.perf_counter()
+        try:
+            getattr(self.modules[position], action)()
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
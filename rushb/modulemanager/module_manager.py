@@ -1,53 +1,361 @@
 from rushb.modules.rb_module import *
 from rushb.connection.connection import *
+from rushb.modulemanager.scheduler import *
+from rushb.modulemanager.async_runtime import *
+from rushb.modulemanager.module_graph import *
+from rushb.modulemanager.config_watcher import *
+from rushb.sharedmem.process_shared_mem import *
+from rushb.metrics import metrics
 
+import asyncio
+import contextlib
 import yaml
 import logging
+import time
 
 
 class ModuleManger:
     def __init__(self, cfg_path: str) -> None:
         self.cfg_path: str = cfg_path
+        # The configuration the running modules were created with
+        self.config: dict = {}
         self.modules: list[RBModule] = []
+        self.module_configs: list[dict] = []
+        # Positions of the modules that were initialized, only these are deinitialized
+        self.initialized: list[int] = []
+        # Modules that keep stepping while the loop timer is degraded, the others are optional
+        self.essential_modules: list[RBModule] = []
+        # Modules that are created and stepped in their own worker process
+        self.process_configs: list[dict] = []
         self.shared_mem: SharedMem = SharedMem()
         self.connection: Connection = None
+        self.scheduler: ModuleScheduler = None
+        # Steps the modules with the ASYNC scheduler while it runs
+        self.runtime: AsyncRuntime = None
+        self.loop_timer: LoopTimer = None
+        # Reloads the configuration file while running, only when the scheduler sets a reload_interval
+        self.config_watcher: ConfigWatcher = None
+        # Modules being swapped on background threads and a changed configuration waiting for them
+        self.reloads: list[ModuleReload] = []
+        self.pending_config: dict = None
+        # Start time of the last loop iteration, only tracked when metrics are enabled
+        self.loop_start: float = None
+        # Seconds every startup stage took, in the order they ran
+        self.startup_times: dict[str, float] = {}
 
     def init(self) -> bool:
         """ Parse the configuration file and initialize the modules """
+        self.startup_times = {}
+        start = time.perf_counter()
         try:
-            config = self.read_config()
-            self.init_connection(config)
+            with self.timed("read config"):
+                config = self.read_config()
+                self.config = config
+            with self.timed("shared memory"):
+                self.init_shared_mem(config)
+            self.init_scheduler(config)
+            if self.scheduler.reload_interval:
+                self.config_watcher = ConfigWatcher(self.cfg_path, self.scheduler.reload_interval)
+            with self.timed("connection"):
+                self.init_connection(config)
             self.assign_modules(config)
-            for module in self.modules:
-                module.init()
-        except RuntimeError:
+            self.init_modules()
+        except Exception:
             logging.critical("Module initialization failed", exc_info=True)
+            # The initialized modules are deinitialized by deinit, the sockets are closed here
+            if self.connection is not None:
+                self.connection.deinit()
+                self.connection = None
             return False
+        finally:
+            self.log_startup_times(time.perf_counter() - start)
 
         return True
 
+    def init_modules(self) -> None:
+        """ Initialize the modules concurrently, each after the modules it is ordered after """
+        graph = ModuleGraph(self.modules, self.module_configs)
+        results = graph.run("init", self.scheduler.init_workers)
+        self.initialized = sorted(position for position, (_, error) in results.items() if error is None)
+        for position, (seconds, _) in results.items():
+            self.startup_times[f"init {graph.names[position]}"] = seconds
+
+        failures = self.log_failures(graph, results, "initialize")
+        if failures:
+            raise RuntimeError(f"Failed to initialize {', '.join(failures)}")
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        """Record how long the startup stage in the with block took"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_times[stage] = time.perf_counter() - start
+
+    def log_startup_times(self, total: float) -> None:
+        """ Log the total startup time and the stages from the slowest to the fastest,
+        the module inits overlap so the stages add up to more than the total """
+        logging.info(f"Startup took {total:.3f} s")
+        for stage, seconds in sorted(self.startup_times.items(), key=lambda item: item[1], reverse=True):
+            logging.info(f"  {stage:<32} {seconds * 1e3:>9.1f} ms")
+
     def deinit(self) -> bool:
-        """ Deinitialize all the assigned modules """
+        """ Deinitialize the initialized modules concurrently, each before the modules it is ordered after """
         try:
-            for module in self.modules:
-                module.deinit()
-        except RuntimeError:
-            logging.critical("Module deinitialization failed", exc_info=True)
-            return False
+            if self.reloads:
+                try:
+                    self.finish_reloads(wait=True)
+                except RuntimeError:
+                    logging.error("Module swap failed", exc_info=True)
+            graph = ModuleGraph([self.modules[position] for position in self.initialized],
+                                [self.module_configs[position] for position in self.initialized])
+            results = graph.run("deinit", self.scheduler.init_workers if self.scheduler else None, reverse=True)
+            self.initialized = []
+            for position, (seconds, _) in sorted(results.items(), key=lambda item: item[1][0], reverse=True):
+                logging.info(f"Deinitialized {graph.names[position]} in {seconds * 1e3:.1f} ms")
+            if self.log_failures(graph, results, "deinitialize"):
+                logging.critical("Module deinitialization failed")
+                return False
+        finally:
+            if isinstance(self.shared_mem, ProcessSharedMem):
+                self.shared_mem.close()
 
         return True
 
+    @staticmethod
+    def log_failures(graph: ModuleGraph, results: dict, action: str) -> list[str]:
+        """ Log every module that failed the action at once and return their names """
+        failures = []
+        for position, (_, error) in sorted(results.items()):
+            if error is not None:
+                logging.error(f"{graph.names[position]} failed to {action}: {error}", exc_info=error)
+                failures.append(graph.names[position])
+        return failures
+
     def run(self) -> bool:
         """ Start processing the modules in a loop """
+        if self.scheduler.scheduler_type == SchedulerType.THREADED:
+            return self.run_threaded()
+        if self.scheduler.scheduler_type == SchedulerType.ASYNC:
+            try:
+                return asyncio.run(self.run_async())
+            except KeyboardInterrupt:
+                logging.info("Exiting...")
+                return True
+
+        self.scheduler.start_processes(self.process_configs, self.shared_mem)
+        self.loop_timer = self.scheduler.loop_timer()
         try:
-            while True:
+            while not self.scheduler.stop_event.is_set():
+                self.check_config()
                 self.update_shared_mem()
+                self.loop_timer.wait(self.scheduler.stop_event)
+        except KeyboardInterrupt:
+            logging.info("Exiting...")
+            return True
+        except RuntimeError:
+            logging.critical("Failed to run module", exc_info=True)
+            return False
+        finally:
+            self.scheduler.stop()
+            logging.info(f"Loop missed {self.loop_timer.overruns} deadlines")
+
+        return not self.scheduler.failed()
+
+    def run_threaded(self) -> bool:
+        """ Step every module on its own worker thread and
+        handle the connection on the calling thread """
+        self.scheduler.start(self.modules, self.module_configs, self.shared_mem)
+        self.scheduler.start_processes(self.process_configs, self.shared_mem)
+        self.loop_timer = self.scheduler.loop_timer()
+        try:
+            while not self.scheduler.stop_event.is_set():
+                self.check_config()
+                self.recv_shared_mem()
+                self.send_shared_mem()
+                self.loop_timer.wait(self.scheduler.stop_event)
         except KeyboardInterrupt:
             logging.info("Exiting...")
             return True
         except RuntimeError:
             logging.critical("Failed to run module", exc_info=True)
             return False
+        finally:
+            self.scheduler.stop()
+
+        return not self.scheduler.failed()
+
+    async def run_async(self) -> bool:
+        """ Step every module as a task on an asyncio event loop and
+        handle the connection on its sockets in between """
+        self.runtime = AsyncRuntime(self.scheduler.stop_event, self.scheduler.rate_hz, self.scheduler.max_workers)
+        self.runtime.start(self.modules, self.module_configs, self.shared_mem)
+        self.scheduler.start_processes(self.process_configs, self.shared_mem)
+        self.loop_timer = self.scheduler.loop_timer()
+        try:
+            while not self.scheduler.stop_event.is_set():
+                self.check_config()
+                await self.arecv_shared_mem()
+                await self.asend_shared_mem()
+                await self.loop_timer.wait_async()
+        except RuntimeError:
+            logging.critical("Failed to run module", exc_info=True)
+            return False
+        finally:
+            await self.runtime.stop()
+            self.scheduler.stop()
+
+        return not self.runtime.failed() and not self.scheduler.failed()
+
+    def check_config(self) -> None:
+        """ Apply the configuration file if it changed since it was last read """
+        if self.config_watcher is None:
+            return
+        self.finish_reloads()
+        config = self.config_watcher.poll()
+        if config is not None:
+            self.pending_config = config
+        # A change while modules are still swapped is applied once they are done
+        if self.pending_config is not None and not self.reloads:
+            config, self.pending_config = self.pending_config, None
+            self.apply_config(config)
+
+    def apply_config(self, config: dict) -> None:
+        """ Apply a changed configuration to the running modules, the unchanged modules keep running.
+        Changed parameters are passed to the configure of the module. A module with any other
+        changed key, an added and a removed module are swapped on a background thread and left
+        out of the loop until they are done. The ASYNC scheduler only applies parameters """
+        for section in ("Connection", "SharedMem", "Scheduler"):
+            if config.get(section) != self.config.get(section):
+                logging.warning(f"The {section} section changed, it is applied on the next start")
+        active = [module for module in config["Modules"] if module.get("active", False)]
+        if [module for module in active if module.get("process", False)] != self.process_configs:
+            logging.warning("The worker process modules changed, they are applied on the next start")
+        module_configs = [module for module in active if not module.get("process", False)]
+        matched, added, removed = diff_modules(self.module_configs, module_configs)
+
+        if self.scheduler.scheduler_type == SchedulerType.ASYNC:
+            self.configure_modules(matched)
+            if added or removed:
+                logging.warning("Modules are only added and removed on the next start with the ASYNC scheduler")
+            return
+
+        threaded = self.scheduler.scheduler_type == SchedulerType.THREADED
+        reloads = [ModuleReload(position, self.modules[position], self.worker(position),
+                                old_config=self.module_configs[position]) for position in removed]
+
+        # Rebuild the module lists in the order of the new configuration
+        positions = {id(module_config): position for position, module_config in matched.items()}
+        modules, applied_configs, workers = [], [], []
+        for index, module_config in enumerate(module_configs):
+            position = positions.get(id(module_config))
+            if position is None:
+                reloads.append(ModuleReload(index, module_config=module_config))
+                continue
+
+            module, old_config = self.modules[position], self.module_configs[position]
+            changes = self.parameter_changes(module, old_config, module_config)
+            if changes is None:
+                reloads.append(ModuleReload(index, module, self.worker(position), old_config, module_config))
+                continue
+            if changes:
+                self.configure_module(position, changes)
+            if threaded:
+                self.scheduler.workers[position].rate_hz = module_config.get("rate_hz", self.scheduler.rate_hz)
+            modules.append(module)
+            applied_configs.append(module_config)
+            workers.append(self.worker(position))
+
+        self.modules = modules
+        self.module_configs = applied_configs
+        if threaded:
+            self.scheduler.workers = workers
+        self.refresh_modules()
+        self.config = config
+
+        for reload in reloads:
+            if reload.module is None:
+                logging.info(f"Adding module {reload.module_config['module_class']}")
+            elif reload.module_config is None:
+                logging.info(f"Removing module {reload.old_config['module_class']}")
+            else:
+                logging.info(f"Initializing {reload.module_config['module_class']} again with its changed config")
+            reload.start()
+            self.reloads.append(reload)
+
+    def finish_reloads(self, wait: bool = False) -> None:
+        """ Put the modules that were swapped back into the loop, waits for the swaps still running
+        only when asked to. Raises if a module that ran before could not be initialized again """
+        threaded = self.scheduler.scheduler_type == SchedulerType.THREADED
+        errors = []
+        for reload in sorted(self.reloads, key=lambda reload: reload.position):
+            if wait:
+                reload.join()
+            if reload.is_alive():
+                continue
+            self.reloads.remove(reload)
+            if reload.error is not None:
+                errors.append(reload.error)
+            if reload.module is None:
+                continue
+
+            position = min(reload.position, len(self.modules))
+            self.modules.insert(position, reload.module)
+            self.module_configs.insert(position, reload.module_config)
+            if threaded and not self.scheduler.stop_event.is_set():
+                worker = self.scheduler.start_worker(reload.module, reload.module_config, self.shared_mem)
+                self.scheduler.workers.insert(position, worker)
+        self.refresh_modules()
+
+        if errors:
+            raise RuntimeError(f"Failed to swap {len(errors)} modules") from errors[0]
+
+    def worker(self, position: int):
+        """ Worker thread of a module, None unless the THREADED scheduler runs """
+        if self.scheduler.scheduler_type == SchedulerType.THREADED and self.scheduler.workers:
+            return self.scheduler.workers[position]
+        return None
+
+    def refresh_modules(self) -> None:
+        """ Derive the initialized and essential modules from the module lists after they changed """
+        self.initialized = list(range(len(self.modules)))
+        self.essential_modules = [module for module, module_config in zip(self.modules, self.module_configs)
+                                  if not module_config.get("optional", False)]
+
+    def configure_modules(self, matched: dict[int, dict]) -> None:
+        """ Pass the changed parameters to the modules and keep the modules with other changes as they are """
+        for position, module_config in matched.items():
+            module = self.modules[position]
+            changes = self.parameter_changes(module, self.module_configs[position], module_config)
+            if changes is None:
+                logging.warning(f"{type(module).__name__} changed more than its parameters, "
+                                f"it is initialized again on the next start")
+                continue
+            if changes:
+                self.configure_module(position, changes)
+            self.module_configs[position] = module_config
+
+    def configure_module(self, position: int, changes: dict) -> None:
+        """ Configure a module between two of its steps, its worker or task applies the changes """
+        logging.info(f"Configuring {type(self.modules[position]).__name__} with {changes}")
+        worker = self.worker(position)
+        if worker is not None:
+            worker.configure(**changes)
+        elif self.runtime is not None:
+            self.runtime.configure(self.modules[position], changes)
+        else:
+            # The sequential loop calls this between the steps
+            self.modules[position].configure(**changes)
+
+    @staticmethod
+    def parameter_changes(module: RBModule, old_config: dict, new_config: dict) -> dict:
+        """ The changed parameters of a module, or None if keys that are not parameters of the module
+        changed or were removed. The keys used by the manager are left out """
+        changed = changed_keys(old_config, new_config) - set(MANAGER_KEYS)
+        if not all(key in module.parameters and key in new_config for key in changed):
+            return None
+        return {key: new_config[key] for key in changed}
 
     def read_config(self):
         """ Read the module parameters from the configuration file """
@@ -65,10 +373,22 @@ class ModuleManger:
             for module in config["Modules"]:
                 # Get the module name to pass to the factory
                 if module["active"]:
-                    module_name = module["module_name"]
-                    # Create and assign the module
+                    module_name = module.get("module_name") or module["module_class"]
+                    # Worker process modules are created in their process once it started
+                    if module.get("process", False):
+                        if not isinstance(self.shared_mem, ProcessSharedMem):
+                            raise ValueError(f"Module {module_name} runs in a process, "
+                                             f"which needs the shared memory mode PROCESS")
+                        logging.info(f"Assigning module {module_name} to a worker process")
+                        self.process_configs.append(module)
+                        continue
+                    # Create and assign the module, creating includes importing its file
                     logging.info(f"Assigning module {module_name}")
-                    self.modules.append(create_module(**module))
+                    with self.timed(f"create {module['module_class']}"):
+                        self.modules.append(create_module(**module))
+                    self.module_configs.append(module)
+                    if not module.get("optional", False):
+                        self.essential_modules.append(self.modules[-1])
         except RuntimeError:
             logging.error("Module assignment failed", exc_info=True)
 
@@ -76,22 +396,81 @@ class ModuleManger:
         """ Read the data from the connection process it and send it back """
 
         # Receive the shared memory from the remote publisher
-        if self.connection.subscriber is not None:
-            self.shared_mem = self.connection.recv()
+        self.recv_shared_mem()
 
         # Pass the shared memory to the modules
-        # and trigger the step function
-        for module in self.modules:
-            self.shared_mem = module.step(self.shared_mem)
+        # and trigger the step function, the optional ones are left out while the loop misses its deadlines
+        degraded = self.loop_timer is not None and self.loop_timer.degraded
+        modules = self.essential_modules if degraded else self.modules
+        if metrics.enabled:
+            self.step_modules_profiled(modules)
+        else:
+            for module in modules:
+                self.shared_mem = module.step(self.shared_mem)
 
         # Send the shared memory to the remote subscriber
-        if self.connection.publisher is not None:
+        self.send_shared_mem()
+
+    def step_modules_profiled(self, modules: list[RBModule]) -> None:
+        """ Step the modules and record the step time of every module and the loop period """
+        loop_start = time.perf_counter()
+        if self.loop_start is not None:
+            metrics.histogram("loop.period", "ms").observe((loop_start - self.loop_start) * 1e3)
+        self.loop_start = loop_start
+
+        for module in modules:
+            start = time.perf_counter()
+            self.shared_mem = module.step(self.shared_mem)
+            metrics.histogram(f"module.{type(module).__name__}.step", "ms").observe(
+                (time.perf_counter() - start) * 1e3)
+
+    def recv_shared_mem(self) -> None:
+        """ Merge the fields received from the remote publisher into the local shared memory """
+        if self.connection.subscribers:
+            timestamps = {}
+            fields = self.connection.recv(timestamps)
+            if not fields:
+                # Nothing new arrived, the modules keep stepping on the last known state
+                logging.debug(f"No data received, servo values are {self.shared_mem.age('servo_vals'):.3f} s old")
+            self.shared_mem.update(fields, timestamps)
+
+    async def arecv_shared_mem(self) -> None:
+        """ Merge the received fields like recv_shared_mem, the module tasks run while waiting """
+        if self.connection.subscribers:
+            timestamps = {}
+            fields = await self.connection.arecv(timestamps)
+            if not fields:
+                logging.debug(f"No data received, servo values are {self.shared_mem.age('servo_vals'):.3f} s old")
+            self.shared_mem.update(fields, timestamps)
+
+    async def asend_shared_mem(self) -> None:
+        """ Send the shared memory to the remote subscriber on the asyncio sockets """
+        if self.connection.publishers:
+            await self.connection.asend(self.shared_mem)
+
+    def send_shared_mem(self) -> None:
+        """ Send the shared memory to the remote subscriber """
+        if self.connection.publishers:
             self.connection.send(self.shared_mem)
 
+    def init_shared_mem(self, config: dict) -> None:
+        """ Create the shared memory, modules in worker processes need it in shared memory blocks """
+        shared_mem_config = dict(config.get("SharedMem", {}))
+        shared_mem_type = SharedMemType[shared_mem_config.pop("mode", "THREAD")]
+        if shared_mem_type == SharedMemType.PROCESS:
+            self.shared_mem = ProcessSharedMem(**shared_mem_config)
+        logging.info(f"Using shared memory of type {shared_mem_type}")
+
     def init_connection(self, config: dict) -> None:
         """ Initialize the publisher and subscriber """
         self.connection = Connection(**config["Connection"])
         try:
-            self.connection.init()
+            # The asyncio runtime awaits the sockets instead of blocking on them
+            self.connection.init(self.scheduler.scheduler_type == SchedulerType.ASYNC)
         except RuntimeError:
             logging.error("Connection initialization failed", exc_info=True)
+
+    def init_scheduler(self, config: dict) -> None:
+        """ Initialize the module scheduler, defaults to stepping the modules sequentially """
+        self.scheduler = ModuleScheduler(**config.get("Scheduler", {}))
+        logging.info(f"Using scheduler of type {self.scheduler.scheduler_type}")
@@ -0,0 +1,181 @@
+from rushb.modules.rb_module import *
+from rushb.sharedmem.process_shared_mem import ProcessSharedMem
+from rushb.metrics import metrics
+from rushb.modulemanager.loop_timer import *
+
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+
+from enum import Enum
+
+
+class SchedulerType(Enum):
+    SEQUENTIAL = "SEQUENTIAL"
+    THREADED = "THREADED"
+    ASYNC = "ASYNC"
+
+
+class ModuleWorker(threading.Thread):
+    """ModuleWorker steps a single module on its own thread at a fixed rate"""
+
+    def __init__(self, module: RBModule, shared_mem: SharedMem, rate_hz: float, stop_event) -> None:
+        super().__init__(name=f"{type(module).__name__}Worker", daemon=True)
+        self.module: RBModule = module
+        self.shared_mem: SharedMem = shared_mem
+        self.stop_event = stop_event
+        self.error: Exception = None
+        # Cleared to stop only this worker, the stop event stops all of them
+        self.running: bool = True
+        # Parameters to configure the module with before its next step
+        self.pending_changes: dict = {}
+        self.changes_lock: threading.Lock = threading.Lock()
+
+        # A missing or zero rate means the module is stepped as fast as possible
+        self.rate_hz: float = rate_hz
+
+    def run(self) -> None:
+        logging.info(f"Starting {self.name} at {self.rate_hz or 'max'} Hz")
+        module_name = type(self.module).__name__
+        step_histogram = metrics.histogram(f"module.{module_name}.step", "ms") if metrics.enabled else None
+        # Workers never spin, a spinning thread would hold the GIL the other workers need
+        timer = LoopTimer(self.rate_hz, f"module.{module_name}") if self.rate_hz else None
+        timer_rate = self.rate_hz
+        while self.running and not self.stop_event.is_set():
+            # The rate can be changed while the worker runs
+            if self.rate_hz != timer_rate:
+                timer = LoopTimer(self.rate_hz, f"module.{module_name}") if self.rate_hz else None
+                timer_rate = self.rate_hz
+            try:
+                if self.pending_changes:
+                    with self.changes_lock:
+                        changes, self.pending_changes = self.pending_changes, {}
+                    self.module.configure(**changes)
+                start = time.perf_counter()
+                self.module.step(self.shared_mem)
+                if step_histogram is not None:
+                    step_histogram.observe((time.perf_counter() - start) * 1e3)
+            except Exception as e:
+                logging.critical(f"{self.name} failed to step the module", exc_info=True)
+                self.error = e
+                # Bring the whole pipeline down like the sequential loop would
+                self.stop_event.set()
+                return
+
+            if timer is not None:
+                timer.wait(self.stop_event)
+
+    def configure(self, **changes) -> None:
+        """Configure the module between two steps, changes queued before the next step are applied together"""
+        with self.changes_lock:
+            self.pending_changes.update(changes)
+
+
+class ModuleProcess(multiprocessing.Process):
+    """ModuleProcess creates, initializes and steps a single module in its own
+    process, attached to the shared memory blocks of the parent process"""
+
+    def __init__(self, module_config: dict, shared_mem: ProcessSharedMem, rate_hz: float, stop_event,
+                 log_level: int) -> None:
+        super().__init__(name=f"{module_config['module_class']}Process", daemon=True)
+        self.module_config: dict = module_config
+        self.attach_args: dict = shared_mem.attach_args()
+        self.rate_hz: float = rate_hz
+        self.stop_event = stop_event
+        self.log_level: int = log_level
+
+    def run(self) -> None:
+        logging.basicConfig(level=self.log_level, format="{asctime} {levelname:<8} {processName} {message}",
+                            style="{")
+        shared_mem = ProcessSharedMem(**self.attach_args)
+        module = None
+        try:
+            module = create_module(**self.module_config)
+            module.init()
+            worker = ModuleWorker(module, shared_mem, self.rate_hz, self.stop_event)
+            worker.name = self.name
+            worker.run()
+            if worker.error is not None:
+                sys.exit(1)
+        except KeyboardInterrupt:
+            # The parent process handles the interrupt and stops the workers
+            pass
+        except Exception:
+            logging.critical(f"{self.name} failed to initialize the module", exc_info=True)
+            self.stop_event.set()
+            sys.exit(1)
+        finally:
+            if module is not None:
+                module.deinit()
+            shared_mem.close()
+
+
+class ModuleScheduler:
+    """ModuleScheduler runs every module on its own worker thread
+    so slow modules do not hold back the fast ones"""
+
+    def __init__(self, **kwargs) -> None:
+        self.scheduler_type: SchedulerType = SchedulerType[kwargs.get("scheduler_type", "SEQUENTIAL")]
+        # Default rate for modules without a rate_hz and rate of the main loop
+        self.rate_hz: float = kwargs.get("rate_hz", 100)
+        # Threads of the ASYNC scheduler stepping the synchronous modules, defaults to the executor default
+        self.max_workers: int = kwargs.get("max_workers")
+        # Threads initializing and deinitializing the modules at once, defaults to the executor default
+        self.init_workers: int = kwargs.get("init_workers")
+        # Pacing of the main loop, see LoopTimer
+        self.spin_time: float = kwargs.get("spin_time", 0.0)
+        self.overrun_policy: OverrunPolicy = OverrunPolicy[kwargs.get("overrun_policy", "SKIP")]
+        self.max_catch_up: int = kwargs.get("max_catch_up", 5)
+        self.recover_iterations: int = kwargs.get("recover_iterations", 10)
+        # Seconds between checks of the configuration file for changes, 0 never reloads it
+        self.reload_interval: float = kwargs.get("reload_interval", 0)
+
+        # Shared with the worker processes, any worker that fails sets it
+        self.stop_event = multiprocessing.Event()
+        self.workers: list[ModuleWorker] = []
+        self.processes: list[ModuleProcess] = []
+
+    def start(self, modules: list[RBModule], module_configs: list[dict], shared_mem: SharedMem) -> None:
+        """Start one worker per module"""
+        self.stop_event.clear()
+        self.workers = [self.start_worker(module, module_config, shared_mem)
+                        for module, module_config in zip(modules, module_configs)]
+
+    def start_worker(self, module: RBModule, module_config: dict, shared_mem: SharedMem) -> ModuleWorker:
+        rate_hz = module_config.get("rate_hz", self.rate_hz)
+        worker = ModuleWorker(module, shared_mem, rate_hz, self.stop_event)
+        worker.start()
+        return worker
+
+    def start_processes(self, module_configs: list[dict], shared_mem: ProcessSharedMem) -> None:
+        """Start one worker process per module, the modules are created in the worker processes"""
+        self.processes = []
+        for module_config in module_configs:
+            rate_hz = module_config.get("rate_hz", self.rate_hz)
+            process = ModuleProcess(module_config, shared_mem, rate_hz, self.stop_event, logging.getLogger().level)
+            logging.info(f"Starting {process.name}")
+            self.processes.append(process)
+            process.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Signal the workers to stop and wait for them to finish"""
+        self.stop_event.set()
+        for worker in [*self.workers, *self.processes]:
+            worker.join(timeout)
+            if worker.is_alive():
+                logging.warning(f"{worker.name} did not stop within {timeout} seconds")
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+    def failed(self) -> bool:
+        """Check if any of the workers stopped because of an error"""
+        return any(worker.error is not None for worker in self.workers) or \
+            any(process.exitcode not in (None, 0) for process in self.processes)
+
+    def loop_timer(self) -> LoopTimer:
+        """Timer pacing the main loop at the scheduler rate"""
+        return LoopTimer(self.rate_hz, "loop", self.spin_time, self.overrun_policy, self.max_catch_up,
+                         self.recover_iterations)
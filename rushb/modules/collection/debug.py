@@ -1,20 +1,23 @@
 import logging
-import datetime
 
 from rushb.modules.rb_module import *
-from rushb.sharedmem.shared_mem import Servos
+from rushb.sharedmem.shared_mem import ServoVals, Servos
 
 
 class ServoReader(RBModule):
     # ServoReader is a class that reads the servo values from the shared memory
     def __init__(self, **kwargs) -> None:
-        pass
+        self.servo_vals_seq: int = None
 
     def init(self) -> None:
         logging.info("Initializing ServoReader")
 
     def step(self, shared_mem: SharedMem) -> SharedMem:
-        logging.debug(f"Servo values {shared_mem.servo_vals.values} {shared_mem.servo_vals.last_update}")
+        # Only log the servo values when they changed
+        slot = shared_mem.read("servo_vals")
+        if slot.seq != self.servo_vals_seq:
+            self.servo_vals_seq = slot.seq
+            logging.debug(f"Servo values {slot.value.values} {shared_mem.age('servo_vals') * 1e3:.1f} ms old")
         return shared_mem
 
     def deinit(self) -> None:
@@ -23,6 +26,8 @@ class ServoReader(RBModule):
 
 class ServoWriter(RBModule):
     # Updates the servo values in the shared memory
+    parameters = ("left_val", "right_val", "top_val")
+
     def __init__(self, **kwargs) -> None:
         self.left_val: int = kwargs.get("left_val")
         self.right_val: int = kwargs.get("right_val")
@@ -32,10 +37,15 @@ class ServoWriter(RBModule):
         logging.info("Initializing ServoWriter")
 
     def step(self, shared_mem: SharedMem) -> SharedMem:
-        shared_mem.servo_vals.values[Servos.LEFT] = self.left_val
-        shared_mem.servo_vals.values[Servos.RIGHT] = self.right_val
-        shared_mem.servo_vals.values[Servos.CAMERA] = self.top_val
-        shared_mem.servo_vals.last_update = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        values = [0] * len(Servos)
+        values[Servos.LEFT] = self.left_val
+        values[Servos.RIGHT] = self.right_val
+        values[Servos.CAMERA] = self.top_val
+
+        # Only publish the values when they changed
+        with shared_mem.lock:
+            if values != shared_mem.servo_vals.values:
+                shared_mem.servo_vals = ServoVals(values)
 
         return shared_mem
 
@@ -1,20 +1,20 @@
 import logging
 from numpy import interp
-import datetime
 from os import environ
-import keyboard
 
 from rushb.modules.rb_module import *
-from rushb.sharedmem.shared_mem import Servos
+from rushb.sharedmem.shared_mem import ServoVals, Servos
 
+# pygame and keyboard are only imported by the init of the module that uses them,
+# importing them takes long and keyboard needs root rights on Linux
 environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
-import pygame
 
 
 class JoyStickControls(RBModule):
     def __init__(self, **kwargs) -> None:
         self.joystick_id = kwargs.get("joystick_id")
         self.joystick = None
+        self.pygame = None
         self.right_stick = 0
         self.left_stick = 0
 
@@ -25,6 +25,8 @@ class JoyStickControls(RBModule):
 
         # Initialize pygame and the joystick module
         logging.info("Initializing JoyStickControls")
+        import pygame
+        self.pygame = pygame
         pygame.init()
         pygame.joystick.init()
         try:
@@ -35,15 +37,23 @@ class JoyStickControls(RBModule):
 
     def step(self, shared_mem: SharedMem) -> SharedMem:
         self.get_gamepad_input()
-        shared_mem.servo_vals.values[Servos.LEFT] = int(self.left_stick)
-        shared_mem.servo_vals.values[Servos.RIGHT] = int(self.right_stick)
-        shared_mem.servo_vals.last_update = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        with shared_mem.lock:
+            values = list(shared_mem.servo_vals.values)
+            values[Servos.LEFT] = int(self.left_stick)
+            values[Servos.RIGHT] = int(self.right_stick)
+
+            # Only publish the values when they changed
+            if values != shared_mem.servo_vals.values:
+                shared_mem.servo_vals = ServoVals(values)
 
         return shared_mem
 
     def deinit(self) -> None:
         # Release the joystick and pygame
         logging.info("Deinitializing JoyStickControls")
+        pygame = self.pygame
+        if pygame is None:
+            return
         try:
             pygame.joystick.quit()
             pygame.quit()
@@ -52,6 +62,7 @@ class JoyStickControls(RBModule):
 
     def get_gamepad_input(self) -> None:
         # Read the event queue
+        pygame = self.pygame
         try:
             pygame.event.get()
         except pygame.error:
@@ -68,6 +79,8 @@ class JoyStickControls(RBModule):
 class KeyboardControls(RBModule):
     """KeyboardControls is a module that controls the servos using the keyboard"""
 
+    parameters = ("up", "down", "left", "right", "x_speed", "y_speed")
+
     def __init__(self, **kwargs) -> None:
         self.button_mapping: dict[str, str] = {
             "up": kwargs.get("up"),
@@ -81,6 +94,7 @@ class KeyboardControls(RBModule):
 
         self.right_track = 90
         self.left_track = 90
+        self.keyboard = None
 
     def init(self) -> None:
         # Check if any of the button mappings is None
@@ -95,6 +109,8 @@ class KeyboardControls(RBModule):
         logging.info("Initializing KeyboardControls")
         logging.info(f"KeyboardControls x speed: {self.x_speed} y speed: {self.y_speed}")
         logging.info(f"Keyboard button mapping: {self.button_mapping}")
+        import keyboard
+        self.keyboard = keyboard
 
     def step(self, shared_mem: SharedMem) -> SharedMem:
         self.get_keyboard_input()
@@ -103,9 +119,18 @@ class KeyboardControls(RBModule):
     def deinit(self) -> None:
         logging.info("Deinitializing KeyboardControls")
 
+    def configure(self, **changes) -> None:
+        # The buttons are kept in the button mapping
+        for direction in self.button_mapping:
+            if direction in changes:
+                self.button_mapping[direction] = changes.pop(direction)
+        super().configure(**changes)
+
     def get_keyboard_input(self) -> None:
         """"Get the pressed key with the keyboard module and update the directional values"""
 
+        keyboard = self.keyboard
+
         # up pressed
         if keyboard.is_pressed(self.button_mapping["up"]):
             self.left_track += self.y_speed
@@ -140,11 +165,14 @@ class KeyboardControls(RBModule):
         self.left_track = max(0, min(self.left_track, 180))
         self.right_track = max(0, min(self.right_track, 180))
 
-        # Update the servo values in the shared memory
-        shared_mem.servo_vals.values[Servos.LEFT] = self.left_track
-        shared_mem.servo_vals.values[Servos.RIGHT] = self.right_track
+        with shared_mem.lock:
+            # Update the servo values in the shared memory
+            values = list(shared_mem.servo_vals.values)
+            values[Servos.LEFT] = self.left_track
+            values[Servos.RIGHT] = self.right_track
 
-        # Update the last update time
-        shared_mem.servo_vals.last_update = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            # Only publish the values when they changed, the new values carry the update time
+            if values != shared_mem.servo_vals.values:
+                shared_mem.servo_vals = ServoVals(values)
 
         return shared_mem
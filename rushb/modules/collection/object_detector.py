@@ -1,72 +1,439 @@
 import logging
+import queue
+import threading
+from abc import ABC, abstractmethod
 from typing import Any
 
 import cv2
 import numpy as np
 import os
-import tensorflow as tf
-from tensorflow.python.keras.utils.data_utils import get_file
 
 from rushb.modules.rb_module import *
+from rushb.sharedmem.shared_mem import Detections
+from rushb.vision.boxes import non_max_suppression
+from rushb.vision.model_store import ModelStore
+from rushb.vision.tracking import BoxTracker, crop_roi, motion, roi_to_frame, to_gray
+
+
+class DetectionBackend(ABC):
+    """DetectionBackend runs a detection model on a batch of uint8 RGB images.
+    Every backend returns the same contract: normalized [y_min, x_min, y_max, x_max]
+    boxes, 1-based class ids and scores, each with a leading batch dimension"""
+
+    # Added to the class ids of the model to make them 1-based
+    default_class_offset = 0
+
+    def __init__(self, **kwargs) -> None:
+        # Number of CPU threads the runtime may use, the runtime default when not set
+        self.num_threads: int = kwargs.get("num_threads")
+        self.class_offset: int = kwargs.get("class_offset", self.default_class_offset)
+
+    @abstractmethod
+    def load(self, model_path: str) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def infer(self, images: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        raise NotImplementedError()
+
+
+class TensorFlowBackend(DetectionBackend):
+    """Runs a TensorFlow SavedModel from the TF2 detection model zoo"""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.infer_function = None
+        # Batch dimension of the model input, None when the model takes batches of any size
+        self.model_batch_size: int = None
+
+    def load(self, model_path: str) -> None:
+        import tensorflow as tf
+
+        if self.num_threads is not None:
+            tf.config.threading.set_intra_op_parallelism_threads(self.num_threads)
+
+        tf.keras.backend.clear_session()
+        detection_model = tf.saved_model.load(model_path)
+
+        # Zoo models export a serving signature with a batch dimension fixed at 1
+        signature = detection_model.signatures.get("serving_default")
+        if signature is not None:
+            input_spec = next(iter(signature.structured_input_signature[1].values()))
+            self.model_batch_size = input_spec.shape[0]
+        if self.model_batch_size is not None:
+            logging.info(f"The model takes batches of {self.model_batch_size} images, larger batches are split")
+
+        # Trace the model once for uint8 RGB images of any size so it does not retrace per frame
+        self.infer_function = tf.function(
+            detection_model,
+            input_signature=[tf.TensorSpec(shape=[self.model_batch_size, None, None, 3], dtype=tf.uint8)])
+
+    def infer(self, images: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        step = self.model_batch_size or len(images)
+        all_boxes, all_classes, all_scores = [], [], []
+        for start in range(0, len(images), step):
+            detections = self.infer_function(images[start:start + step])
+            all_boxes.append(detections['detection_boxes'].numpy())
+            all_classes.append(detections['detection_classes'].numpy())
+            all_scores.append(detections['detection_scores'].numpy())
+        return (np.concatenate(all_boxes),
+                np.concatenate(all_classes).astype(np.int32) + self.class_offset,
+                np.concatenate(all_scores))
+
+    @staticmethod
+    def convert_to_tflite(model_path: str, tflite_path: str) -> None:
+        """Convert a SavedModel to a TFLite flatbuffer, the detection ops
+        that have no TFLite builtin fall back to the TF select ops. The
+        converted model is only kept if the TFLite backend can run it"""
+        import tensorflow as tf
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(model_path)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        tflite_model = converter.convert()
+
+        # Write next to the destination and move it into place so a partial file is never loaded
+        os.makedirs(os.path.dirname(tflite_path), exist_ok=True)
+        tmp_path = f"{tflite_path}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(tflite_model)
+
+        # tflite_runtime has no TF select ops, a model that needs them is not cached
+        try:
+            backend = TFLiteBackend()
+            backend.load(tmp_path)
+            backend.check()
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, tflite_path)
+
+
+class TFLiteBackend(DetectionBackend):
+    """Runs a TFLite SSD model with the detection post-processing op, or a
+    SavedModel converted as a whole that keeps its detection_* signature
+    outputs, using tflite_runtime when it is installed and full TensorFlow otherwise"""
+
+    # The post-processing op returns 0-based class ids
+    default_class_offset = 1
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.interpreter = None
+        self.input_details: dict = None
+        self.output_indexes: dict[str, int] = {}
+        self.signature_runner = None
+
+    def load(self, model_path: str) -> None:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.interpreter = Interpreter(model_path=model_path, num_threads=self.num_threads)
+
+        # Converted SavedModels keep the zoo signature with 1-based classes and take any image size
+        signatures = self.interpreter.get_signature_list()
+        for name, signature in signatures.items():
+            if "detection_boxes" in signature["outputs"]:
+                self.signature_runner = self.interpreter.get_signature_runner(name)
+                self.input_details = {"name": signature["inputs"][0]}
+                self.class_offset = 0
+                return
+
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+
+        # The post-processing op outputs boxes [1, N, 4], classes [1, N], scores [1, N] and the count [1].
+        # Tell classes and scores apart by name, older converters keep the op order instead
+        outputs = self.interpreter.get_output_details()
+        boxes = [output for output in outputs if len(output["shape"]) == 3]
+        pairs = [output for output in outputs if len(output["shape"]) == 2]
+        if len(boxes) != 1 or len(pairs) != 2:
+            raise ValueError(f"{model_path} does not end with the SSD detection post-processing op")
+        pairs.sort(key=lambda output: ("score" in output["name"].lower(), output["index"]))
+        self.output_indexes = {"boxes": boxes[0]["index"], "classes": pairs[0]["index"], "scores": pairs[1]["index"]}
+
+    def check(self) -> None:
+        """Run the model once on a blank image, ops the runtime lacks only fail when the model runs"""
+        self.infer(np.zeros((1, 300, 300, 3), np.uint8))
+
+    def infer(self, images: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.signature_runner is not None:
+            all_boxes, all_classes, all_scores = [], [], []
+            for image in images:
+                detections = self.signature_runner(**{self.input_details["name"]: image[np.newaxis, ...]})
+                all_boxes.append(detections["detection_boxes"][0])
+                all_classes.append(detections["detection_classes"][0])
+                all_scores.append(detections["detection_scores"][0])
+            return np.stack(all_boxes), np.stack(all_classes).astype(np.int32), np.stack(all_scores)
+
+        _, height, width, _ = self.input_details["shape"]
+        all_boxes, all_classes, all_scores = [], [], []
+        for image in images:
+            image = cv2.resize(image, (width, height))[np.newaxis, ...]
+
+            # Float models expect the pixels scaled to [-1, 1], quantized models the raw pixels
+            if self.input_details["dtype"] == np.float32:
+                image = (image.astype(np.float32) - 127.5) / 127.5
+
+            self.interpreter.set_tensor(self.input_details["index"], image)
+            self.interpreter.invoke()
+            all_boxes.append(self.interpreter.get_tensor(self.output_indexes["boxes"])[0])
+            all_classes.append(self.interpreter.get_tensor(self.output_indexes["classes"])[0])
+            all_scores.append(self.interpreter.get_tensor(self.output_indexes["scores"])[0])
+
+        return (np.stack(all_boxes),
+                np.stack(all_classes).astype(np.int32) + self.class_offset,
+                np.stack(all_scores))
+
+
+class ONNXRuntimeBackend(DetectionBackend):
+    """Runs an ONNX model exported from the TF2 detection model zoo, for example with tf2onnx"""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.session = None
+        self.input_name: str = None
+        self.output_names: list[str] = kwargs.get(
+            "output_names", ["detection_boxes", "detection_classes", "detection_scores"])
+
+    def load(self, model_path: str) -> None:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if self.num_threads is not None:
+            options.intra_op_num_threads = self.num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, images: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        boxes, classes, scores = self.session.run(self.output_names, {self.input_name: images})
+        return boxes, classes.astype(np.int32) + self.class_offset, scores
+
+
+class OpenCVDNNBackend(DetectionBackend):
+    """Runs a frozen TensorFlow detection graph with cv2.dnn"""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.net = None
+        # Text graph description needed by cv2.dnn for TF object detection graphs
+        self.config_path: str = kwargs.get("config_path")
+        self.input_size: list[int] = kwargs.get("input_size", [300, 300])
+
+    def load(self, model_path: str) -> None:
+        if self.num_threads is not None:
+            cv2.setNumThreads(self.num_threads)
+
+        self.net = cv2.dnn.readNet(model_path, self.config_path or "")
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def infer(self, images: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        blob = cv2.dnn.blobFromImages(list(images), size=tuple(self.input_size), swapRB=False)
+        self.net.setInput(blob)
+
+        # Every row is [image index, class id, score, x_min, y_min, x_max, y_max]
+        rows = self.net.forward().reshape(-1, 7)
+        all_boxes, all_classes, all_scores = [], [], []
+        for i in range(len(images)):
+            image_rows = rows[rows[:, 0] == i]
+            all_boxes.append(image_rows[:, [4, 3, 6, 5]])
+            all_classes.append(image_rows[:, 1].astype(np.int32) + self.class_offset)
+            all_scores.append(image_rows[:, 2])
+
+        # Images can have a different number of detections, pad them to the same length
+        count = max(len(scores) for scores in all_scores)
+        return (np.stack([np.pad(boxes, ((0, count - len(boxes)), (0, 0))) for boxes in all_boxes]),
+                np.stack([np.pad(classes, (0, count - len(classes))) for classes in all_classes]),
+                np.stack([np.pad(scores, (0, count - len(scores))) for scores in all_scores]))
+
+
+DETECTION_BACKENDS = {
+    "TF": TensorFlowBackend,
+    "TFLITE": TFLiteBackend,
+    "ONNX": ONNXRuntimeBackend,
+    "OPENCV": OpenCVDNNBackend,
+}
+
+
+class InferenceWorker(threading.Thread):
+    """InferenceWorker takes batches of queued frames, runs the detection
+    model on them and hands the confident detections back to the detector"""
+
+    def __init__(self, detector: "ObjectDetector", input_queue: queue.Queue, batch_size: int, name: str) -> None:
+        super().__init__(name=name, daemon=True)
+        self.detector: ObjectDetector = detector
+        self.input_queue: queue.Queue = input_queue
+        self.batch_size: int = batch_size
+        self.stop_event: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            # Wait for a frame, then batch up the ones that are already queued
+            try:
+                batch = [self.input_queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.input_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                queue_seqs, frame_seqs, images, grays = zip(*batch)
+                results = self.detector.detect(images)
+                for queue_seq, frame_seq, gray, detections in zip(queue_seqs, frame_seqs, grays, results):
+                    detections.frame_seq = frame_seq
+                    self.detector.publish_detections(queue_seq, detections, gray)
+            except Exception as e:
+                logging.error(f"{self.name} failed to run inference", exc_info=True)
+                self.detector.worker_error = e
+                return
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
 
 
 class ObjectDetector(RBModule):
     """ObjectDetector is a class that detects objects in an image using a pre-trained model."""
 
+    parameters = ("iou_threshold", "confidence_threshold", "max_detections", "nms_backend", "class_aware_nms",
+                  "detect_every", "motion_threshold", "roi")
+
     def __init__(self, **kwargs) -> None:
         self.model_url = kwargs.get("model_url")
-        self.labels_path = kwargs.get("labels_path")
         self.cache_dir = kwargs.get("cache_dir")
+        # Expected SHA-256 of the downloaded model archive, not verified when not set
+        self.model_sha256 = kwargs.get("model_sha256")
+        # Only use the models already in the cache and never touch the network
+        self.offline: bool = kwargs.get("offline", False)
+        # Cache a TFLite conversion of the TF model and load that on the next start
+        self.optimize: bool = kwargs.get("optimize", False)
+        self.model_store: ModelStore = None
+        self.saved_model_path: str = None
+        # Local model file for the backends that do not load from the model zoo
+        self.model_path = kwargs.get("model_path")
         self.iou_threshold = kwargs.get("iou_threshold")
         self.confidence_threshold = kwargs.get("confidence_threshold")
         self.max_detections = kwargs.get("max_detections")
-
-        self.class_names = []
-        self.class_colors = []
+        # nms_backend: TF, NUMPY
+        self.nms_backend: str = kwargs.get("nms_backend", "NUMPY")
+        # Only suppress overlapping boxes of the same class
+        self.class_aware_nms: bool = kwargs.get("class_aware_nms", False)
+
+        # backend: TF, TFLITE, ONNX, OPENCV
+        backend = kwargs.get("backend", "TF")
+        if backend not in DETECTION_BACKENDS:
+            raise ValueError(f"Unknown detection backend {backend}")
+        self.backend: DetectionBackend = DETECTION_BACKENDS[backend](**kwargs)
+        self.backend_kwargs: dict = kwargs
 
         self.model_name = None
-        self.detection_model = None
+
+        # Run the model every detect_every frames or when the motion since the last
+        # detection goes over motion_threshold, and track the boxes in between
+        self.detect_every: int = kwargs.get("detect_every", 1)
+        self.motion_threshold: float = kwargs.get("motion_threshold")
+        self.track_width: int = kwargs.get("track_width", 320)
+        self.tracking: bool = self.detect_every > 1 or self.motion_threshold is not None
+        self.tracker: BoxTracker = BoxTracker()
+        self.frames_since_detection: int = None
+        self.detection_gray = None
+        # Normalized [y_min, x_min, y_max, x_max] region the model runs on, the whole frame when not set
+        self.roi: list = kwargs.get("roi")
+
+        # Run the inference on worker threads fed by a bounded frame queue
+        self.pipelined: bool = kwargs.get("pipelined", False)
+        self.queue_size: int = kwargs.get("queue_size", 2)
+        self.batch_size: int = kwargs.get("batch_size", 1)
+        self.num_workers: int = kwargs.get("num_workers", 1)
+        self.input_queue: queue.Queue = None
+        self.workers: list[InferenceWorker] = []
+        self.worker_error: Exception = None
+
+        # Newest detections published by the workers and the queued frame they belong to
+        self.detections_lock: threading.Lock = threading.Lock()
+        self.detections_seq: int = -1
+        self.detections: Detections = None
+        self.detections_gray = None
+        self.detections_updated: bool = False
+        self.queued_frames: int = 0
+        self.last_frame_seq: int = None
 
     def init(self) -> None:
-        logging.info("Initializing ObjectDetector")
-        self.read_classes()
-        self.download_model()
+        logging.info(f"Initializing ObjectDetector with backend {type(self.backend).__name__}")
+        # Only the TF backend loads a model zoo SavedModel, the others load a local model file
+        if self.model_path is None:
+            self.download_model()
         self.load_model()
 
+        if self.pipelined:
+            self.start_workers()
+
     def step(self, shared_mem: SharedMem) -> SharedMem:
-        shared_mem.video_frame = self.predict(shared_mem.video_frame)
+        if self.worker_error is not None:
+            raise RuntimeError("Inference worker failed") from self.worker_error
+
+        # Only frames published since the last step are processed
+        frame, frame_seq, _ = shared_mem.read("video_frame")
+        if frame is None or frame_seq == self.last_frame_seq:
+            return shared_mem
+        self.last_frame_seq = frame_seq
+
+        if not self.pipelined:
+            if not self.tracking:
+                detections = self.predict(frame)
+                detections.frame_seq = frame_seq
+                shared_mem.detections = detections
+            else:
+                gray = to_gray(frame, self.track_width)
+                if self.should_detect(gray):
+                    self.tracker.reset(gray, self.predict(frame))
+                shared_mem.detections = self.tracker.track(gray, frame_seq)
+            return shared_mem
+
+        if not self.tracking:
+            # Queue every new frame, the queue drops the oldest frame when the workers fall behind
+            self.enqueue_frame(frame_seq, frame, None)
+
+            # Publish the newest detections the workers have produced once
+            with self.detections_lock:
+                detections = self.detections
+            if detections is not None and detections is not shared_mem.detections:
+                shared_mem.detections = detections
+            return shared_mem
+
+        gray = to_gray(frame, self.track_width)
+        if self.should_detect(gray):
+            self.enqueue_frame(frame_seq, frame, gray)
+
+        # Track from the frame the newest detections were found on to the current one
+        with self.detections_lock:
+            if self.detections_updated:
+                self.tracker.reset(self.detections_gray, self.detections)
+                self.detections_updated = False
+        shared_mem.detections = self.tracker.track(gray, frame_seq)
+
         return shared_mem
 
     def deinit(self) -> None:
-        pass
-
-    def read_classes(self) -> None:
-        """Reads the classes from the labels file and
-        creates a list of colors for each class"""
-
-        # Check if the labels path is not None
-        if self.labels_path is None:
-            raise ValueError("Labels path is not set")
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
 
-        # Check if the labels file exists
-        if not os.path.exists(self.labels_path):
-            raise FileNotFoundError(f"Labels file not found at {self.labels_path}")
-
-        try:
-            logging.info(f"Reading classes from {self.labels_path}")
-            with open(self.labels_path, "r") as f:
-                self.class_names = [cname.strip() for cname in f.readlines()]
-
-            self.class_colors = np.random.uniform(0, 255, size=(len(self.class_names), 3))
-        except Exception as e:
-            logging.error(f"Error reading classes from {self.labels_path}")
-            raise e
+    def configure(self, **changes) -> None:
+        super().configure(**changes)
+        self.tracking = self.detect_every > 1 or self.motion_threshold is not None
 
     def download_model(self) -> None:
         """Downloads the model from the TensorFlow model zoo
-        and extracts it to the cache directory. If the model
-        is already present in the cache dir, it will not
-        be downloaded again"""
+        and extracts it to the model store. If the model
+        is already present in the store, it will not
+        be downloaded or extracted again"""
 
         # Check if the model url is valid
         if not self.model_url:
@@ -80,18 +447,38 @@ class ObjectDetector(RBModule):
             raise ValueError("Cache directory is not set")
 
         os.makedirs(self.cache_dir, exist_ok=True)
+        self.model_store = ModelStore(self.cache_dir, self.offline)
 
         try:
-            get_file(file_name, origin=self.model_url, cache_dir=self.cache_dir,
-                     cache_subdir=self.model_name, extract=True)
+            archive_path = self.model_store.fetch(self.model_url, self.model_sha256)
+            extract_dir = self.model_store.extract(self.model_url, archive_path)
         except Exception as e:
             logging.error(f"Error downloading model from {self.model_url}")
             raise e
 
-    def load_model(self) -> None:
-        """Loads the model from the cache directory in a variable"""
+        self.saved_model_path = os.path.join(extract_dir, self.model_name, "saved_model")
 
-        model_path = os.path.join(self.cache_dir, self.model_name, self.model_name, "saved_model")
+    def load_model(self) -> None:
+        """Loads the model from the model path or the cache directory into the backend"""
+
+        model_path = self.model_path or self.saved_model_path
+
+        # Load the optimized form of a model zoo model when it was cached by a previous start
+        optimize = self.optimize and self.model_path is None and isinstance(self.backend, TensorFlowBackend)
+        if optimize:
+            tflite_path = self.model_store.optimized_path(self.model_url, "model.tflite")
+            if os.path.exists(tflite_path):
+                try:
+                    logging.info(f"Loading optimized model from {tflite_path}")
+                    backend = TFLiteBackend(**self.backend_kwargs)
+                    backend.load(tflite_path)
+                    backend.check()
+                    self.backend = backend
+                    return
+                except Exception as e:
+                    # Converted by an older version or for another runtime, the SavedModel is loaded instead
+                    logging.warning(f"Could not load the optimized model, removing it: {e}")
+                    os.remove(tflite_path)
 
         # Check if the model exists
         if not os.path.exists(model_path):
@@ -99,37 +486,122 @@ class ObjectDetector(RBModule):
 
         try:
             logging.info(f"Loading model from {model_path}")
-            tf.keras.backend.clear_session()
-            self.detection_model = tf.saved_model.load(model_path)
+            self.backend.load(model_path)
         except Exception as e:
             logging.error(f"Error loading model from {model_path}")
             raise e
 
-    def predict(self, image):
+        # The TF model keeps running if the conversion fails, it is only retried on the next start
+        if optimize:
+            try:
+                logging.info(f"Caching an optimized TFLite model at {tflite_path}")
+                TensorFlowBackend.convert_to_tflite(model_path, tflite_path)
+            except Exception as e:
+                logging.warning(f"Could not convert the model to TFLite: {e}")
+
+    def start_workers(self) -> None:
+        """Start the inference workers and their bounded input queue"""
+        logging.info(f"Starting {self.num_workers} inference workers with batch size {self.batch_size}")
+        self.input_queue = queue.Queue(maxsize=self.queue_size)
+        for i in range(self.num_workers):
+            worker = InferenceWorker(self, self.input_queue, self.batch_size, f"InferenceWorker{i}")
+            self.workers.append(worker)
+            worker.start()
+
+    def should_detect(self, gray) -> bool:
+        """Decide if the model runs on the frame or the boxes are tracked instead"""
+        if self.frames_since_detection is None or self.frames_since_detection + 1 >= self.detect_every:
+            detect = True
+        else:
+            detect = self.motion_threshold is not None and motion(gray, self.detection_gray) > self.motion_threshold
+
+        if detect:
+            self.frames_since_detection = 0
+            self.detection_gray = gray
+        else:
+            self.frames_since_detection += 1
+        return detect
+
+    def enqueue_frame(self, frame_seq: int, frame, gray) -> None:
+        """Queue a frame for inference, dropping the oldest queued frame when the queue is full.
+        The color conversion copies the frame so it can not change while it is queued"""
+        if self.roi is not None:
+            frame = crop_roi(frame, self.roi)
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.queued_frames += 1
+        while True:
+            try:
+                self.input_queue.put_nowait((self.queued_frames, frame_seq, image, gray))
+                return
+            except queue.Full:
+                try:
+                    self.input_queue.get_nowait()
+                    logging.debug("Inference queue full, dropped the oldest frame")
+                except queue.Empty:
+                    pass
+
+    def publish_detections(self, queue_seq: int, detections: Detections, gray) -> None:
+        """Keep the detections if they belong to a newer frame than the current ones"""
+        with self.detections_lock:
+            if queue_seq > self.detections_seq:
+                self.detections_seq = queue_seq
+                self.detections = detections
+                self.detections_gray = gray
+                self.detections_updated = True
+
+    def detect(self, images) -> list[Detections]:
+        """Run the model on a list of RGB images and return the confident detections of every image"""
+
+        # Images of the same size are batched into a single model call
+        if len(images) > 1 and len({image.shape for image in images}) == 1:
+            batches = [np.stack(images)]
+        else:
+            batches = [image[np.newaxis, ...] for image in images]
+
+        results = []
+        for batch in batches:
+            try:
+                all_boxes, all_classes, all_scores = self.backend.infer(batch)
+            except Exception as e:
+                logging.error("Error getting predictions from model")
+                raise e
+
+            for boxes, class_indexes, class_scores in zip(all_boxes, all_classes, all_scores):
+                confident_predictions = self.nms(boxes, class_scores, class_indexes)
+                results.append(Detections(boxes[confident_predictions], class_indexes[confident_predictions],
+                                          class_scores[confident_predictions]))
+
+        if self.roi is not None:
+            results = [roi_to_frame(detections, self.roi) for detections in results]
+        return results
+
+    def predict(self, image) -> Detections:
         """Predicts the objects in the image using the model"""
 
+        if self.roi is not None:
+            image = crop_roi(image, self.roi)
+
         all_predictions, class_indexes, class_scores = self.feed_forward_image(image)
-        confident_predictions = self.nms(all_predictions, class_scores)
-        image = self.draw_bounding_boxes(all_predictions, confident_predictions,
-                                           class_scores, class_indexes, image)
-        return image
+        confident_predictions = self.nms(all_predictions, class_scores, class_indexes)
+        detections = Detections(all_predictions[confident_predictions], class_indexes[confident_predictions],
+                                class_scores[confident_predictions])
+
+        if self.roi is not None:
+            detections = roi_to_frame(detections, self.roi)
+        return detections
 
     def feed_forward_image(self, image) -> tuple[Any, Any, Any]:
         """Feed the frame to the model and get the predictions"""
 
         try:
-            input_tensor = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            input_tensor = tf.convert_to_tensor(input_tensor, dtype=tf.uint8)
-            input_tensor = input_tensor[tf.newaxis, ...]
+            input_tensor = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)[np.newaxis, ...]
         except Exception as e:
             logging.error("Error converting image to tensor")
             raise e
 
         try:
-            detections = self.detection_model(input_tensor)
-            bounding_boxes = detections['detection_boxes'][0].numpy()
-            class_indexes = detections['detection_classes'][0].numpy().astype(np.int32)
-            class_scores = detections['detection_scores'][0].numpy()
+            all_boxes, all_classes, all_scores = self.backend.infer(input_tensor)
+            bounding_boxes, class_indexes, class_scores = all_boxes[0], all_classes[0], all_scores[0]
         except Exception as e:
             logging.error("Error getting predictions from model")
             raise e
@@ -137,8 +609,9 @@ class ObjectDetector(RBModule):
         logging.debug(f"Detection count: {len(bounding_boxes)}")
         return bounding_boxes, class_indexes, class_scores
 
-    def nms(self, bounding_boxes, class_scores):
-        """Non-maximum suppression to remove overlapping bounding boxes"""
+    def nms(self, bounding_boxes, class_scores, class_indexes) -> np.ndarray:
+        """Non-maximum suppression to remove overlapping bounding boxes,
+        returns the indexes of the confident predictions"""
 
         # Check if the max detections is not None
         if self.max_detections is None:
@@ -153,10 +626,20 @@ class ObjectDetector(RBModule):
             raise ValueError("Confidence threshold is not set")
 
         try:
-            confident_predictions = tf.image.non_max_suppression(
-                bounding_boxes, class_scores, self.max_detections,
-                self.iou_threshold,
-                self.confidence_threshold)
+            if self.nms_backend == "NUMPY":
+                confident_predictions = non_max_suppression(
+                    bounding_boxes, class_scores, self.max_detections,
+                    self.iou_threshold,
+                    self.confidence_threshold,
+                    class_indexes if self.class_aware_nms else None)
+            elif self.nms_backend == "TF" and not self.class_aware_nms:
+                import tensorflow as tf
+                confident_predictions = tf.image.non_max_suppression(
+                    bounding_boxes, class_scores, self.max_detections,
+                    self.iou_threshold,
+                    self.confidence_threshold).numpy()
+            else:
+                raise ValueError(f"Unsupported NMS backend {self.nms_backend} with class aware NMS {self.class_aware_nms}")
         except Exception as e:
             logging.error("Error performing NMS")
             raise e
@@ -164,33 +647,3 @@ class ObjectDetector(RBModule):
         logging.debug(f"Confident predictions: {len(confident_predictions)}")
 
         return confident_predictions
-
-    def draw_bounding_boxes(self, all_predictions, confident_predictions,
-                              class_scores, class_indexes, image):
-        """Draw bounding boxes of the confident predictions on the image"""
-
-        try:
-            h, w, c = image.shape
-            if len(confident_predictions) != 0:
-                for i in confident_predictions:
-                    bounding_box = tuple(all_predictions[i].tolist())
-                    class_confidence = round(100 * class_scores[i])
-                    class_index = class_indexes[i]
-                    class_label = self.class_names[class_index - 1]
-                    color = tuple(self.class_colors[class_index - 1])
-
-                    # Text to be displayed on the bounding box
-                    display_text = f"{class_label} {class_confidence}%"
-
-                    # Coordinates of the bounding box
-                    y_min, x_min, y_max, x_max = bounding_box
-                    y_min, x_min, y_max, x_max = int(y_min * h), int(x_min * w), int(y_max * h), int(x_max * w)
-
-                    # Draw the bounding box and the text
-                    cv2.rectangle(image, (x_min, y_min), (x_max, y_max), color, 2)
-                    cv2.putText(image, display_text, (x_min, y_min - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-        except Exception as e:
-            logging.error("Error drawing bounding boxes")
-            raise e
-
-        return image
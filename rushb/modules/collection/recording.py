@@ -0,0 +1,152 @@
+import logging
+import time
+
+import numpy as np
+
+from rushb.modules.rb_module import *
+from rushb.sharedmem.shared_mem_log import *
+
+
+class Recorder(RBModule):
+    """Recorder appends every value published to the recorded shared memory
+    fields to a log, which the Player replays"""
+
+    def __init__(self, **kwargs) -> None:
+        self.path: str = kwargs.get("path")
+        self.fields: list[str] = kwargs.get("fields", list(LOG_FIELDS))
+        # Compression of the recorded video frames, raw frames are replayed without decoding
+        self.video_codec: VideoCodec = VideoCodec[kwargs.get("video_codec", "RAW")]
+        self.quality: int = kwargs.get("quality", 90)
+        self.overwrite: bool = kwargs.get("overwrite", False)
+
+        self.writer: LogWriter = None
+        self.tick: int = 0
+        # Sequence number of the last recorded value of every field
+        self.recorded_seqs: dict[str, int] = {}
+
+    def init(self) -> None:
+        logging.info("Initializing Recorder")
+        if self.path is None:
+            raise ValueError("The path cannot be None")
+        unknown = set(self.fields) - set(LOG_FIELDS)
+        if unknown:
+            raise ValueError(f"Fields {sorted(unknown)} cannot be recorded, only {LOG_FIELDS}")
+
+        self.writer = LogWriter(self.path, self.video_codec, self.quality, self.overwrite)
+        logging.info(f"Recording {', '.join(self.fields)} to {self.path}")
+
+    def step(self, shared_mem: SharedMem) -> SharedMem:
+        """Append the fields published since the last step"""
+        self.tick += 1
+        published = []
+        for name in self.fields:
+            value, seq, timestamp = shared_mem.read(name)
+            if timestamp is None or seq == self.recorded_seqs.get(name):
+                continue
+            self.recorded_seqs[name] = seq
+            published.append((timestamp, name, value))
+
+        # In the order they were published, the log is indexed by time
+        for timestamp, name, value in sorted(published, key=lambda entry: entry[0]):
+            self.writer.write(self.tick, name, value, timestamp)
+        if published:
+            self.writer.flush()
+        return shared_mem
+
+    def deinit(self) -> None:
+        logging.info("Deinitializing Recorder")
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class Player(RBModule):
+    """Player replays a log of the Recorder into the shared memory. It keeps
+    to the recorded timing scaled by the speed, or with a speed of 0 replays
+    one recorded tick per step as fast as the loop runs"""
+
+    parameters = ("speed", "loop")
+
+    def __init__(self, **kwargs) -> None:
+        self.path: str = kwargs.get("path")
+        self.speed: float = kwargs.get("speed", 1.0)
+        # Seconds into the log to start at
+        self.start: float = kwargs.get("start", 0.0)
+        # Start over at the beginning when the log is replayed
+        self.loop: bool = kwargs.get("loop", False)
+
+        self.reader: LogReader = None
+        # Position of the next entry to replay, and when the replay passed which position in the log
+        self.position: int = 0
+        self.play_start: float = None
+        self.log_start: float = 0.0
+        self.finished: bool = False
+
+    def init(self) -> None:
+        logging.info("Initializing Player")
+        if self.path is None:
+            raise ValueError("The path cannot be None")
+
+        self.reader = LogReader(self.path)
+        logging.info(f"Replaying {len(self.reader)} values over {self.reader.duration:.1f} s "
+                     f"from {self.path} at {self.speed or 'max'} x speed")
+
+    def step(self, shared_mem: SharedMem) -> SharedMem:
+        if self.play_start is None:
+            self.seek(shared_mem, self.start)
+
+        if self.position >= len(self.reader):
+            if self.loop:
+                self.seek(shared_mem, 0.0)
+            elif not self.finished:
+                logging.info(f"Replay of {self.path} finished")
+                self.finished = True
+            return shared_mem
+
+        if self.speed:
+            # Everything up to the current replay time, a late step only publishes the newest value of every field
+            end = self.reader.search(self.log_start + (time.monotonic() - self.play_start) * self.speed)
+        else:
+            ticks = self.reader.index["tick"]
+            end = self.position + int(np.searchsorted(ticks[self.position:], ticks[self.position], side="right"))
+
+        self.publish(shared_mem, self.reader.latest(self.position, end))
+        self.position = max(self.position, end)
+        return shared_mem
+
+    def configure(self, **changes) -> None:
+        # Continue from the current replay time at the new speed
+        if "speed" in changes and self.play_start is not None:
+            now = time.monotonic()
+            if self.speed:
+                self.log_start += (now - self.play_start) * self.speed
+            elif self.position < len(self.reader):
+                self.log_start = float(self.reader.times[self.position])
+            self.play_start = now
+        super().configure(**changes)
+
+    def seek(self, shared_mem: SharedMem, seconds: float) -> None:
+        """Jump to the given seconds into the log and publish the newest value of every field up to there"""
+        self.position = self.reader.search(seconds)
+        self.play_start = time.monotonic()
+        self.log_start = seconds
+        self.finished = False
+        self.publish(shared_mem, self.reader.latest(0, self.position))
+
+    def publish(self, shared_mem: SharedMem, positions: list) -> None:
+        """Publish the entries at the given positions as if they were produced now"""
+        fields = {}
+        for position in positions:
+            name, value = self.reader.record(position)
+            if name == "servo_vals":
+                value.stamp_ns = time.monotonic_ns()
+                value.wall_ns = time.time_ns()
+            fields[name] = value
+        if fields:
+            shared_mem.update(fields)
+
+    def deinit(self) -> None:
+        logging.info("Deinitializing Player")
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
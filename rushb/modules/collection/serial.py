@@ -1,20 +1,286 @@
+import copy
 import serial
 import logging
-from io import TextIOWrapper, BufferedRWPair
+import struct
+import threading
+import time
 
+from rushb.metrics import metrics
 from rushb.modules.rb_module import *
-from rushb.sharedmem.shared_mem import ServoVals, Servos
+from rushb.sharedmem.shared_mem import ServoVals, Servos, Telemetry
+
+# Binary servo frame: 2 start bytes, a sequence number the microcontroller acknowledges,
+# the left, right and camera servo values in hundredths of a degree as little endian
+# uint16, and the 8 bit sum of the sequence number and the servo values
+BINARY_START = b"\xaa\x55"
+BINARY_PAYLOAD = struct.Struct("<B3H")
+
+# Telemetry frame: 2 start bytes, frame type, payload length, payload,
+# and the 8 bit sum of the frame type, payload length and payload
+TELEMETRY_START = b"\xaa\x56"
+TELEMETRY_HEADER = struct.Struct("<BB")
+
+# Telemetry frame types and their payloads
+TELEMETRY_SERVOS = 0x01  # servo positions in hundredths of a degree as uint16
+TELEMETRY_BATTERY = 0x02  # battery voltage in millivolts as uint16
+TELEMETRY_ACK = 0x03  # sequence number of the acknowledged servo frame
+TELEMETRY_PAYLOADS = {
+    TELEMETRY_SERVOS: struct.Struct("<3H"),
+    TELEMETRY_BATTERY: struct.Struct("<H"),
+    TELEMETRY_ACK: struct.Struct("<B"),
+}
+
+
+class SerialWriterThread(threading.Thread):
+    """SerialWriterThread writes the newest submitted message to the serial port,
+    messages submitted while a write is running replace each other"""
+
+    def __init__(self, serial_port: serial.Serial, sent_times: dict = None) -> None:
+        super().__init__(name="SerialWriterThread", daemon=True)
+        self.serial_port: serial.Serial = serial_port
+        # Send times of the written binary frames by sequence number, replaced frames are never written
+        self.sent_times: dict = sent_times if sent_times is not None else {}
+        self.condition: threading.Condition = threading.Condition()
+        self.pending: bytes = None
+        self.pending_stamp_ns: int = None
+        self.pending_seq: int = None
+        self.running: bool = False
+        self.error: Exception = None
+
+    def start(self) -> None:
+        self.running = True
+        super().start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the writer thread and wait for it to finish"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def submit(self, message: bytes, stamp_ns: int = None, seq: int = None) -> None:
+        """Hand the newest message to the writer thread without blocking. The monotonic
+        time in ns its values were produced at is used to measure the latency, the
+        sequence number of a binary frame to match its acknowledgement"""
+        if self.error is not None:
+            raise RuntimeError("Serial writer thread failed") from self.error
+
+        with self.condition:
+            self.pending, self.pending_stamp_ns, self.pending_seq = message, stamp_ns, seq
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                message, stamp_ns, seq, self.pending = self.pending, self.pending_stamp_ns, self.pending_seq, None
+
+            if seq is not None:
+                self.sent_times[seq] = time.monotonic()
+            try:
+                self.serial_port.write(message)
+                self.serial_port.flush()
+            except Exception as e:
+                logging.error(f"Error while writing to the serial port: {e}")
+                self.error = e
+                return
+            observe_serial_latency(stamp_ns)
+
+
+def observe_serial_latency(stamp_ns: int) -> None:
+    """Record the time from producing the servo values to writing them to the serial port"""
+    if metrics.enabled and stamp_ns is not None:
+        metrics.histogram("latency.servo_vals.input_to_serial", "ms").observe((time.monotonic_ns() - stamp_ns) / 1e6)
+
+
+class SerialReaderThread(threading.Thread):
+    """SerialReaderThread reads telemetry frames from the serial port and keeps
+    the latest reported values. Frames are parsed in place from a byte buffer,
+    acknowledgements are matched with the send times of the servo frames"""
+
+    def __init__(self, serial_port: serial.Serial, sent_times: dict = None) -> None:
+        super().__init__(name="SerialReaderThread", daemon=True)
+        self.serial_port: serial.Serial = serial_port
+        # Monotonic send time of the servo frames by sequence number, filled by the writer
+        self.sent_times: dict = sent_times if sent_times is not None else {}
+        self.buffer: bytearray = bytearray()
+
+        self.lock: threading.Lock = threading.Lock()
+        self.telemetry: Telemetry = Telemetry()
+        self.published_frames: int = 0
+        self.running: bool = False
+        self.error: Exception = None
+
+    def start(self) -> None:
+        self.running = True
+        super().start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the reader thread, it exits after the current read times out"""
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self) -> None:
+        while self.running:
+            try:
+                data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+            except Exception as e:
+                logging.error(f"Error while reading from the serial port: {e}")
+                self.error = e
+                return
+            if data:
+                self.feed(data)
+
+    def feed(self, data: bytes) -> None:
+        """Parse all complete telemetry frames in the buffer, partial frames are kept"""
+        self.buffer += data
+        pos = 0
+        with memoryview(self.buffer) as view:
+            while True:
+                start = self.buffer.find(TELEMETRY_START, pos)
+                if start < 0:
+                    # Keep a trailing byte, it may be the first start byte of the next frame
+                    pos = max(pos, len(self.buffer) - 1)
+                    break
+
+                header_end = start + len(TELEMETRY_START) + TELEMETRY_HEADER.size
+                if header_end > len(self.buffer):
+                    pos = start
+                    break
+                frame_type, length = TELEMETRY_HEADER.unpack_from(view, start + len(TELEMETRY_START))
+                end = header_end + length + 1
+                if end > len(self.buffer):
+                    pos = start
+                    break
+
+                if sum(view[start + len(TELEMETRY_START):end - 1]) & 0xFF != view[end - 1]:
+                    # Resynchronize on the next start bytes
+                    with self.lock:
+                        self.telemetry.errors += 1
+                    pos = start + 1
+                    continue
+
+                self.handle_frame(frame_type, view[header_end:end - 1])
+                pos = end
+        del self.buffer[:pos]
+
+    def handle_frame(self, frame_type: int, payload: memoryview) -> None:
+        """Apply a single telemetry frame to the latest values"""
+        now = time.monotonic()
+        payload_format = TELEMETRY_PAYLOADS.get(frame_type)
+        with self.lock:
+            if payload_format is None or len(payload) != payload_format.size:
+                self.telemetry.errors += 1
+                return
+
+            self.telemetry.frames += 1
+            if frame_type == TELEMETRY_SERVOS:
+                self.telemetry.servo_positions = [value / 100 for value in payload_format.unpack(payload)]
+            elif frame_type == TELEMETRY_BATTERY:
+                self.telemetry.battery_voltage = payload_format.unpack(payload)[0] / 1000
+            elif frame_type == TELEMETRY_ACK:
+                seq = payload_format.unpack(payload)[0]
+                self.telemetry.last_ack = seq
+                sent_time = self.sent_times.pop(seq, None)
+                if sent_time is not None:
+                    self.add_rtt(now - sent_time)
+
+    def add_rtt(self, rtt: float) -> None:
+        telemetry = self.telemetry
+        telemetry.rtt = rtt
+        telemetry.rtt_mean = rtt if telemetry.rtt_mean is None else 0.9 * telemetry.rtt_mean + 0.1 * rtt
+        telemetry.rtt_max = rtt if telemetry.rtt_max is None else max(telemetry.rtt_max, rtt)
+
+    def publish(self, shared_mem: SharedMem) -> None:
+        """Copy the latest telemetry into the shared memory if frames arrived since the last call"""
+        if self.error is not None:
+            raise RuntimeError("Serial reader thread failed") from self.error
+
+        with self.lock:
+            if self.telemetry.frames + self.telemetry.errors == self.published_frames:
+                return
+            self.published_frames = self.telemetry.frames + self.telemetry.errors
+            telemetry = copy.copy(self.telemetry)
+        shared_mem.update({"telemetry": telemetry})
+
+
+class SerialReader(RBModule):
+    """SerialReader is a class that reads the telemetry of the microcontroller from the serial port"""
+
+    def __init__(self, **kwargs) -> None:
+        self.serial_port = None
+        self.port = kwargs.get("port")
+        self.baudrate = kwargs.get("baudrate")
+        self.reader_thread: SerialReaderThread = None
+
+    def init(self) -> None:
+        """Initialize the serial port and start reading"""
+        logging.info("Initializing SerialReader")
+
+        # Check if the serial port name and baudrate are not None
+        if self.port is None or self.baudrate is None:
+            raise ValueError("The port and baudrate cannot be None")
+
+        try:
+            self.serial_port = serial.Serial(self.port, self.baudrate, timeout=0.1)
+        except Exception as e:
+            logging.error(f"Error while initializing the serial port: {e}")
+            raise e
+
+        self.reader_thread = SerialReaderThread(self.serial_port)
+        self.reader_thread.start()
+
+    def step(self, shared_mem: SharedMem) -> SharedMem:
+        """Publishes the latest telemetry to the shared memory"""
+        self.reader_thread.publish(shared_mem)
+        return shared_mem
+
+    def deinit(self) -> None:
+        """Stop reading and release the serial port"""
+        logging.info("Deinitializing SerialReader")
+        try:
+            if self.reader_thread is not None:
+                self.reader_thread.stop()
+                self.reader_thread = None
+            self.serial_port.close()
+        except Exception as e:
+            logging.error(f"Error while deinitializing the serial port: {e}")
+            raise e
 
 
 class SerialWriter(RBModule):
     """SerialWriter is a class that writes the servo values to the serial port"""
 
+    parameters = ("keep_alive",)
+
     def __init__(self, **kwargs) -> None:
         self.serial_port = None
-        self.sio = None
         self.port = kwargs.get("port")
         self.baudrate = kwargs.get("baudrate")
 
+        # protocol: TEXT, BINARY
+        self.protocol: str = kwargs.get("protocol", "TEXT")
+        # Only write when the values change, unchanged values are written again every keep_alive seconds if set
+        self.keep_alive: float = kwargs.get("keep_alive")
+        # Write on a dedicated thread so step never blocks on the port
+        self.threaded: bool = kwargs.get("threaded", False)
+        self.writer_thread: SerialWriterThread = None
+        # Read the telemetry and acknowledgements of the microcontroller from the same port
+        self.duplex: bool = kwargs.get("duplex", False)
+        self.reader_thread: SerialReaderThread = None
+
+        self.last_values: list = None
+        self.last_write: float = None
+        self.last_stamp_ns: int = None
+        # Sequence number of the next binary servo frame and the send times of the unacknowledged ones
+        self.seq: int = 0
+        self.sent_times: dict = {}
+
     def init(self) -> None:
         """Initialize the serial port"""
         logging.info("Initializing SerialWriter")
@@ -23,23 +289,65 @@ class SerialWriter(RBModule):
         if self.port is None or self.baudrate is None:
             raise ValueError("The port and baudrate cannot be None")
 
+        # Check if the protocol is supported
+        if self.protocol not in ("TEXT", "BINARY"):
+            raise ValueError(f"Unknown serial protocol {self.protocol}")
+
         try:
-            self.serial_port = serial.Serial(self.port, self.baudrate, timeout=1)
-            self.sio: TextIOWrapper = TextIOWrapper(BufferedRWPair(self.serial_port, self.serial_port))
+            self.serial_port = serial.Serial(self.port, self.baudrate, timeout=0.1, write_timeout=1)
         except Exception as e:
             logging.error(f"Error while initializing the serial port: {e}")
             raise e
 
+        if self.threaded:
+            self.writer_thread = SerialWriterThread(self.serial_port, self.sent_times)
+            self.writer_thread.start()
+
+        if self.duplex:
+            self.reader_thread = SerialReaderThread(self.serial_port, self.sent_times)
+            self.reader_thread.start()
+
     def step(self, shared_mem: SharedMem) -> SharedMem:
         """Writes the servo values to the serial port"""
-        servo_vals = SerialWriter.prep_servo_vals(shared_mem.servo_vals)
-        logging.debug(f"Servo values to written to serial port {self.serial_port}: {servo_vals}")
+        if self.reader_thread is not None:
+            self.reader_thread.publish(shared_mem)
+
+        # Published servo values are never changed in place, no lock is needed to read them
+        servo_vals = shared_mem.servo_vals
+
+        # Skip unchanged values, they are only written again once the keep alive interval passed
+        now = time.monotonic()
+        if servo_vals.values == self.last_values \
+                and (self.keep_alive is None or now - self.last_write < self.keep_alive):
+            return shared_mem
+        self.last_values, self.last_write = servo_vals.values, now
+
+        seq = None
+        if self.protocol == "BINARY":
+            seq = self.seq
+            message = SerialWriter.pack_servo_vals(servo_vals, seq)
+            self.seq = (self.seq + 1) & 0xFF
+        else:
+            message = SerialWriter.prep_servo_vals(servo_vals).encode("ascii")
+
+        # Only the first write of new servo values counts towards the latency, keep alive writes repeat old ones
+        stamp_ns = servo_vals.stamp_ns if servo_vals.stamp_ns != self.last_stamp_ns else None
+        self.last_stamp_ns = servo_vals.stamp_ns
+
+        logging.debug(f"Servo values to written to serial port {self.serial_port}: {message}")
+        if self.writer_thread is not None:
+            self.writer_thread.submit(message, stamp_ns, seq)
+            return shared_mem
+
+        if seq is not None:
+            self.sent_times[seq] = now
         try:
-            self.sio.write(servo_vals)
-            self.sio.flush()
+            self.serial_port.write(message)
+            self.serial_port.flush()
         except Exception as e:
             logging.error(f"Error while writing to the serial port: {e}")
             raise e
+        observe_serial_latency(stamp_ns)
 
         return shared_mem
 
@@ -47,8 +355,12 @@ class SerialWriter(RBModule):
         """Release the serial port"""
         logging.info("Deinitializing SerialWriter")
         try:
-            # TODO FIXME
-            #self.sio.close()
+            if self.writer_thread is not None:
+                self.writer_thread.stop()
+                self.writer_thread = None
+            if self.reader_thread is not None:
+                self.reader_thread.stop()
+                self.reader_thread = None
             self.serial_port.close()
         except Exception as e:
             logging.error(f"Error while deinitializing the serial port: {e}")
@@ -59,3 +371,11 @@ class SerialWriter(RBModule):
         """Prepares the servo values for writing to the serial port"""
         return f"!{servo_vals.values[Servos.LEFT]}@{servo_vals.values[Servos.RIGHT]}#" \
                f"{servo_vals.values[Servos.CAMERA]}$\n"
+
+    @staticmethod
+    def pack_servo_vals(servo_vals: ServoVals, seq: int = 0) -> bytes:
+        """Packs the servo values into a fixed size binary frame"""
+        values = [min(max(int(round(servo_vals.values[servo] * 100)), 0), 18000)
+                  for servo in (Servos.LEFT, Servos.RIGHT, Servos.CAMERA)]
+        payload = BINARY_PAYLOAD.pack(seq, *values)
+        return BINARY_START + payload + bytes([sum(payload) & 0xFF])
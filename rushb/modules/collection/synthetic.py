@@ -0,0 +1,74 @@
+import logging
+import math
+import time
+
+import numpy as np
+
+from rushb.modules.rb_module import *
+from rushb.sharedmem.shared_mem import ServoVals, Servos
+
+
+class SyntheticVideoCapture(RBModule):
+    """SyntheticVideoCapture publishes generated frames in place of a camera,
+    a noise image scrolling by a few pixels every frame"""
+
+    parameters = ("speed",)
+
+    def __init__(self, **kwargs) -> None:
+        self.width: int = kwargs.get("width", 640)
+        self.height: int = kwargs.get("height", 480)
+        # Pixels the image moves by per frame, so consecutive frames differ
+        self.speed: int = kwargs.get("speed", 4)
+        self.seed: int = kwargs.get("seed", 0)
+        self.image: np.ndarray = None
+        self.frame_index: int = 0
+
+    def init(self) -> None:
+        logging.info("Initializing SyntheticVideoCapture")
+        rng = np.random.default_rng(self.seed)
+        self.image = rng.integers(0, 256, size=(self.height, self.width, 3), dtype=np.uint8)
+
+    def step(self, shared_mem: SharedMem) -> SharedMem:
+        """Writes the next generated frame to the shared memory"""
+        self.frame_index += 1
+        # A new array per frame like a camera read, published frames must not be mutated
+        frame = np.roll(self.image, self.frame_index * self.speed, axis=1)
+        shared_mem.publish("video_frame", frame)
+        return shared_mem
+
+    def deinit(self) -> None:
+        logging.info("Deinitializing SyntheticVideoCapture")
+        self.image = None
+
+
+class ScriptedControls(RBModule):
+    """ScriptedControls drives the servos along sine waves in place of a
+    keyboard or joystick, the camera servo stays centered"""
+
+    parameters = ("period", "amplitude")
+
+    def __init__(self, **kwargs) -> None:
+        # Seconds per full sweep and the sweep around the center in degrees
+        self.period: float = kwargs.get("period", 2.0)
+        self.amplitude: float = kwargs.get("amplitude", 45)
+        self.start: float = None
+
+    def init(self) -> None:
+        logging.info("Initializing ScriptedControls")
+        self.start = time.monotonic()
+
+    def step(self, shared_mem: SharedMem) -> SharedMem:
+        phase = 2 * math.pi * (time.monotonic() - self.start) / self.period
+        values = [90] * len(Servos)
+        values[Servos.LEFT] = int(90 + self.amplitude * math.sin(phase))
+        values[Servos.RIGHT] = int(90 + self.amplitude * math.cos(phase))
+
+        # Only publish the values when they changed
+        with shared_mem.lock:
+            if values != shared_mem.servo_vals.values:
+                shared_mem.servo_vals = ServoVals(values)
+
+        return shared_mem
+
+    def deinit(self) -> None:
+        logging.info("Deinitializing ScriptedControls")
@@ -1,6 +1,71 @@
 import cv2
 import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from rushb.metrics import metrics
 from rushb.modules.rb_module import *
+from rushb.sharedmem.shared_mem import Detections
+from rushb.vision.boxes import scale_boxes
+
+
+class FrameGrabber(threading.Thread):
+    """FrameGrabber reads frames from an opened capture on a background
+    thread, so readers never wait for the camera"""
+
+    def __init__(self, video_capture: cv2.VideoCapture) -> None:
+        super().__init__(name="FrameGrabber", daemon=True)
+        self.video_capture: cv2.VideoCapture = video_capture
+
+        self.condition: threading.Condition = threading.Condition()
+        self.running: bool = False
+        self.error: Exception = None
+
+        # Sequence number, monotonic capture time and buffer of the newest frame
+        self.frame_seq: int = 0
+        self.frame_time: float = None
+        self.frame = None
+
+    def start(self) -> None:
+        self.running = True
+        super().start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop grabbing frames and wait for the thread to finish"""
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self) -> None:
+        while self.running:
+            # Every frame is read into a new array, published frames must not be mutated
+            ret, frame = self.video_capture.read()
+            frame_time = time.monotonic()
+            if not ret:
+                with self.condition:
+                    self.error = RuntimeError("Failed to capture frame")
+                    self.condition.notify_all()
+                return
+
+            with self.condition:
+                self.frame_seq += 1
+                self.frame_time = frame_time
+                self.frame = frame
+                self.condition.notify_all()
+
+    def latest(self, timeout: float) -> tuple:
+        """Get the sequence number, capture time and buffer of the newest frame.
+        Only waits when no frame has been captured yet"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None or self.error is not None, timeout)
+            if self.error is not None:
+                raise self.error
+            if self.frame is None:
+                raise RuntimeError(f"No frame captured within {timeout} seconds")
+            return self.frame_seq, self.frame_time, self.frame
 
 
 class VideoCapture(RBModule):
@@ -11,6 +76,19 @@ class VideoCapture(RBModule):
         self.video_capture = None
         self.camera_id = kwargs.get("camera_id")
 
+        # Optional capture properties, the driver defaults are used when not set
+        self.width: int = kwargs.get("width")
+        self.height: int = kwargs.get("height")
+        self.fps: float = kwargs.get("fps")
+        self.fourcc: str = kwargs.get("fourcc")
+        self.buffer_size: int = kwargs.get("buffer_size")
+
+        # Grab the frames on a background thread
+        self.threaded: bool = kwargs.get("threaded", False)
+        self.first_frame_timeout: float = kwargs.get("first_frame_timeout", 5.0)
+        self.frame_grabber: FrameGrabber = None
+        self.frame_seq: int = 0
+
     def init(self) -> None:
         # Initialize the video capture
         logging.info("Initializing VideoCapture")
@@ -21,28 +99,65 @@ class VideoCapture(RBModule):
 
         try:
             self.video_capture = cv2.VideoCapture(self.camera_id)
+            self.set_properties()
         except Exception as e:
             logging.error(f"Error while initializing the video capture: {e}")
             raise e
 
+        if self.threaded:
+            self.frame_grabber = FrameGrabber(self.video_capture)
+            self.frame_grabber.start()
+
     def step(self, shared_mem: SharedMem) -> SharedMem:
         """Writes the video frame to the shared memory"""
-        ret, frame = self.video_capture.read()
-        if not ret:
-            raise RuntimeError("Failed to capture frame")
+        if self.frame_grabber is not None:
+            frame_seq, frame_time, frame = self.frame_grabber.latest(self.first_frame_timeout)
+        else:
+            ret, frame = self.video_capture.read()
+            if not ret:
+                raise RuntimeError("Failed to capture frame")
+            frame_seq, frame_time = self.frame_seq + 1, time.monotonic()
 
-        shared_mem.video_frame = frame
+        # Nothing new was grabbed since the last step, keep the published frame
+        if frame_seq == self.frame_seq:
+            return shared_mem
+        if frame_seq - self.frame_seq > 1:
+            logging.debug(f"Skipped {frame_seq - self.frame_seq - 1} frames")
+        self.frame_seq = frame_seq
+
+        shared_mem.publish("video_frame", frame, frame_time)
         return shared_mem
 
     def deinit(self) -> None:
         # Release the video capture
         logging.info("Deinitializing VideoCapture")
         try:
+            if self.frame_grabber is not None:
+                self.frame_grabber.stop()
+                self.frame_grabber = None
             self.video_capture.release()
         except Exception as e:
             logging.error(f"Error while deinitializing the video capture: {e}")
             raise e
 
+    def set_properties(self) -> None:
+        """Apply the configured capture properties, the FOURCC has
+        to be set first since it limits the supported resolutions"""
+        properties = [
+            (cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc) if self.fourcc else None),
+            (cv2.CAP_PROP_FRAME_WIDTH, self.width),
+            (cv2.CAP_PROP_FRAME_HEIGHT, self.height),
+            (cv2.CAP_PROP_FPS, self.fps),
+            (cv2.CAP_PROP_BUFFERSIZE, self.buffer_size),
+        ]
+        for prop, value in properties:
+            if value is not None and not self.video_capture.set(prop, value):
+                logging.warning(f"Capture property {prop} could not be set to {value}")
+
+        logging.info(f"Capturing {self.video_capture.get(cv2.CAP_PROP_FRAME_WIDTH):.0f}x"
+                     f"{self.video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT):.0f} at "
+                     f"{self.video_capture.get(cv2.CAP_PROP_FPS):.0f} fps")
+
 
 class VideoViewer(RBModule):
     """VideoViewer is a class that displays the video feed from the shared memory"""
@@ -52,11 +167,22 @@ class VideoViewer(RBModule):
         self.height = kwargs.get("height")
         self.width = kwargs.get("width")
 
+        # Overlay the detections on a copy of the frame before showing it
+        self.draw_detections: bool = kwargs.get("draw_detections", False)
+        self.labels_path: str = kwargs.get("labels_path")
+        self.class_names: list[str] = []
+        self.class_colors = []
+        # Sequence numbers of the last shown frame and detections
+        self.shown_seqs: tuple = None
+
     def init(self) -> None:
         # Check if the height and width are not None
         if self.height is None or self.width is None:
             raise ValueError("The height and width cannot be None")
 
+        if self.draw_detections:
+            self.read_classes()
+
         try:
             logging.info("Initializing VideoViewer")
             # Initialize the display window
@@ -69,15 +195,30 @@ class VideoViewer(RBModule):
 
     def step(self, shared_mem: SharedMem) -> SharedMem:
         # Get the video frame from the shared memory
-        frame = shared_mem.video_frame
+        frame_slot = shared_mem.read("video_frame")
+        frame = frame_slot.value
 
         # Check if the frame is empty
         if frame is None:
             logging.warning("Video frame is empty")
-            return
+            return shared_mem
+
+        # Only redraw when the frame or the shown detections changed, the window is still serviced
+        detections_slot = shared_mem.read("detections")
+        seqs = (frame_slot.seq, detections_slot.seq if self.draw_detections else None)
+        if seqs != self.shown_seqs:
+            self.shown_seqs = seqs
+
+            # Draw on a copy, the frame is shared with the other modules
+            detections = detections_slot.value
+            if self.draw_detections and len(detections) != 0:
+                frame = self.draw_bounding_boxes(detections, frame.copy())
 
-        # Show the frame
-        cv2.imshow("Video", frame)
+            # Show the frame
+            cv2.imshow("Video", frame)
+            if metrics.enabled and frame_slot.time is not None:
+                metrics.histogram("latency.video_frame.capture_to_display", "ms").observe(
+                    (time.monotonic() - frame_slot.time) * 1e3)
         cv2.waitKey(1)
 
         return shared_mem
@@ -90,3 +231,50 @@ class VideoViewer(RBModule):
         except Exception as e:
             logging.error(f"Error while deinitializing the video viewer: {e}")
             raise e
+
+    def read_classes(self) -> None:
+        """Reads the classes from the labels file and
+        creates a list of colors for each class"""
+
+        # Check if the labels path is not None
+        if self.labels_path is None:
+            raise ValueError("Labels path is not set")
+
+        # Check if the labels file exists
+        if not os.path.exists(self.labels_path):
+            raise FileNotFoundError(f"Labels file not found at {self.labels_path}")
+
+        try:
+            logging.info(f"Reading classes from {self.labels_path}")
+            with open(self.labels_path, "r") as f:
+                self.class_names = [cname.strip() for cname in f.readlines()]
+
+            self.class_colors = np.random.uniform(0, 255, size=(len(self.class_names), 3))
+        except Exception as e:
+            logging.error(f"Error reading classes from {self.labels_path}")
+            raise e
+
+    def draw_bounding_boxes(self, detections: Detections, image):
+        """Draw the bounding boxes of the detections on the image"""
+
+        try:
+            h, w, c = image.shape
+            # Scale all the boxes to pixels at once
+            pixel_boxes = scale_boxes(detections.boxes, h, w).tolist()
+            class_confidences = np.round(100 * detections.scores).astype(np.int32).tolist()
+            for (y_min, x_min, y_max, x_max), class_index, class_confidence in zip(
+                    pixel_boxes, detections.class_ids.tolist(), class_confidences):
+                class_label = self.class_names[class_index - 1]
+                color = tuple(self.class_colors[class_index - 1])
+
+                # Text to be displayed on the bounding box
+                display_text = f"{class_label} {class_confidence}%"
+
+                # Draw the bounding box and the text
+                cv2.rectangle(image, (x_min, y_min), (x_max, y_max), color, 2)
+                cv2.putText(image, display_text, (x_min, y_min - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        except Exception as e:
+            logging.error("Error drawing bounding boxes")
+            raise e
+
+        return image
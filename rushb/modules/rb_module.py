@@ -1,11 +1,16 @@
 from abc import ABC, abstractmethod
+from rushb.modules.registry import find_module
 from rushb.sharedmem.shared_mem import SharedMem
 
+import asyncio
 import importlib
 import logging
 
 
 class RBModule(ABC):
+    # Config keys that configure applies to the running module, changing any other key initializes it again
+    parameters: tuple = ()
+
     @abstractmethod
     def init(self) -> None:
         raise NotImplementedError()
@@ -14,27 +19,44 @@ class RBModule(ABC):
     def step(self, shared_mem: SharedMem) -> SharedMem:
         raise NotImplementedError()
 
+    async def astep(self, shared_mem: SharedMem) -> SharedMem:
+        """Step of the asyncio runtime, modules that wait on I/O override it to await
+        instead of block. Runs the synchronous step on the executor of the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.step, shared_mem)
+
     @abstractmethod
     def deinit(self) -> None:
         raise NotImplementedError()
 
+    def configure(self, **changes) -> None:
+        """Apply changed parameters to the running module, by default
+        they replace the attributes of the same name"""
+        for key, value in changes.items():
+            setattr(self, key, value)
+
+
+def has_astep(module: RBModule) -> bool:
+    """Check if the module implements its own async step"""
+    return type(module).astep is not RBModule.astep
+
 
 def create_module(**kwargs) -> RBModule:
     """Create a module based on the module name and the kwargs"""
 
-    # Get the module name
-    module_name: str = kwargs.get("module_name")
     # Get the module class
     module_class: str = kwargs.get("module_class")
 
-    # Check if the module name is None
-    if module_name is None:
-        raise ValueError("The module name cannot be None")
-
     # Check if the module class is None
     if module_class is None:
         raise ValueError("The module class cannot be None")
 
+    # Get the module name, it is looked up in the index when not set
+    module_name: str = kwargs.get("module_name") or find_module(module_class)
+
+    # Check if the module name is None
+    if module_name is None:
+        raise ValueError(f"The module name of {module_class} cannot be None, it is not in the collection")
+
     # Import the module
     try:
         module = importlib.import_module(f"rushb.modules.collection.{module_name}")
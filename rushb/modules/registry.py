@@ -0,0 +1,53 @@
+import ast
+import logging
+import os
+
+# Directory of the module collection, every file is a module_name
+COLLECTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "collection")
+
+# File of the collection every module class is defined in, so creating a
+# module only imports its own file. New modules are found by discover_modules
+# until they are added here
+MODULE_INDEX: dict[str, str] = {
+    "ServoReader": "debug",
+    "ServoWriter": "debug",
+    "JoyStickControls": "driving_controls",
+    "KeyboardControls": "driving_controls",
+    "ObjectDetector": "object_detector",
+    "Recorder": "recording",
+    "Player": "recording",
+    "SerialReader": "serial",
+    "SerialWriter": "serial",
+    "ScriptedControls": "synthetic",
+    "SyntheticVideoCapture": "synthetic",
+    "VideoCapture": "video",
+    "VideoViewer": "video",
+}
+
+
+def discover_modules(collection_dir: str = COLLECTION_DIR) -> dict[str, str]:
+    """Find the RBModule subclasses of the collection by parsing its files, nothing is imported"""
+    index = {}
+    for file_name in sorted(os.listdir(collection_dir)):
+        module_name, extension = os.path.splitext(file_name)
+        if extension != ".py" or module_name.startswith("_"):
+            continue
+        with open(os.path.join(collection_dir, file_name), "r") as f:
+            tree = ast.parse(f.read(), file_name)
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and any(
+                    isinstance(base, ast.Name) and base.id == "RBModule" for base in node.bases):
+                index[node.name] = module_name
+    return index
+
+
+def find_module(module_class: str) -> str:
+    """Name of the collection file that defines the module class, None if there is none"""
+    if module_class in MODULE_INDEX:
+        return MODULE_INDEX[module_class]
+
+    module_name = discover_modules().get(module_class)
+    if module_name is not None:
+        logging.debug(f"Module {module_class} is not in the index, found it in {module_name}")
+        MODULE_INDEX[module_class] = module_name
+    return module_name
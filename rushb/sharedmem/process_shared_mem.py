@@ -0,0 +1,239 @@
+import logging
+import multiprocessing
+import struct
+import time
+
+from enum import Enum
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from rushb.connection.codec import SERVO_FORMAT, DETECTIONS_FORMAT, encode_servo_vals, decode_servo_vals, \
+    encode_detections, decode_detections
+from rushb.sharedmem.shared_mem import *
+
+# Sequence number at the start of every record and ring header
+SEQ_FORMAT = struct.Struct("<Q")
+
+# Sequence number, time and length of a record, followed by the encoded value
+RECORD_HEADER = struct.Struct("<QdI")
+
+# Sequence number and time of the newest frame of a ring, followed by the frames
+RING_HEADER = struct.Struct("<Qd")
+
+# Encoder and decoder of the fields kept in shared records, the record header has the time
+RECORD_CODECS = {
+    "servo_vals": (encode_servo_vals, decode_servo_vals),
+    "detections": (encode_detections, lambda frames: decode_detections(frames)[0]),
+}
+
+
+class SharedMemType(Enum):
+    THREAD = "THREAD"
+    PROCESS = "PROCESS"
+
+
+def _close(shm: shared_memory.SharedMemory, unlink: bool) -> None:
+    """Close a shared memory block and remove it if this process created it"""
+    try:
+        shm.close()
+    except BufferError:
+        # Frames handed out to the modules still point into the block, it is unmapped on exit
+        logging.debug(f"Shared memory {shm.name} is still in use, leaving it mapped")
+    if unlink:
+        shm.unlink()
+
+
+def _open(name: str, size: int, create: bool) -> shared_memory.SharedMemory:
+    """Open a named shared memory block, a block of the same name left over by a crashed run is replaced"""
+    if create:
+        try:
+            return shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            logging.warning(f"Removing shared memory {name} left over by a previous run")
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+    return shared_memory.SharedMemory(name=name, create=create, size=size)
+
+
+class SharedRecord:
+    """SharedRecord keeps the newest encoded value of a field in a named shared memory block"""
+
+    def __init__(self, name: str, capacity: int, create: bool) -> None:
+        self.capacity: int = capacity
+        self.shm = _open(name, RECORD_HEADER.size + capacity, create)
+        if create:
+            RECORD_HEADER.pack_into(self.shm.buf, 0, 0, 0.0, 0)
+
+    def header(self) -> tuple:
+        """Sequence number, time and length of the newest value"""
+        return RECORD_HEADER.unpack_from(self.shm.buf, 0)
+
+    def write(self, data: bytes, timestamp: float) -> int:
+        """Store a new value, the caller holds the lock"""
+        if len(data) > self.capacity:
+            raise ValueError(f"Value of {len(data)} bytes does not fit in shared memory {self.shm.name} "
+                             f"of {self.capacity} bytes")
+
+        seq = self.header()[0] + 1
+        self.shm.buf[RECORD_HEADER.size:RECORD_HEADER.size + len(data)] = data
+        RECORD_HEADER.pack_into(self.shm.buf, 0, seq, timestamp, len(data))
+        return seq
+
+    def read(self, length: int) -> bytes:
+        """Copy of the newest value, the caller holds the lock"""
+        return bytes(self.shm.buf[RECORD_HEADER.size:RECORD_HEADER.size + length])
+
+    def close(self, unlink: bool) -> None:
+        _close(self.shm, unlink)
+
+
+class FrameRing:
+    """FrameRing keeps the newest video frames in a ring of preallocated
+    arrays in a named shared memory block. Frames are copied out of the ring,
+    the writer reuses a slot once slots - 1 newer frames were written"""
+
+    def __init__(self, name: str, shape: tuple, dtype: str, slots: int, create: bool) -> None:
+        # The newest frame is read while the writer fills the next slot
+        if slots < 2:
+            raise ValueError(f"A frame ring needs at least 2 slots, got {slots}")
+        self.shape: tuple = tuple(shape)
+        frame_size = int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        self.shm = _open(name, RING_HEADER.size + slots * frame_size, create)
+        self.frames = np.ndarray((slots, *self.shape), dtype, buffer=self.shm.buf, offset=RING_HEADER.size)
+        if create:
+            RING_HEADER.pack_into(self.shm.buf, 0, 0, 0.0)
+
+    def header(self) -> tuple:
+        """Sequence number and time of the newest frame"""
+        return RING_HEADER.unpack_from(self.shm.buf, 0)
+
+    def write(self, frame: np.ndarray, timestamp: float, lock) -> int:
+        """Copy a frame into the next slot and publish it under the lock.
+        There must only be a single writer"""
+        if frame.shape != self.shape:
+            raise ValueError(f"Video frame of shape {frame.shape} does not fit in a ring of shape {self.shape}, "
+                             f"set the frame_shape of the shared memory")
+
+        seq = self.header()[0] + 1
+        np.copyto(self.frames[(seq - 1) % len(self.frames)], frame)
+        with lock:
+            RING_HEADER.pack_into(self.shm.buf, 0, seq, timestamp)
+        return seq
+
+    def frame(self, seq: int) -> np.ndarray:
+        """Copy of the frame with the given sequence number, None if its slot was reused while copying"""
+        frame = self.frames[(seq - 1) % len(self.frames)].copy()
+        # The slot of the frame is written again after the header passed slots - 1 newer frames
+        if self.header()[0] >= seq + len(self.frames) - 1:
+            return None
+        return frame
+
+    def close(self, unlink: bool) -> None:
+        del self.frames
+        _close(self.shm, unlink)
+
+
+class ProcessSharedMem(SharedMem):
+    """ProcessSharedMem is a SharedMem whose servo values, video frames and
+    detections live in named shared memory blocks, so modules in worker
+    processes attach to the same data without copying it through sockets.
+    Video frames are kept in a ring of preallocated arrays, servo values and
+    detections as encoded records. The lock is shared by all the processes.
+    Every shared field must only be published by a single module, the other
+    fields stay local to each process"""
+
+    def __init__(self, name: str = "rushb", frame_shape: tuple = (480, 640, 3), frame_dtype: str = "uint8",
+                 frame_slots: int = 4, max_detections: int = 100, create: bool = True, lock=None) -> None:
+        super().__init__()
+        self.name: str = name
+        self.frame_shape: tuple = tuple(frame_shape)
+        self.frame_dtype: str = frame_dtype
+        self.frame_slots: int = frame_slots
+        self.max_detections: int = max_detections
+        self.owner: bool = create
+        self.lock = multiprocessing.RLock() if lock is None else lock
+
+        # Each detection is 4 box coordinates, a class id and a score, all 4 bytes wide
+        self.records: dict[str, SharedRecord] = {
+            "servo_vals": SharedRecord(f"{name}_servo_vals", SERVO_FORMAT.size, create),
+            "detections": SharedRecord(f"{name}_detections", DETECTIONS_FORMAT.size + max_detections * 24, create),
+        }
+        self.frame_ring: FrameRing = FrameRing(f"{name}_video_frame", self.frame_shape, frame_dtype,
+                                               frame_slots, create)
+        # Decoded slots of the shared fields, decoding is skipped while the sequence number is unchanged
+        self.shared_slots: dict[str, Slot] = {}
+
+    def publish(self, name: str, value, timestamp: float = None) -> Slot:
+        if name != "video_frame" and name not in self.records:
+            return super().publish(name, value, timestamp)
+
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if name == "video_frame":
+            if value is None:
+                raise ValueError("Shared video frames cannot be None")
+            seq = self.frame_ring.write(value, timestamp, self.lock)
+        else:
+            data = RECORD_CODECS[name][0](value)
+            with self.lock:
+                seq = self.records[name].write(data, timestamp)
+
+        slot = Slot(value, seq, timestamp)
+        self.shared_slots[name] = slot
+        return slot
+
+    def read(self, name: str) -> Slot:
+        if name != "video_frame" and name not in self.records:
+            return super().read(name)
+
+        # Peek at the sequence number without the lock, unchanged fields are returned from the cache
+        shm = self.frame_ring.shm if name == "video_frame" else self.records[name].shm
+        cached = self.shared_slots.get(name)
+        if cached is not None and SEQ_FORMAT.unpack_from(shm.buf, 0)[0] == cached.seq:
+            return cached
+
+        value = None
+        while value is None:
+            with self.lock:
+                if name == "video_frame":
+                    seq, timestamp = self.frame_ring.header()
+                    length = None
+                else:
+                    seq, timestamp, length = self.records[name].header()
+
+                if cached is not None and cached.seq == seq:
+                    return cached
+                # Nothing was published yet, keep the initial value
+                if seq == 0:
+                    return super().read(name)
+                data = self.records[name].read(length) if length is not None else None
+
+            if name == "video_frame":
+                # Published frames must not change, a frame whose slot was reused is read again at the newest one
+                value = self.frame_ring.frame(seq)
+            else:
+                value = RECORD_CODECS[name][1]([data])
+
+        slot = Slot(value, seq, timestamp)
+        self.shared_slots[name] = slot
+        return slot
+
+    def close(self) -> None:
+        """Detach from the shared memory blocks, the process that created them also removes them"""
+        self.shared_slots = {}
+        self.frame_ring.close(self.owner)
+        for record in self.records.values():
+            record.close(self.owner)
+
+    def attach_args(self) -> dict:
+        """Arguments a worker process attaches to the same blocks with, only the shared lock is passed along"""
+        return {"name": self.name, "frame_shape": self.frame_shape, "frame_dtype": self.frame_dtype,
+                "frame_slots": self.frame_slots, "max_detections": self.max_detections, "lock": self.lock,
+                "create": False}
+
+    def __getstate__(self) -> dict:
+        return self.attach_args()
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
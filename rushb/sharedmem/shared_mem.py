@@ -1,6 +1,10 @@
 from dataclasses import dataclass
-import datetime
+import threading
+import time
 from enum import IntEnum
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
 
 
 class Servos(IntEnum):
@@ -9,19 +13,156 @@ class Servos(IntEnum):
     CAMERA = 2
 
 
+def monotonic_to_wall_ns(monotonic: float) -> int:
+    """Wall clock time in ns of a monotonic time in seconds of this host"""
+    return time.time_ns() - round((time.monotonic() - monotonic) * 1e9)
+
+
+def wall_ns_to_monotonic(wall_ns: int) -> float:
+    """Monotonic time in seconds on this host of a wall clock time in ns,
+    across hosts this is only as accurate as their clock synchronization"""
+    return time.monotonic() - (time.time_ns() - wall_ns) / 1e9
+
+
 @dataclass
 class ServoVals:
     """"ServoVals is a class that holds the values for the servos
-    and the time that the values were last updated"""
+    and the time that the values were produced at"""
+
+    def __init__(self, values: list = None):
+        self.values = [90, 90, 90] if values is None else values
+        # Monotonic and wall clock time in ns, the monotonic stamp is only comparable on the same host
+        self.stamp_ns = time.monotonic_ns()
+        self.wall_ns = time.time_ns()
+
+
+class Detections:
+    """Detections holds the confident object detections of a video frame as arrays.
+    The boxes are rows of normalized [y_min, x_min, y_max, x_max] coordinates"""
+
+    def __init__(self, boxes=None, class_ids=None, scores=None, frame_seq: int = 0) -> None:
+        self.boxes = np.zeros((0, 4), np.float32) if boxes is None else np.asarray(boxes, np.float32)
+        self.class_ids = np.zeros(0, np.int32) if class_ids is None else np.asarray(class_ids, np.int32)
+        self.scores = np.zeros(0, np.float32) if scores is None else np.asarray(scores, np.float32)
+        # Sequence number of the video frame the detections belong to
+        self.frame_seq = frame_seq
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+
+class Telemetry:
+    """Telemetry holds the latest values reported by the microcontroller and
+    the round trip times of the servo commands it acknowledged, in seconds"""
+
+    def __init__(self) -> None:
+        self.servo_positions = None
+        self.battery_voltage = None
+        self.last_ack = None
+        self.rtt = None
+        self.rtt_mean = None
+        self.rtt_max = None
+        # Received frames and frames dropped because of a bad checksum or size
+        self.frames = 0
+        self.errors = 0
+
+
+class Slot(NamedTuple):
+    """Slot is a published value of a shared memory field together with
+    the sequence number of the publish and its monotonic time in seconds"""
+    value: Any
+    seq: int
+    time: Optional[float]
+
 
-    def __init__(self):
-        self.values = [90, 90, 90]
-        self.last_update = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+# Names of the shared memory fields, every field is kept in its own slot
+FIELDS = ("servo_vals", "video_frame", "detections", "telemetry")
+
+
+def _field(name: str) -> property:
+    """Attribute access to the value of a slot, assigning publishes a new value"""
+
+    def get(self):
+        return self.read(name).value
+
+    def set(self, value):
+        self.publish(name, value)
+
+    return property(get, set, doc=f"Latest published {name}")
 
 
 class SharedMem:
-    """SharedMem is a class that holds the data shared between all modules"""
+    """SharedMem is a class that holds the data shared between all modules.
+    Every field is kept in an immutable slot that is swapped as a whole on
+    publish, so readers always see a consistent value, sequence number and
+    time without taking the lock. Published values must not be mutated,
+    publish a new value instead. The lock serializes the publishers and has
+    to be held while a new value is derived from the current one"""
+
+    servo_vals = _field("servo_vals")
+    video_frame = _field("video_frame")
+    detections = _field("detections")
+    telemetry = _field("telemetry")
 
     def __init__(self) -> None:
-        self.servo_vals = ServoVals()
-        self.video_frame = None
+        self.lock = threading.RLock()
+        self.slots: dict[str, Slot] = {name: Slot(None, 0, None) for name in FIELDS}
+        self.slots["servo_vals"] = Slot(ServoVals(), 0, None)
+        self.slots["detections"] = Slot(Detections(), 0, None)
+        self.slots["telemetry"] = Slot(Telemetry(), 0, None)
+
+    @property
+    def video_frame_seq(self) -> int:
+        """Sequence number of the video frame"""
+        return self.read("video_frame").seq
+
+    @property
+    def video_frame_time(self) -> Optional[float]:
+        """Monotonic capture time of the video frame"""
+        return self.read("video_frame").time
+
+    def publish(self, name: str, value, timestamp: float = None) -> Slot:
+        """Replace the value of a field and bump its sequence number. The
+        time defaults to now, sources pass the time the value was captured"""
+        if name not in self.slots:
+            raise KeyError(f"Unknown shared memory field {name}")
+
+        with self.lock:
+            slot = Slot(value, self.slots[name].seq + 1, time.monotonic() if timestamp is None else timestamp)
+            self.slots[name] = slot
+        return slot
+
+    def read(self, name: str) -> Slot:
+        """Consistent snapshot of a field"""
+        if name not in self.slots:
+            raise KeyError(f"Unknown shared memory field {name}")
+        return self.slots[name]
+
+    def changed(self, name: str, seq: int) -> bool:
+        """Whether the field was published since the given sequence number was read"""
+        return self.read(name).seq != seq
+
+    def update(self, fields: dict, timestamps: dict = None) -> None:
+        """Publish the given fields by name, the other fields are left untouched.
+        Fields without a monotonic timestamp are stamped with the current time"""
+        timestamps = timestamps or {}
+        with self.lock:
+            for name, value in fields.items():
+                self.publish(name, value, timestamps.get(name))
+
+    def age(self, name: str) -> float:
+        """Seconds since the field was last published, infinite if it never was"""
+        update_time = self.read(name).time
+        if update_time is None:
+            return float("inf")
+        return time.monotonic() - update_time
+
+    def __getstate__(self) -> dict:
+        # Locks cannot be pickled, leave it out of the state
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
@@ -0,0 +1,146 @@
+import logging
+import mmap
+import os
+
+import numpy as np
+
+from rushb.connection.codec import *
+from rushb.sharedmem.shared_mem import *
+
+# Start of the data and the index file, followed by the records and the index entries
+LOG_MAGIC = b"RBLOG\x00\x00\x01"
+
+# Monotonic time the value was published at, raised to the time of the entry before so the
+# index stays sorted, tick of the recorder, field, offset and length of the encoded value
+INDEX_DTYPE = np.dtype([("time", "<f8"), ("tick", "<u8"), ("field", "u1"), ("offset", "<u8"), ("length", "<u4")])
+
+# Fields that can be logged, the values are stored in their wire encoding
+LOG_FIELDS = ("servo_vals", "video_frame", "detections")
+
+
+def index_path(path: str) -> str:
+    return f"{path}.idx"
+
+
+class LogWriter:
+    """LogWriter appends the published values of the shared memory fields to a
+    log. The data file holds the encoded values back to back, the index file
+    one fixed size entry per value. The data of a value is always written
+    before its index entry, so a log cut short by a crash stays readable"""
+
+    def __init__(self, path: str, video_codec: VideoCodec = VideoCodec.RAW, quality: int = 90,
+                 overwrite: bool = False) -> None:
+        self.path: str = path
+        self.video_codec: VideoCodec = video_codec
+        self.quality: int = quality
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        mode = "wb" if overwrite else "xb"
+        self.data_file = open(path, mode)
+        self.index_file = open(index_path(path), mode)
+        self.data_file.write(LOG_MAGIC)
+        self.index_file.write(LOG_MAGIC)
+        self.offset: int = len(LOG_MAGIC)
+        self.entry: np.ndarray = np.zeros(1, INDEX_DTYPE)
+        self.last_time: float = float("-inf")
+
+    def write(self, tick: int, name: str, value, timestamp: float) -> None:
+        """Append a value of a field, it is only visible to readers after flush"""
+        data = self.encode(name, value, timestamp)
+        # Values can be published with an earlier time than the value before, a frame
+        # carries its capture time. The index is searched by time and has to stay sorted
+        self.last_time = max(self.last_time, timestamp)
+        self.entry[0] = (self.last_time, tick, LOG_FIELDS.index(name), self.offset, len(data))
+        self.data_file.write(data)
+        self.index_file.write(self.entry.tobytes())
+        self.offset += len(data)
+
+    def encode(self, name: str, value, timestamp: float) -> bytes:
+        wall_ns = monotonic_to_wall_ns(timestamp)
+        if name == "servo_vals":
+            return encode_servo_vals(value)
+        if name == "video_frame":
+            return encode_video_frame(value, True, self.video_codec, self.quality, wall_ns)[0]
+        if name == "detections":
+            return encode_detections(value, wall_ns)
+        raise KeyError(f"Shared memory field {name} cannot be logged")
+
+    def flush(self) -> None:
+        self.data_file.flush()
+        self.index_file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+
+class LogReader:
+    """LogReader memory maps a log written by LogWriter. Values are decoded
+    straight from the mapping, raw video frames are views on it without a
+    copy. The index is searched by time to seek anywhere in the log"""
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.data_file = open(path, "rb")
+        self.data: mmap.mmap = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise ValueError(f"{path} is not a shared memory log")
+
+        with open(index_path(path), "rb") as index_file:
+            if index_file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+                raise ValueError(f"{index_path(path)} is not a shared memory log index")
+        # Leave out a partially written last entry
+        entries = (os.path.getsize(index_path(path)) - len(LOG_MAGIC)) // INDEX_DTYPE.itemsize
+        self.index: np.ndarray = np.zeros(0, INDEX_DTYPE)
+        if entries:
+            self.index = np.memmap(index_path(path), INDEX_DTYPE, "r", offset=len(LOG_MAGIC), shape=(entries,))
+        # and the entries whose data did not make it to disk, the data is appended in index order
+        ends = self.index["offset"] + self.index["length"]
+        self.index = self.index[:int(np.searchsorted(ends, len(self.data), side="right"))]
+        if len(self.index) < entries:
+            logging.warning(f"Dropped {entries - len(self.index)} incomplete entries of {path}")
+
+        # Seconds since the first value of every entry, logs of older versions are not sorted by time
+        self.times: np.ndarray = np.zeros(0)
+        if len(self.index):
+            self.times = np.maximum.accumulate(self.index["time"] - self.index["time"][0])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def record(self, position: int) -> tuple:
+        """Field name and decoded value of the entry at the given position"""
+        _, _, field, offset, length = self.index[position]
+        name = LOG_FIELDS[field]
+        frames = [memoryview(self.data)[offset:offset + length]]
+        if name == "servo_vals":
+            return name, decode_servo_vals(frames)
+        if name == "video_frame":
+            return name, decode_video_frame(frames)[0]
+        return name, decode_detections(frames)[0]
+
+    def search(self, seconds: float) -> int:
+        """Position after the last entry at or before the given seconds into the log"""
+        return int(np.searchsorted(self.times, seconds, side="right"))
+
+    def latest(self, start: int, end: int) -> list:
+        """Positions of the last entry of every field between the start and end position"""
+        fields = self.index["field"][start:end]
+        positions = []
+        for field in np.unique(fields):
+            positions.append(start + int(np.flatnonzero(fields == field)[-1]))
+        return sorted(positions)
+
+    def close(self) -> None:
+        try:
+            self.data.close()
+        except BufferError:
+            # Frames handed out to the modules still point into the mapping, it is unmapped on exit
+            logging.debug(f"Log {self.path} is still in use, leaving it mapped")
+        self.data_file.close()
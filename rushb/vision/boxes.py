@@ -0,0 +1,83 @@
+import numpy as np
+
+# Candidate count up to which NMS computes all pairwise overlaps at once
+MATRIX_NMS_LIMIT = 300
+
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    """Areas of [y_min, x_min, y_max, x_max] boxes"""
+    return np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Pairwise intersection over union of two arrays of boxes"""
+    y_min = np.maximum(boxes_a[:, np.newaxis, 0], boxes_b[np.newaxis, :, 0])
+    x_min = np.maximum(boxes_a[:, np.newaxis, 1], boxes_b[np.newaxis, :, 1])
+    y_max = np.minimum(boxes_a[:, np.newaxis, 2], boxes_b[np.newaxis, :, 2])
+    x_max = np.minimum(boxes_a[:, np.newaxis, 3], boxes_b[np.newaxis, :, 3])
+    intersection = np.maximum(y_max - y_min, 0) * np.maximum(x_max - x_min, 0)
+    union = box_areas(boxes_a)[:, np.newaxis] + box_areas(boxes_b)[np.newaxis, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, max_output_size: int,
+                        iou_threshold: float = 0.5, score_threshold: float = float("-inf"),
+                        class_ids: np.ndarray = None) -> np.ndarray:
+    """Greedy non-maximum suppression with the same semantics as
+    tf.image.non_max_suppression. Returns the indexes of the kept boxes
+    ordered by descending score. When class ids are given, boxes only
+    suppress boxes of the same class"""
+
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+
+    # Corners may be given in any order, sort them so every box is [y_min, x_min, y_max, x_max]
+    boxes = np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1)
+
+    # Shift the boxes of every class into their own region so different classes never overlap
+    if class_ids is not None and len(boxes) != 0:
+        offset = boxes.max() - boxes.min() + 1
+        boxes = boxes + (np.asarray(class_ids, dtype=np.float32) * offset)[:, np.newaxis]
+
+    candidates = np.flatnonzero(scores > score_threshold)
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    if max_output_size <= 0:
+        return np.zeros(0, dtype=np.int32)
+
+    # Few candidates are cheapest with all the pairwise overlaps computed at once
+    if len(order) <= MATRIX_NMS_LIMIT:
+        overlaps = iou_matrix(boxes[order], boxes[order]) > iou_threshold
+        suppressed = np.zeros(len(order), dtype=bool)
+        keep = []
+        for i in range(len(order)):
+            if suppressed[i]:
+                continue
+            keep.append(order[i])
+            if len(keep) == max_output_size:
+                break
+            suppressed |= overlaps[i]
+        return np.asarray(keep, dtype=np.int32)
+
+    # Many candidates are cheapest with one row of overlaps per kept box
+    areas = box_areas(boxes)
+    keep = []
+    while len(order) != 0 and len(keep) < max_output_size:
+        best, order = order[0], order[1:]
+        keep.append(best)
+
+        # Drop the remaining boxes that overlap the kept one too much
+        y_min = np.maximum(boxes[best, 0], boxes[order, 0])
+        x_min = np.maximum(boxes[best, 1], boxes[order, 1])
+        y_max = np.minimum(boxes[best, 2], boxes[order, 2])
+        x_max = np.minimum(boxes[best, 3], boxes[order, 3])
+        intersection = np.maximum(y_max - y_min, 0) * np.maximum(x_max - x_min, 0)
+        union = areas[best] + areas[order] - intersection
+        overlap = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+        order = order[overlap <= iou_threshold]
+
+    return np.asarray(keep, dtype=np.int32)
+
+
+def scale_boxes(boxes: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Scale normalized [y_min, x_min, y_max, x_max] boxes to integer pixel coordinates"""
+    return (np.asarray(boxes, dtype=np.float32) * np.array([height, width, height, width], np.float32)).astype(np.int32)
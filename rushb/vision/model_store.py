@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import urllib.request
+import zipfile
+
+# Size of the chunks models are downloaded and hashed in
+CHUNK_SIZE = 1 << 20
+
+# File in the extracted directory holding the SHA-256 of the archive it was extracted from
+EXTRACTED_STAMP = ".sha256"
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """ModelStore keeps downloaded models in a local cache keyed by their URL.
+    Every entry records the SHA-256 of the downloaded archive in a manifest,
+    downloads and extractions are written to a temporary path and moved into
+    place atomically, and in offline mode the network is never touched"""
+
+    def __init__(self, cache_dir: str, offline: bool = False) -> None:
+        self.cache_dir: str = cache_dir
+        self.offline: bool = offline
+
+    def entry_dir(self, url: str) -> str:
+        """Cache directory of a model URL"""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, key)
+
+    def read_manifest(self, url: str) -> dict:
+        manifest_path = os.path.join(self.entry_dir(url), "manifest.json")
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def write_manifest(self, url: str, manifest: dict) -> None:
+        entry_dir = self.entry_dir(url)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(entry_dir, "manifest.json"))
+
+    def fetch(self, url: str, sha256: str = None) -> str:
+        """Get the path of the cached archive of a model URL, downloading it
+        if it is not cached yet. Raises if the archive does not match the
+        expected SHA-256 or is missing in offline mode"""
+        entry_dir = self.entry_dir(url)
+        archive_path = os.path.join(entry_dir, os.path.basename(url))
+        manifest = self.read_manifest(url)
+
+        if os.path.exists(archive_path) and manifest.get("sha256"):
+            if sha256 is not None and manifest["sha256"] != sha256:
+                raise ValueError(f"Cached model {archive_path} has SHA-256 {manifest['sha256']}, expected {sha256}")
+            # The archive on disk may have been truncated or replaced since it was recorded
+            if file_sha256(archive_path) == manifest["sha256"]:
+                logging.info(f"Using cached model {archive_path}")
+                return archive_path
+            logging.warning(f"Cached model {archive_path} does not match its manifest")
+
+        if self.offline:
+            raise FileNotFoundError(f"Model {url} is not cached in {self.cache_dir} and the model store is offline")
+
+        os.makedirs(entry_dir, exist_ok=True)
+        digest = self.download(url, archive_path)
+        if sha256 is not None and digest != sha256:
+            os.remove(archive_path)
+            raise ValueError(f"Downloaded model {url} has SHA-256 {digest}, expected {sha256}")
+
+        self.write_manifest(url, {"url": url, "archive": os.path.basename(url), "sha256": digest})
+        return archive_path
+
+    @staticmethod
+    def download(url: str, archive_path: str) -> str:
+        """Download a file next to its destination, hashing it on
+        the way, and move it into place once it is complete"""
+        logging.info(f"Downloading model from {url}")
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive_path), suffix=".part")
+        try:
+            with urllib.request.urlopen(url) as response, os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.replace(tmp_path, archive_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest.hexdigest()
+
+    def extract(self, url: str, archive_path: str) -> str:
+        """Extract a cached archive once and return the extracted directory. The directory
+        is extracted again when it was extracted from another archive than the cached one"""
+        entry_dir = self.entry_dir(url)
+        extract_dir = os.path.join(entry_dir, "extracted")
+        sha256 = self.read_manifest(url).get("sha256")
+        if sha256 is not None and self.extracted_sha256(extract_dir) == sha256:
+            return extract_dir
+
+        if os.path.isdir(extract_dir):
+            # Move the stale tree aside first, the new one is moved into place in one step.
+            # Optimized forms were converted from the stale model as well
+            logging.info(f"Removing model {extract_dir} extracted from another archive")
+            stale_dir = tempfile.mkdtemp(dir=entry_dir, suffix=".stale")
+            os.replace(extract_dir, os.path.join(stale_dir, "extracted"))
+            shutil.rmtree(stale_dir)
+            shutil.rmtree(os.path.join(entry_dir, "optimized"), ignore_errors=True)
+
+        logging.info(f"Extracting model {archive_path}")
+        tmp_dir = tempfile.mkdtemp(dir=entry_dir, suffix=".extracting")
+        try:
+            if tarfile.is_tarfile(archive_path):
+                with tarfile.open(archive_path) as archive:
+                    # Refuse members that would land outside the extraction directory where supported
+                    if hasattr(tarfile, "data_filter"):
+                        archive.extractall(tmp_dir, filter="data")
+                    else:
+                        archive.extractall(tmp_dir)
+            elif zipfile.is_zipfile(archive_path):
+                with zipfile.ZipFile(archive_path) as archive:
+                    archive.extractall(tmp_dir)
+            else:
+                raise ValueError(f"Unsupported model archive {archive_path}")
+            with open(os.path.join(tmp_dir, EXTRACTED_STAMP), "w") as f:
+                f.write(sha256 or "")
+            os.replace(tmp_dir, extract_dir)
+        except OSError:
+            # Another process finished the same extraction first
+            if not os.path.isdir(extract_dir):
+                raise
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+
+        return extract_dir
+
+    @staticmethod
+    def extracted_sha256(extract_dir: str) -> str:
+        """SHA-256 of the archive a directory was extracted from, None if it is not known"""
+        try:
+            with open(os.path.join(extract_dir, EXTRACTED_STAMP), "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def optimized_path(self, url: str, file_name: str) -> str:
+        """Path of an optimized form of a cached model, it may not exist yet"""
+        return os.path.join(self.entry_dir(url), "optimized", file_name)
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+
+from rushb.sharedmem.shared_mem import Detections
+
+# Points tracked per box edge, every box is tracked with a grid of GRID_SIZE x GRID_SIZE points
+GRID_SIZE = 4
+
+
+def to_gray(frame: np.ndarray, width: int) -> np.ndarray:
+    """Downscale a BGR frame to the given width and convert it to gray"""
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    return cv2.cvtColor(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+
+def motion(gray_a: np.ndarray, gray_b: np.ndarray) -> float:
+    """Mean absolute gray level difference of two frames"""
+    return float(cv2.absdiff(gray_a, gray_b).mean())
+
+
+class BoxTracker:
+    """BoxTracker moves the boxes of the last detections along with the
+    image content using sparse optical flow on a grid of points per box,
+    so frames without a full detection still carry detections"""
+
+    def __init__(self) -> None:
+        self.prev_gray: np.ndarray = None
+        self.detections: Detections = Detections()
+        self.grid = (np.arange(GRID_SIZE, dtype=np.float32) + 0.5) / GRID_SIZE
+
+    def reset(self, gray: np.ndarray, detections: Detections) -> None:
+        """Start tracking new detections found on the given frame"""
+        self.prev_gray = gray
+        self.detections = detections
+
+    def track(self, gray: np.ndarray, frame_seq: int = 0) -> Detections:
+        """Move the tracked boxes to the given frame and return them as new detections"""
+        if self.prev_gray is None or len(self.detections) == 0 or gray.shape != self.prev_gray.shape:
+            self.prev_gray = gray
+            return Detections(self.detections.boxes, self.detections.class_ids, self.detections.scores, frame_seq)
+
+        height, width = gray.shape
+        boxes = self.detections.boxes
+
+        # Grid points inside every box in pixels, shape [boxes, points, 2] as x, y
+        ys = boxes[:, 0, np.newaxis] + (boxes[:, 2] - boxes[:, 0])[:, np.newaxis] * self.grid
+        xs = boxes[:, 1, np.newaxis] + (boxes[:, 3] - boxes[:, 1])[:, np.newaxis] * self.grid
+        points = np.stack(np.broadcast_arrays(xs[:, np.newaxis, :] * width, ys[:, :, np.newaxis] * height), axis=-1)
+        points = points.reshape(-1, 1, 2).astype(np.float32)
+
+        # Track all the points of all the boxes in a single call
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+        self.prev_gray = gray
+
+        # Every box moves by the median displacement of its tracked points, boxes without any stay put
+        displacement = (new_points - points).reshape(len(boxes), -1, 2)
+        displacement[status.reshape(len(boxes), -1) == 0] = np.nan
+        tracked = ~np.all(np.isnan(displacement[..., 0]), axis=1)
+        shift = np.zeros((len(boxes), 2), dtype=np.float32)
+        shift[tracked] = np.nanmedian(displacement[tracked], axis=1)
+
+        shift = shift / np.array([width, height], dtype=np.float32)
+        boxes = np.clip(boxes + np.concatenate([shift[:, ::-1], shift[:, ::-1]], axis=1), 0, 1)
+        self.detections = Detections(boxes, self.detections.class_ids, self.detections.scores, frame_seq)
+        return self.detections
+
+
+def crop_roi(frame: np.ndarray, roi: list) -> np.ndarray:
+    """Crop a frame to a normalized [y_min, x_min, y_max, x_max] region of interest"""
+    height, width = frame.shape[:2]
+    y_min, x_min, y_max, x_max = roi
+    return frame[int(y_min * height):int(y_max * height), int(x_min * width):int(x_max * width)]
+
+
+def roi_to_frame(detections: Detections, roi: list) -> Detections:
+    """Map detections found in a region of interest back to normalized frame coordinates"""
+    y_min, x_min, y_max, x_max = roi
+    scale = np.array([y_max - y_min, x_max - x_min, y_max - y_min, x_max - x_min], dtype=np.float32)
+    offset = np.array([y_min, x_min, y_min, x_min], dtype=np.float32)
+    return Detections(detections.boxes * scale + offset, detections.class_ids, detections.scores,
+                      detections.frame_seq)
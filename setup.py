@@ -21,7 +21,13 @@ setup(
     long_description_content_type="text/markdown",
     long_description=long_description,
     packages=find_packages(),
-    install_requires=['keyboard', 'opencv-python', 'tensorflow-gpu', 'pillow', 'zmq', 'PyYAML', 'pygame', 'pyserial'],
+    install_requires=['keyboard', 'opencv-python', 'numpy', 'pillow', 'zmq', 'PyYAML', 'pygame', 'pyserial'],
+    # Runtimes of the ObjectDetector backends, OpenCV DNN needs no extra package
+    extras_require={
+        'tf': ['tensorflow'],
+        'tflite': ['tflite-runtime'],
+        'onnx': ['onnxruntime'],
+    },
     keywords=['python', 'robotics', 'arduino', 'rasberry pi', 'computer vision', 'ai'],
     classifiers=[
         "Programming Language :: Python :: 3"
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from rushb.vision.boxes import MATRIX_NMS_LIMIT, non_max_suppression
+
+
+def reference_iou(box_a, box_b):
+    """Intersection over union of two [y_min, x_min, y_max, x_max] boxes in plain Python"""
+    height = max(min(box_a[2], box_b[2]) - max(box_a[0], box_b[0]), 0)
+    width = max(min(box_a[3], box_b[3]) - max(box_a[1], box_b[1]), 0)
+    intersection = height * width
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def reference_nms(boxes, scores, max_output_size, iou_threshold, score_threshold=float("-inf"), class_ids=None):
+    """Greedy NMS one box at a time, the definition the vectorized version has to match"""
+    keep = []
+    for index in sorted(range(len(scores)), key=lambda i: -scores[i]):
+        if scores[index] <= score_threshold or len(keep) == max_output_size:
+            continue
+        if all(class_ids is not None and class_ids[index] != class_ids[kept] or
+               reference_iou(boxes[index], boxes[kept]) <= iou_threshold for kept in keep):
+            keep.append(index)
+    return keep
+
+
+def random_boxes(rng, count):
+    corners = rng.random((count, 2, 2), dtype=np.float32)
+    sizes = rng.random((count, 2, 2), dtype=np.float32) * 0.3
+    return np.concatenate([corners[:, 0], corners[:, 0] + sizes[:, 0]], axis=1)
+
+
+@pytest.mark.parametrize("count", [0, 1, 20, MATRIX_NMS_LIMIT + 50])
+@pytest.mark.parametrize("class_aware", [False, True])
+def test_matches_reference(count, class_aware):
+    rng = np.random.default_rng(count)
+    boxes = random_boxes(rng, count)
+    scores = rng.permutation(count).astype(np.float32) / max(count, 1)
+    class_ids = rng.integers(0, 3, count) if class_aware else None
+
+    keep = non_max_suppression(boxes, scores, 50, 0.3, 0.1, class_ids)
+    assert keep.tolist() == reference_nms(boxes, scores, 50, 0.3, 0.1, class_ids)
+
+
+def test_overlapping_boxes_are_suppressed():
+    boxes = np.array([[0, 0, 1, 1], [0, 0, 1, 0.9], [2, 2, 3, 3]], dtype=np.float32)
+    scores = np.array([0.8, 0.9, 0.7], dtype=np.float32)
+    assert non_max_suppression(boxes, scores, 10, 0.5).tolist() == [1, 2]
+    assert non_max_suppression(boxes, scores, 1, 0.5).tolist() == [1]
+    assert non_max_suppression(boxes, scores, 0, 0.5).tolist() == []
+
+
+def test_corner_order_does_not_matter():
+    boxes = np.array([[0, 0, 1, 1], [1, 1, 0, 0]], dtype=np.float32)
+    scores = np.array([0.9, 0.8], dtype=np.float32)
+    assert non_max_suppression(boxes, scores, 10, 0.5).tolist() == [0]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from rushb.connection.codec import *
+
+
+def test_servo_vals_round_trip():
+    servo_vals = ServoVals([90, 45.5, np.int64(180)])
+    decoded = decode_servo_vals([encode_servo_vals(servo_vals)])
+    assert decoded.values == [90, 45.5, 180]
+    assert [type(value) for value in decoded.values] == [int, float, int]
+    assert decoded.wall_ns == servo_vals.wall_ns
+
+
+@pytest.mark.parametrize("single_part", [False, True])
+@pytest.mark.parametrize("shape, dtype", [((48, 64, 3), np.uint8), ((48, 64), np.uint8), ((8, 8), np.float32)])
+def test_raw_video_frame_round_trip(single_part, shape, dtype):
+    frame = np.random.default_rng(0).integers(0, 255, shape).astype(dtype)
+    decoded, wall_ns = decode_video_frame(encode_video_frame(frame, single_part, wall_ns=123))
+    assert wall_ns == 123
+    assert decoded.dtype == frame.dtype
+    np.testing.assert_array_equal(decoded, frame)
+
+
+def test_jpeg_video_frame_round_trip():
+    # A smooth gradient survives JPEG compression with little error
+    frame = np.dstack([np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (48, 1))] * 3)
+    decoded, _ = decode_video_frame(encode_video_frame(frame, codec=VideoCodec.JPEG, quality=95))
+    assert decoded.shape == frame.shape
+    assert np.abs(decoded.astype(int) - frame.astype(int)).mean() < 2
+
+
+@pytest.mark.parametrize("count", [0, 3])
+def test_detections_round_trip(count):
+    rng = np.random.default_rng(count)
+    detections = Detections(rng.random((count, 4)), rng.integers(1, 90, count), rng.random(count), frame_seq=7)
+    decoded, wall_ns = decode_detections([encode_detections(detections, wall_ns=456)])
+    assert wall_ns == 456
+    assert decoded.frame_seq == 7
+    assert len(decoded) == count
+    assert decoded.boxes.shape == (count, 4)
+    np.testing.assert_array_equal(decoded.boxes, detections.boxes)
+    np.testing.assert_array_equal(decoded.class_ids, detections.class_ids)
+    np.testing.assert_array_equal(decoded.scores, detections.scores)
+
+
+def test_wrong_version_is_rejected():
+    servo_message = bytearray(encode_servo_vals(ServoVals()))
+    detections_message = bytearray(encode_detections(Detections()))
+    video_frames = encode_video_frame(np.zeros((2, 2), np.uint8))
+    video_header = bytearray(video_frames[0])
+    for message in (servo_message, detections_message, video_header):
+        message[0] = WIRE_VERSION + 1
+
+    with pytest.raises(ValueError, match="wire version"):
+        decode_servo_vals([bytes(servo_message)])
+    with pytest.raises(ValueError, match="wire version"):
+        decode_detections([bytes(detections_message)])
+    with pytest.raises(ValueError, match="wire version"):
+        decode_video_frame([bytes(video_header), video_frames[1]])
+
+
+def test_truncated_messages_are_rejected():
+    with pytest.raises(ValueError):
+        decode_servo_vals([encode_servo_vals(ServoVals())[:-1]])
+    with pytest.raises(ValueError):
+        decode_detections([encode_detections(Detections(np.zeros((1, 4)), [1], [0.5]))[:-1]])
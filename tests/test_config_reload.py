@@ -0,0 +1,149 @@
+import threading
+import time
+
+from rushb.modulemanager.module_manager import *
+
+
+def test_diff_modules_matches_by_class_and_occurrence():
+    old = [{"module_class": "ServoWriter"}, {"module_class": "ServoReader"}, {"module_class": "ServoReader"}]
+    new = [{"module_class": "ServoReader", "rate_hz": 10}, {"module_class": "SyntheticVideoCapture"}]
+    matched, added, removed = diff_modules(old, new)
+
+    assert matched == {1: new[0]}
+    assert added == [new[1]]
+    assert removed == [0, 2]
+
+
+def test_changed_keys_include_added_and_removed_keys():
+    assert changed_keys({"a": 1, "b": 2}, {"a": 1, "b": 3, "c": 4}) == {"b", "c"}
+    assert changed_keys({"a": 1}, {}) == {"a"}
+
+
+def test_parameter_changes():
+    module = create_module(module_class="SyntheticVideoCapture")
+    old = {"module_class": "SyntheticVideoCapture", "active": True, "speed": 4, "width": 32}
+
+    assert ModuleManger.parameter_changes(module, old, {**old, "speed": 2, "rate_hz": 5}) == {"speed": 2}
+    assert ModuleManger.parameter_changes(module, old, dict(old)) == {}
+    # Structural keys and removed parameters, which have no value to configure, need a new module
+    assert ModuleManger.parameter_changes(module, old, {**old, "width": 64}) is None
+    without_speed = {key: value for key, value in old.items() if key != "speed"}
+    assert ModuleManger.parameter_changes(module, old, without_speed) is None
+
+
+def manager_with(module_configs: list[dict], scheduler_type: str = "SEQUENTIAL") -> ModuleManger:
+    """Manager running the modules of the configs without a connection"""
+    manager = ModuleManger("unused.yml")
+    manager.config = {"Modules": module_configs}
+    manager.scheduler = ModuleScheduler(scheduler_type=scheduler_type)
+    manager.modules = [create_module(**module_config) for module_config in module_configs]
+    manager.module_configs = list(module_configs)
+    for module in manager.modules:
+        module.init()
+    manager.refresh_modules()
+    return manager
+
+
+def configs(*modules: dict) -> dict:
+    return {"Modules": [{"active": True, **module} for module in modules]}
+
+
+WRITER = {"module_class": "ServoWriter", "left_val": 1, "right_val": 2, "top_val": 3}
+VIDEO = {"module_class": "SyntheticVideoCapture", "width": 32, "height": 24}
+
+
+def test_apply_parameter_change_keeps_the_module():
+    manager = manager_with(configs(WRITER, VIDEO)["Modules"])
+    writer, video = manager.modules
+
+    manager.apply_config(configs({**WRITER, "left_val": 50}, {**VIDEO, "speed": 1}))
+
+    assert manager.reloads == []
+    assert manager.modules == [writer, video]
+    assert writer.left_val == 50 and video.speed == 1
+    assert manager.module_configs[0]["left_val"] == 50
+
+
+def test_apply_structural_change_initializes_the_module_again():
+    manager = manager_with(configs(WRITER, VIDEO)["Modules"])
+    writer, video = manager.modules
+
+    manager.apply_config(configs(WRITER, {**VIDEO, "width": 64}))
+    # The other modules keep stepping while the module is swapped
+    assert manager.modules == [writer]
+    manager.finish_reloads(wait=True)
+
+    assert manager.modules[0] is writer
+    assert manager.modules[1] is not video
+    assert manager.modules[1].image.shape == (24, 64, 3)
+    assert video.image is None
+    assert manager.initialized == [0, 1]
+
+
+def test_apply_added_and_removed_modules():
+    manager = manager_with(configs(WRITER)["Modules"])
+    writer = manager.modules[0]
+
+    manager.apply_config(configs(VIDEO, {"module_class": "ServoReader", "optional": True}))
+    manager.finish_reloads(wait=True)
+
+    assert [type(module).__name__ for module in manager.modules] == ["SyntheticVideoCapture", "ServoReader"]
+    assert writer not in manager.modules
+    assert manager.essential_modules == manager.modules[:1]
+
+
+def test_failed_reload_falls_back_to_the_previous_config():
+    manager = manager_with(configs(VIDEO)["Modules"])
+
+    # A negative size cannot be generated, the module keeps running with the old config
+    manager.apply_config(configs({**VIDEO, "width": -1}))
+    manager.finish_reloads(wait=True)
+
+    assert manager.module_configs == [configs(VIDEO)["Modules"][0]]
+    assert manager.modules[0].image.shape == (24, 32, 3)
+
+
+class RecordingModule(RBModule):
+    """Steps slowly and records the thread the module is configured on"""
+    parameters = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.in_step = False
+        self.configured_in_step = None
+        self.configured_on = None
+
+    def init(self) -> None:
+        pass
+
+    def step(self, shared_mem: SharedMem) -> SharedMem:
+        self.in_step = True
+        time.sleep(0.01)
+        self.in_step = False
+        return shared_mem
+
+    def configure(self, **changes) -> None:
+        self.configured_in_step = self.in_step
+        self.configured_on = threading.current_thread()
+        super().configure(**changes)
+
+    def deinit(self) -> None:
+        pass
+
+
+def test_worker_configures_between_steps():
+    module = RecordingModule()
+    stop_event = threading.Event()
+    worker = ModuleWorker(module, SharedMem(), 0, stop_event)
+    worker.start()
+    try:
+        time.sleep(0.02)
+        worker.configure(value=5)
+        time.sleep(0.05)
+    finally:
+        stop_event.set()
+        worker.join()
+
+    assert module.value == 5
+    assert module.configured_on is worker
+    assert module.configured_in_step is False
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import os
+import pathlib
+import tarfile
+
+import pytest
+
+from rushb.vision.model_store import ModelStore, file_sha256
+
+
+def write_archive(path: pathlib.Path, files: dict) -> str:
+    """Write a tar.gz archive with the given file contents and return its SHA-256"""
+    with tarfile.open(path, "w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+@pytest.fixture
+def model(tmp_path):
+    archive = tmp_path / "served" / "model.tar.gz"
+    archive.parent.mkdir()
+    sha256 = write_archive(archive, {"model/saved_model/saved_model.pb": b"v1"})
+    return archive, archive.as_uri(), sha256
+
+
+def test_fetch_downloads_once(tmp_path, model):
+    archive, url, sha256 = model
+    store = ModelStore(str(tmp_path / "cache"))
+    archive_path = store.fetch(url, sha256)
+    assert file_sha256(archive_path) == sha256
+    assert store.read_manifest(url)["sha256"] == sha256
+
+    # Served from the cache even when the source is gone
+    archive.unlink()
+    assert store.fetch(url, sha256) == archive_path
+
+
+def test_fetch_rejects_a_wrong_sha256(tmp_path, model):
+    _, url, _ = model
+    store = ModelStore(str(tmp_path / "cache"))
+    with pytest.raises(ValueError, match="SHA-256"):
+        store.fetch(url, "0" * 64)
+    assert not os.path.exists(os.path.join(store.entry_dir(url), "model.tar.gz"))
+
+
+def test_fetch_downloads_a_corrupted_archive_again(tmp_path, model):
+    _, url, sha256 = model
+    store = ModelStore(str(tmp_path / "cache"))
+    archive_path = store.fetch(url)
+    with open(archive_path, "r+b") as f:
+        f.truncate(10)
+
+    assert store.fetch(url) == archive_path
+    assert file_sha256(archive_path) == sha256
+
+
+def test_offline_store_never_downloads(tmp_path, model):
+    _, url, sha256 = model
+    with pytest.raises(FileNotFoundError):
+        ModelStore(str(tmp_path / "cache"), offline=True).fetch(url)
+
+    ModelStore(str(tmp_path / "cache")).fetch(url)
+    assert file_sha256(ModelStore(str(tmp_path / "cache"), offline=True).fetch(url)) == sha256
+
+
+def test_extract_follows_the_archive(tmp_path, model):
+    archive, url, _ = model
+    store = ModelStore(str(tmp_path / "cache"))
+    extract_dir = store.extract(url, store.fetch(url))
+    model_file = pathlib.Path(extract_dir, "model", "saved_model", "saved_model.pb")
+    assert model_file.read_bytes() == b"v1"
+
+    # A cached optimized form belongs to the previous archive
+    optimized_path = pathlib.Path(store.optimized_path(url, "model.tflite"))
+    optimized_path.parent.mkdir()
+    optimized_path.write_bytes(b"tflite")
+
+    # Without a manifest the archive is downloaded again, the new archive is extracted
+    write_archive(archive, {"model/saved_model/saved_model.pb": b"v2"})
+    os.remove(os.path.join(store.entry_dir(url), "manifest.json"))
+    assert store.extract(url, store.fetch(url)) == extract_dir
+    assert model_file.read_bytes() == b"v2"
+    assert not optimized_path.exists()
+
+    # An unchanged archive is not extracted again
+    model_file.write_bytes(b"kept")
+    store.extract(url, store.fetch(url))
+    assert model_file.read_bytes() == b"kept"
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+
+from rushb.sharedmem.process_shared_mem import ProcessSharedMem
+
+
+@pytest.fixture
+def shared_mem():
+    shared_mem = ProcessSharedMem(name=f"rushb_test_{os.getpid()}", frame_shape=(4, 4, 3), frame_slots=2)
+    yield shared_mem
+    shared_mem.close()
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full((4, 4, 3), value, np.uint8)
+
+
+def test_read_frames_do_not_change(shared_mem):
+    reader = ProcessSharedMem(**shared_mem.attach_args())
+    try:
+        shared_mem.publish("video_frame", frame(1))
+        first = reader.read("video_frame")
+        for value in range(2, 6):
+            shared_mem.publish("video_frame", frame(value))
+
+        assert first.seq == 1
+        np.testing.assert_array_equal(first.value, frame(1))
+        newest = reader.read("video_frame")
+        assert newest.seq == 5 == reader.video_frame_seq
+        np.testing.assert_array_equal(newest.value, frame(5))
+    finally:
+        reader.close()
+
+
+def test_reused_slot_is_not_returned(shared_mem):
+    for value in range(1, 4):
+        shared_mem.publish("video_frame", frame(value))
+
+    # With 2 slots frame 1 shares its slot with frame 3
+    assert shared_mem.frame_ring.frame(1) is None
+    np.testing.assert_array_equal(shared_mem.frame_ring.frame(3), frame(3))
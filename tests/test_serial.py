@@ -0,0 +1,74 @@
+import time
+
+from rushb.modules.collection.serial import *
+
+
+def telemetry_frame(frame_type: int, payload: bytes) -> bytes:
+    body = TELEMETRY_HEADER.pack(frame_type, len(payload)) + payload
+    return TELEMETRY_START + body + bytes([sum(body) & 0xFF])
+
+
+def feed_bytewise(reader: SerialReaderThread, data: bytes) -> None:
+    for i in range(len(data)):
+        reader.feed(data[i:i + 1])
+
+
+def test_frames_fed_one_byte_at_a_time():
+    reader = SerialReaderThread(None)
+    feed_bytewise(reader, telemetry_frame(TELEMETRY_SERVOS, TELEMETRY_PAYLOADS[TELEMETRY_SERVOS].pack(9000, 4550, 0)) +
+                  telemetry_frame(TELEMETRY_BATTERY, TELEMETRY_PAYLOADS[TELEMETRY_BATTERY].pack(7400)))
+
+    assert reader.telemetry.servo_positions == [90.0, 45.5, 0.0]
+    assert reader.telemetry.battery_voltage == 7.4
+    assert reader.telemetry.frames == 2
+    assert reader.telemetry.errors == 0
+    assert len(reader.buffer) == 0
+
+
+def test_resynchronizes_after_noise():
+    reader = SerialReaderThread(None)
+    # Noise including a lone start byte and a start sequence that claims a long payload
+    noise = b"\x00\xaa\x13" + TELEMETRY_START + b"\x02\x20" + b"\x11" * 40
+    feed_bytewise(reader, noise + telemetry_frame(TELEMETRY_BATTERY, TELEMETRY_PAYLOADS[TELEMETRY_BATTERY].pack(5000)))
+
+    assert reader.telemetry.battery_voltage == 5.0
+    assert reader.telemetry.frames == 1
+
+
+def test_bad_checksum_is_rejected():
+    reader = SerialReaderThread(None)
+    corrupt = bytearray(telemetry_frame(TELEMETRY_BATTERY, TELEMETRY_PAYLOADS[TELEMETRY_BATTERY].pack(7400)))
+    corrupt[-1] ^= 0xFF
+    feed_bytewise(reader, bytes(corrupt) +
+                  telemetry_frame(TELEMETRY_BATTERY, TELEMETRY_PAYLOADS[TELEMETRY_BATTERY].pack(6000)))
+
+    assert reader.telemetry.battery_voltage == 6.0
+    assert reader.telemetry.frames == 1
+    assert reader.telemetry.errors == 1
+
+
+def test_payload_of_the_wrong_size_is_rejected():
+    reader = SerialReaderThread(None)
+    reader.feed(telemetry_frame(TELEMETRY_BATTERY, b"\x01\x02\x03"))
+
+    assert reader.telemetry.battery_voltage is None
+    assert reader.telemetry.errors == 1
+
+
+def test_acknowledgement_measures_the_round_trip():
+    sent_times = {7: time.monotonic() - 0.05}
+    reader = SerialReaderThread(None, sent_times)
+    reader.feed(telemetry_frame(TELEMETRY_ACK, TELEMETRY_PAYLOADS[TELEMETRY_ACK].pack(7)))
+
+    assert reader.telemetry.last_ack == 7
+    assert reader.telemetry.rtt >= 0.05
+    assert 7 not in sent_times
+
+
+def test_servo_frame_checksum():
+    frame = SerialWriter.pack_servo_vals(ServoVals([90, 45.5, 200]), seq=3)
+    payload = frame[len(BINARY_START):-1]
+
+    assert frame.startswith(BINARY_START)
+    assert BINARY_PAYLOAD.unpack(payload) == (3, 9000, 4550, 18000)
+    assert frame[-1] == sum(payload) & 0xFF
@@ -0,0 +1,73 @@
+import numpy as np
+
+from rushb.sharedmem.shared_mem_log import *
+
+
+def write_log(path, entries, **kwargs):
+    writer = LogWriter(str(path), **kwargs)
+    for tick, name, value, timestamp in entries:
+        writer.write(tick, name, value, timestamp)
+    writer.close()
+
+
+def test_round_trip(tmp_path):
+    frame = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+    detections = Detections([[0.1, 0.2, 0.3, 0.4]], [3], [0.9], frame_seq=5)
+    write_log(tmp_path / "log", [(1, "servo_vals", ServoVals([10, 20.5, 30]), 100.0),
+                                 (1, "video_frame", frame, 100.01),
+                                 (2, "detections", detections, 100.05)])
+
+    reader = LogReader(str(tmp_path / "log"))
+    try:
+        assert len(reader) == 3
+        assert reader.duration == np.float64(100.05) - 100.0
+        assert reader.index["tick"].tolist() == [1, 1, 2]
+
+        name, servo_vals = reader.record(0)
+        assert name == "servo_vals" and servo_vals.values == [10, 20.5, 30]
+        name, recorded_frame = reader.record(1)
+        assert name == "video_frame"
+        np.testing.assert_array_equal(recorded_frame, frame)
+        name, recorded_detections = reader.record(2)
+        assert name == "detections" and recorded_detections.frame_seq == 5
+        np.testing.assert_array_equal(recorded_detections.class_ids, [3])
+        del recorded_frame
+    finally:
+        reader.close()
+
+
+def test_seek_with_values_published_out_of_order(tmp_path):
+    # The frame was captured before the servo values it is written after
+    frame = np.zeros((2, 2, 3), np.uint8)
+    write_log(tmp_path / "log", [(1, "servo_vals", ServoVals([1, 1, 1]), 10.0),
+                                 (2, "servo_vals", ServoVals([2, 2, 2]), 10.2),
+                                 (2, "video_frame", frame, 10.1),
+                                 (3, "servo_vals", ServoVals([3, 3, 3]), 10.3)])
+
+    reader = LogReader(str(tmp_path / "log"))
+    try:
+        assert np.all(np.diff(reader.times) >= 0)
+        # Nothing is replayed early, the frame follows the values it was written after
+        assert reader.search(0.15) == 1
+        assert reader.search(0.25) == 3
+        assert reader.search(0.35) == 4
+        assert reader.latest(0, reader.search(0.25)) == [1, 2]
+    finally:
+        reader.close()
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = tmp_path / "log"
+    write_log(path, [(tick, "servo_vals", ServoVals([tick] * 3), float(tick)) for tick in range(3)])
+    # The last value and half an index entry did not make it to disk
+    with open(path, "r+b") as data_file:
+        data_file.truncate(os.path.getsize(path) - 1)
+    with open(index_path(str(path)), "ab") as index_file:
+        index_file.write(b"\x00" * (INDEX_DTYPE.itemsize // 2))
+
+    reader = LogReader(str(path))
+    try:
+        assert len(reader) == 2
+        assert reader.record(1)[1].values == [1, 1, 1]
+    finally:
+        reader.close()